@@ -0,0 +1,147 @@
+"""
+Benchmark of database queries. It runs the like lookup of `/random`
+and like toggles against a temporary database by a new connection per
+query (as before the connection manager) and by the kept connections of
+`bot.db`, and reports median and 95th percentile latency per query.
+Then it sends a storm of concurrent likes by the executor of `bot.db`
+with a commit per query and with group commit, and reports writes per
+second and latency.
+
+    python -m bench.db --tunes 10000 --queries 2000 --storm 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from bot import db
+
+IS_LIKED = "SELECT * FROM likes WHERE match_id = ? AND user_id = ?;"
+LIKE = "INSERT OR IGNORE INTO likes (match_id, user_id) VALUES (?, ?);"
+UNLIKE = "DELETE FROM likes WHERE match_id = ? AND user_id = ?;"
+
+
+def connect_per_query(db_file: str, query: str, args: tuple) -> list:
+    """Sends the query by a new connection, like `send_query` did before."""
+
+    with sqlite3.connect(db_file, check_same_thread=False) as conn:
+        conn.execute("pragma journal_mode=wal;")
+        cursor = conn.execute(query, args)
+        conn.commit()
+        rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def kept_connections(_db_file: str, query: str, args: tuple) -> list:
+    """Sends the query by connections of `bot.db`."""
+
+    if query.startswith("SELECT"):
+        return db.read_query(query, args).fetchall()
+    result = db.write_queries([(query, args)])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result.fetchall()
+
+
+def seed(tunes: int, users: int) -> None:
+    """Fills the database with tunes and their likes."""
+
+    with db.connections.writer() as conn:
+        conn.executemany(
+            "INSERT INTO match (original, slowed, user_id) VALUES (?, ?, ?);",
+            ((f"original-{i}", f"slowed-{i}", i % users) for i in range(tunes)),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO likes (match_id, user_id) VALUES (?, ?);",
+            ((i % tunes + 1, i % users) for i in range(tunes * 3)),
+        )
+        conn.commit()
+
+
+def run(send, db_file: str, query: str, args: argparse.Namespace) -> dict:
+    """
+    Sends the query `args.queries` times with random arguments
+    and returns latency in microseconds.
+    """
+
+    rng = random.Random(0)
+    latencies = []
+    for _ in range(args.queries):
+        params = (rng.randint(1, args.tunes), rng.randrange(args.users))
+        start = time.perf_counter()
+        send(db_file, query, params)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    values = np.array(latencies)
+    return {
+        "median_us": round(float(np.median(values)), 1),
+        "p95_us": round(float(np.percentile(values, 95)), 1),
+    }
+
+
+async def storm(executor: db.Executor, likes: int, tunes: int, users: int) -> dict:
+    """Sends concurrent likes of popular tunes and returns throughput and latency."""
+
+    rng = random.Random(1)
+    latencies = []
+
+    async def like(args: tuple) -> None:
+        start = time.perf_counter()
+        await executor.write(LIKE, args)
+        latencies.append((time.perf_counter() - start) * 1e3)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(like((rng.randint(1, min(tunes, 10)), users + i)) for i in range(likes))
+    )
+    wall = time.perf_counter() - start
+    executor.close()
+
+    values = np.array(latencies)
+    return {
+        "writes_per_second": round(likes / wall),
+        "median_ms": round(float(np.median(values)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+    }
+
+
+def main() -> None:
+    """Benchmark runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tunes", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--storm", type=int, default=1000, help="Count of concurrent likes")
+    parser.add_argument("--delay", type=float, default=5, help="DB_COMMIT_DELAY")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "db.sqlite")
+        db.connections = db.Connections(db_file)
+        db.execute_script("./schema.sql")
+        seed(args.tunes, args.users)
+
+        for name, query in (("is_liked", IS_LIKED), ("like", LIKE), ("unlike", UNLIKE)):
+            for mode, send in (("connect", connect_per_query), ("kept", kept_connections)):
+                result = run(send, db_file, query, args)
+                print(json.dumps({"query": name, "mode": mode, **result}))
+
+        for mode, max_batch in (("commit_per_query", 1), ("group_commit", db.MAX_BATCH)):
+            executor = db.Executor(delay=args.delay / 1000, max_batch=max_batch)
+            result = asyncio.run(storm(executor, args.storm, args.tunes, args.users))
+            print(json.dumps({"storm": args.storm, "mode": mode, **result}))
+
+        db.connections.close()
+
+
+if __name__ == "__main__":
+    main()
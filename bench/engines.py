@@ -0,0 +1,91 @@
+"""
+Benchmark of audio engines. It renders synthetic MP3 file by every
+available engine and reports wall-clock and CPU time per minute of audio.
+
+    python -m bench.engines --duration 60 --runs 3
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench.stats import cpu_time
+from bot.utils.u_engine import ENGINES, Target, get_engine
+from bot.utils.u_presets import DEFAULT_PRESET, get_preset
+
+
+def make_fixture(
+    path: str, duration: float, sample_rate: int = 44100, bitrate: int = 320
+) -> None:
+    """Writes stereo CBR MP3 file with chords and noise of the given duration."""
+
+    try:
+        import soundfile  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise SystemExit("Benchmarks require soundfile: pip install soundfile") from error
+
+    time_ = np.arange(int(duration * sample_rate)) / sample_rate
+    chord = sum(np.sin(2 * np.pi * freq * time_) for freq in (220, 277.2, 329.6))
+    noise = np.random.default_rng(0).standard_normal((len(time_), 2)) * 0.05
+    samples = (chord[:, None] * 0.2 + noise).astype(np.float32)
+    soundfile.write(
+        path,
+        samples,
+        sample_rate,
+        format="MP3",
+        compression_level=1 - (min(max(bitrate, 32), 320) - 32) / 288,
+        bitrate_mode="CONSTANT",
+    )
+
+
+def bench(engine_name: str, source: str, duration: float, runs: int) -> dict:
+    """Renders the source `runs` times and returns timings per minute of audio."""
+
+    engine = get_engine(engine_name)
+    output = f"{source[:-4]}_{engine_name}.mp3"
+    walls, cpus = [], []
+
+    for _ in range(runs):
+        wall, cpu = time.perf_counter(), cpu_time()
+        engine.render(source, Target(output), get_preset(DEFAULT_PRESET))
+        walls.append(time.perf_counter() - wall)
+        cpus.append(cpu_time() - cpu)
+
+    minutes = duration / 60
+    return {
+        "engine": engine_name,
+        "duration": duration,
+        "runs": runs,
+        "wall_per_minute": min(walls) / minutes,
+        "cpu_per_minute": min(cpus) / minutes,
+        "output_bytes": os.path.getsize(output),
+    }
+
+
+def main():
+    """Benchmark runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of audio")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--engines", nargs="*", default=list(ENGINES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "fixture.mp3")
+        make_fixture(source, args.duration)
+
+        for name in args.engines:
+            try:
+                result = bench(name, source, args.duration, args.runs)
+            except Exception as error:  # pylint: disable=broad-except
+                result = {"engine": name, "error": str(error)}
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Benchmark of the audio pipeline by stages. It generates synthetic MP3
+fixtures of several lengths and bitrates and runs download, tagging,
+effects and upload stages for each of them offline. Telegram is replaced
+by a local HTTP server. Reports wall time, CPU time, peak RSS and bytes
+written per stage as JSON lines, so runs before and after a change
+can be compared.
+
+    python -m bench.pipeline --lengths 30 180 600 --bitrates 128 320 --output results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+
+import aiohttp
+from aiohttp import web
+from mutagen import id3
+
+from bench.engines import make_fixture
+from bench.stats import Stage
+from bot.config import config
+from bot.utils import u_audio, u_profile
+from bot.utils.u_brand import brand
+from bot.utils.u_engine import Target
+from bot.utils.u_presets import DEFAULT_PRESET, get_preset
+
+CHUNK_SIZE = 65536
+
+
+def add_tags(path: str, cover: int = 100) -> None:
+    """Adds ID3 tag with text frames and cover of `cover` KB to the fixture."""
+
+    tags = id3.ID3()
+    tags.add(id3.TIT2(text="Title"))
+    tags.add(id3.TPE1(text="Artist"))
+    tags.add(id3.APIC(mime="image/jpeg", desc="Cover", data=os.urandom(cover * 1024)))
+    tags.save(path, v2_version=3)
+
+
+def serve(directory: str, ports: multiprocessing.Queue) -> None:
+    """
+    Runs local stand-in for Telegram servers. It serves files from the
+    `directory` and accepts uploads. It runs in a separate process, so its
+    I/O is not counted in the stages.
+    """
+
+    async def receive(request: web.Request) -> web.Response:
+        size = 0
+        async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+            size += len(chunk)
+        return web.json_response({"ok": True, "size": size})
+
+    app = web.Application(client_max_size=0)
+    app.router.add_static("/file/", directory)
+    app.router.add_post("/upload", receive)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        ports.put(sock.getsockname()[1])
+        web.run_app(app, sock=sock, print=None, access_log=None)
+
+
+def start_server(directory: str) -> tuple[multiprocessing.Process, str]:
+    """Starts the stand-in server process. Returns the process and base URL."""
+
+    ports: multiprocessing.Queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(directory, ports), daemon=True)
+    process.start()
+
+    return process, f"http://127.0.0.1:{ports.get(timeout=10)}"
+
+
+async def download(session: aiohttp.ClientSession, url: str, path: str) -> None:
+    """Downloads file by chunks like `Downloadable.download`."""
+
+    async with session.get(url, raise_for_status=True) as response:
+        with open(path, "wb") as file:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                file.write(chunk)
+
+
+async def upload(session: aiohttp.ClientSession, url: str, path: str) -> None:
+    """Uploads file as multipart form like `sendAudio`."""
+
+    with open(path, "rb") as file:
+        form = aiohttp.FormData()
+        form.add_field("audio", file, filename=os.path.basename(path))
+        async with session.post(url, data=form, raise_for_status=True) as response:
+            await response.read()
+
+
+# pylint: disable-next=too-many-locals
+async def bench(
+    session: aiohttp.ClientSession, base_url: str, tmp: str, fixture: str, length: float
+) -> list:
+    """Runs stages of the pipeline for the fixture and returns their results."""
+
+    preset = get_preset(DEFAULT_PRESET)
+    downloaded = os.path.join(tmp, "downloaded.mp3")
+    slowed = os.path.join(tmp, "downloaded_slow.mp3")
+    bitrate = u_profile.get_bitrate(
+        u_profile.get_source_bitrate(os.path.getsize(fixture), length), length, preset.speed
+    )
+
+    with Stage("download") as downloading:
+        await download(session, f"{base_url}/file/{os.path.basename(fixture)}", downloaded)
+
+    with Stage("tagging") as tagging:
+        tags = await u_audio.render_id3_tags(downloaded)
+
+    # Effects run in-process to measure them without the render pool
+    with Stage("effects") as effects:
+        u_audio.render(downloaded, Target(slowed, tags, bitrate), preset.name)
+
+    with Stage("upload") as uploading:
+        await upload(session, f"{base_url}/upload", slowed)
+
+    results = []
+    for stage in (downloading, tagging, effects, uploading):
+        stage.result.update(
+            fixture=os.path.basename(fixture),
+            length=length,
+            source_bytes=os.path.getsize(fixture),
+            output_bytes=os.path.getsize(slowed),
+            bitrate=bitrate,
+        )
+        results.append(stage.result)
+
+    for path in (downloaded, slowed):
+        os.remove(path)
+
+    return results
+
+
+def get_revision() -> str | None:
+    """Returns current git revision of the sources if any."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> list:
+    """Generates fixtures and runs the pipeline for each of them."""
+
+    brand.load("slow_tunes_bot")
+    meta = {
+        "revision": get_revision(),
+        "engine": config.AUDIO_ENGINE,
+        "python": platform.python_version(),
+    }
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = os.path.join(tmp, "fixtures")
+        os.makedirs(fixtures)
+        server, base_url = start_server(fixtures)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                for length in args.lengths:
+                    for bitrate in args.bitrates:
+                        fixture = os.path.join(fixtures, f"{length:g}s_{bitrate}k.mp3")
+                        make_fixture(fixture, length, bitrate=bitrate)
+                        add_tags(fixture)
+
+                        for run_ in range(args.runs):
+                            for result in await bench(session, base_url, tmp, fixture, length):
+                                result.update(meta, run=run_)
+                                print(json.dumps(result), flush=True)
+                                results.append(result)
+        finally:
+            server.terminate()
+            server.join()
+
+    return results
+
+
+def main():
+    """Benchmark runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lengths", type=float, nargs="*", default=[30, 180, 600])
+    parser.add_argument("--bitrates", type=int, nargs="*", default=[128, 320])
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--output", help="also write results to JSON lines file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Simulation of the queue under mixed load. Users send songs and some
+of them send long mixes; jobs are run by render workers in order of
+arrival (FIFO) and by the fair scheduler of the queue. It reports median
+and 95th percentile of waits of all, short and long jobs.
+
+    python -m bench.scheduler --workers 2 --jobs 2000 --load 0.9
+"""
+
+import argparse
+import heapq
+import json
+import random
+
+import numpy as np
+
+from bot.utils.u_queue import DEFAULT_LANE, fair_score
+
+LONG = 600  # Audio longer than this is a mix, in seconds
+
+
+def make_jobs(count: int, users: int, heavy: float, rate: float, seed: int) -> list:
+    """Returns list of `(arrival, user, duration)` of jobs with Poisson arrivals."""
+
+    rng = random.Random(seed)
+    heavy_users = max(int(users * heavy), 1)
+    jobs = []
+    arrival = 0.0
+    for _ in range(count):
+        arrival += rng.expovariate(rate)
+        user = rng.randrange(users)
+        if user < heavy_users and rng.random() < 0.5:
+            duration = rng.uniform(15 * 60, 25 * 60)
+        else:
+            duration = rng.uniform(2 * 60, 5 * 60)
+        jobs.append((arrival, user, duration))
+    return jobs
+
+
+def simulate(jobs: list, workers: int, ratio: float, weight: float | None) -> list:
+    """
+    Runs jobs by `workers` and returns list of `(wait, duration)`. Jobs are
+    ordered by arrival if `weight` is None, otherwise by `fair_score`.
+    """
+
+    pending: list = []
+    finish: dict[int, float] = {}
+    free = [0.0] * workers
+    waits = []
+    position = 0
+
+    def admit(until: float) -> None:
+        nonlocal position
+        while position < len(jobs) and jobs[position][0] <= until:
+            arrival, user, duration = jobs[position]
+            if weight is None:
+                score = arrival
+            else:
+                score, finish[user] = fair_score(
+                    arrival, finish.get(user, 0), DEFAULT_LANE, duration * weight
+                )
+            heapq.heappush(pending, (score, position))
+            position += 1
+
+    while position < len(jobs) or pending:
+        now = heapq.heappop(free)
+        admit(now)
+        if not pending:
+            now = jobs[position][0]
+            admit(now)
+
+        _, index = heapq.heappop(pending)
+        arrival, _, duration = jobs[index]
+        waits.append((now - arrival, duration))
+        heapq.heappush(free, now + duration * ratio)
+
+    return waits
+
+
+def summary(waits: list) -> dict:
+    """Returns median and 95th percentile of waits in seconds."""
+
+    if not waits:
+        return {}
+    values = np.array(waits)
+    return {
+        "count": len(values),
+        "median": round(float(np.median(values)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def main() -> None:
+    """Benchmark runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--heavy", type=float, default=0.1, help="Share of users with mixes")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--load", type=float, default=0.9, help="Utilization of workers")
+    parser.add_argument("--ratio", type=float, default=0.1, help="Render seconds per audio second")
+    parser.add_argument("--weight", type=float, default=0.2, help="SCHEDULER_WEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Mean duration of jobs to get arrival rate for the load
+    sample = make_jobs(10000, args.users, args.heavy, 1.0, args.seed + 1)
+    service = np.mean([duration for *_, duration in sample]) * args.ratio
+    jobs = make_jobs(
+        args.jobs, args.users, args.heavy, args.load * args.workers / service, args.seed
+    )
+
+    for policy, weight in (("fifo", None), ("fair", args.weight)):
+        waits = simulate(jobs, args.workers, args.ratio, weight)
+        print(
+            json.dumps(
+                {
+                    "policy": policy,
+                    "all": summary([wait for wait, _ in waits]),
+                    "short": summary([wait for wait, duration in waits if duration < LONG]),
+                    "long": summary([wait for wait, duration in waits if duration >= LONG]),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
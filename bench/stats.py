@@ -0,0 +1,84 @@
+"""Resource usage measurements shared by benchmarks (Linux)."""
+
+import resource
+import time
+
+
+def cpu_time() -> float:
+    """Returns CPU time of the process and its children."""
+
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(item.ru_utime + item.ru_stime for item in usage)
+
+
+def written_bytes() -> int | None:
+    """Returns count of bytes written by the process."""
+
+    try:
+        with open("/proc/self/io", encoding="ascii") as stats:
+            for line in stats:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> None:
+    """Resets peak resident set size of the process (Linux 4.0+)."""
+
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as refs:
+            refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    """
+    Returns peak resident set size in bytes of the process since the last
+    reset or of the biggest waited child process (e.g. sox).
+    """
+
+    peak = 0
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return max(peak, children)
+
+
+class Stage:
+    """Context manager which measures resources used by the stage."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.result: dict = {"stage": name}
+        self.__wall = 0.0
+        self.__cpu = 0.0
+        self.__written: int | None = None
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.__wall = time.perf_counter()
+        self.__cpu = cpu_time()
+        self.__written = written_bytes()
+        return self
+
+    def __exit__(self, *_exc):
+        written = written_bytes()
+        self.result.update(
+            wall=time.perf_counter() - self.__wall,
+            cpu=cpu_time() - self.__cpu,
+            peak_rss=peak_rss(),
+            bytes_written=(
+                written - self.__written
+                if written is not None and self.__written is not None
+                else None
+            ),
+        )
@@ -0,0 +1,111 @@
+"""
+Microbenchmark of ID3 tagging of slowed audio. It compares tagging of
+the encoded file after the fact (mutagen rewrites the whole file to insert
+the tag) with the tag rendered up front and written before audio data.
+Reports bytes written per job.
+
+    python -m bench.tagging --size 10 --cover 300 --runs 5
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+
+from mutagen import id3
+
+from bench.stats import written_bytes
+from bot.utils.u_audio import REPLACED_FRAMES
+from bot.utils.u_brand import brand
+from bot.utils.u_tagging import Tagging
+
+
+def make_fixture(tmp: str, size: int, cover: int) -> tuple[str, bytes]:
+    """
+    Writes source file with text frames and embedded cover of `cover` KB,
+    and the album art of the Bot. Returns path to the source and
+    `size` MB of encoded audio.
+    """
+
+    source = os.path.join(tmp, "source.mp3")
+    tags = id3.ID3()
+    tags.add(id3.TIT2(text="Title"))
+    tags.add(id3.TPE1(text="Artist"))
+    tags.add(id3.APIC(mime="image/jpeg", desc="Cover", data=os.urandom(cover * 1024)))
+    tags.save(source, v2_version=3)
+
+    album_art = os.path.join(tmp, "thumb.jpg")
+    with open(album_art, "wb") as image:
+        image.write(os.urandom(64 * 1024))
+    brand.load("slow_tunes_bot", album_art=album_art)
+
+    return source, os.urandom(size * 1024 * 1024)
+
+
+async def tag_after(source: str, output: str, audio: bytes) -> None:
+    """Encoder writes the file, then tags are saved on it."""
+
+    with open(output, "wb") as encoded:
+        encoded.write(audio)
+
+    tags = Tagging(output)
+    tags.copy_from(source)
+    await tags.add_brand()
+    tags.save()
+
+
+async def tag_up_front(source: str, output: str, audio: bytes) -> None:
+    """Tags are rendered first, encoder writes audio after them."""
+
+    tags = Tagging(io.BytesIO())
+    tags.copy_from(source, skip=REPLACED_FRAMES)
+    await tags.add_brand()
+
+    with open(output, "wb") as encoded:
+        encoded.write(tags.to_bytes())
+        encoded.write(audio)
+
+
+def bench(job, source: str, audio: bytes, runs: int) -> dict:
+    """Runs the tagging job `runs` times and returns bytes written per job."""
+
+    output = f"{source[:-4]}_{job.__name__}.mp3"
+    walls, written = [], []
+
+    for _ in range(runs):
+        wall, before = time.perf_counter(), written_bytes()
+        asyncio.run(job(source, output, audio))
+        walls.append(time.perf_counter() - wall)
+        if before is not None:
+            written.append(written_bytes() - before)  # type: ignore
+
+    return {
+        "job": job.__name__,
+        "runs": runs,
+        "wall": min(walls),
+        "bytes_written": min(written) if written else None,
+        "audio_bytes": len(audio),
+        "output_bytes": os.path.getsize(output),
+    }
+
+
+def main():
+    """Benchmark runner."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=10, help="MB of encoded audio")
+    parser.add_argument("--cover", type=int, default=300, help="KB of source cover")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, audio = make_fixture(tmp, args.size, args.cover)
+        for job in (tag_after, tag_up_front):
+            print(json.dumps(bench(job, source, audio, args.runs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of pre-forked sox processes. It renders short synthetic clips
+one after another by sox started for every job and by sox processes
+pre-forked by the engine, and reports jobs per second. Jobs take turns
+of the bitrates and report progress, like jobs of the queue.
+
+    python -m bench.workers --duration 5 --jobs 50 --bitrates 128 192 320
+"""
+
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from bench.engines import make_fixture
+from bench.stats import cpu_time
+from bot.utils.u_engine import SoxEngine, Target
+from bot.utils.u_presets import DEFAULT_PRESET, get_preset
+
+
+def run(engine: SoxEngine, source: str, output: str, args: argparse.Namespace) -> dict:
+    """Renders the clip `args.jobs` times by turns of the bitrates and returns timings."""
+
+    preset = get_preset(DEFAULT_PRESET)
+    options = {"progress": lambda seconds: None} if args.progress else {}
+    for bitrate in args.bitrates:  # Warm up
+        engine.render(source, Target(output, bitrate=bitrate), preset, **options)
+
+    cpu = cpu_time()
+    start = time.perf_counter()
+    for bitrate in itertools.islice(itertools.cycle(args.bitrates), args.jobs):
+        engine.render(source, Target(output, bitrate=bitrate), preset, **options)
+    wall = time.perf_counter() - start
+
+    return {
+        "wall": round(wall, 3),
+        "cpu": round(cpu_time() - cpu, 3),
+        "jobs_per_second": round(args.jobs / wall, 2),
+    }
+
+
+def main() -> None:
+    """Runs the benchmark with arguments of the command line."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=5, help="Clip length in seconds")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--bitrates", type=float, nargs="+", default=[128, 192, 320])
+    parser.add_argument("--progress", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--spares", type=int, default=3, help="SOX_SPARES")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.mp3")
+        output = os.path.join(directory, "output.mp3")
+        make_fixture(source, args.duration, bitrate=128)
+
+        results = {}
+        for mode, spares in (("cold", 0), ("warm", args.spares)):
+            engine = SoxEngine(spares=spares)
+            results[mode] = run(engine, source, output, args)
+            if engine.spares is not None:
+                engine.spares.close()
+            print(json.dumps({"mode": mode, "duration": args.duration, **results[mode]}))
+
+        print(
+            json.dumps(
+                {
+                    "speedup": round(
+                        results["warm"]["jobs_per_second"] / results["cold"]["jobs_per_second"], 2
+                    )
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
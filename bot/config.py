@@ -1,7 +1,9 @@
+import importlib.util
 import os
 import sys
+import tempfile
 
-from pydantic import ValidationError
+from pydantic import ValidationError, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -22,20 +24,58 @@ class AppConfig(BaseSettings):
 
     ADMIN_ID: int
     ALBUM_ART: str = "./assets/thumb.jpg"
+    AUDIO_ENGINE: str = "sox"  # sox or numpy
     APP_HOST: str = "0.0.0.0"
     APP_PORT: int = 3001
     BOT_TOKEN: str
     DATA_DIR: str = "./data/"
     DB_FILE: str = os.path.join(DATA_DIR, "db.sqlite")
+    DB_COMMIT_DELAY: int = 5  # Milliseconds to collect writes into one transaction
+    DB_READERS: int = 4  # Reader connections kept open, the writer is one
     DEBUG: bool = False
+    FINGERPRINT: bool = True  # Reuse renders of re-encoded copies of audio
+    FINGERPRINT_DISTANCE: int = 6  # Max count of different bits of 64
+    LOCAL_WORKERS: bool = True  # Run jobs in the bot process, false - only by worker.py
+    METRICS: bool = True  # Serve Prometheus metrics on APP_HOST:APP_PORT
+    METRICS_WORKER_PORT: int = 0  # Metrics port of worker.py, 0 - no server
+    PREVIEW: bool = False  # Send slowed beginning of audio before the full track
+    PREVIEW_LENGTH: int = 30  # Seconds of the source audio in preview
+    SCHEDULER_WEIGHT: float = 0.2  # Seconds of queue delay per second of audio, 0 - FIFO
+    SEGMENT_THRESHOLD: int = 600  # Render longer audio by segments in parallel, 0 - never
     SPEED_RATIO: float = 33 / 45
+    SPOOL_DIR: str = os.path.join(tempfile.gettempdir(), "slow-tunes-bot")  # Use tmpfs
+    SPOOL_QUOTA: int = 1024  # In megabytes, 0 - unlimited
+    SPOOL_SWEEP_INTERVAL: int = 600  # In seconds, 0 - sweep only at startup
+    STREAMING: bool = False  # Pipe audio through sox without temp files
+    PROGRESS_INTERVAL: int = 5  # Min seconds between edits of a status message
+    QUEUE_DRAIN_TIMEOUT: int = 60  # Seconds for running jobs to finish on shutdown
+    QUEUE_SLA: int = 1200  # Max projected wait of a new job in seconds, 0 - admit all
+    QUEUE_VISIBILITY_TIMEOUT: int = 60  # Seconds before the job of a lost worker is retried
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
+    RENDER_TIMEOUT: int = 60  # Seconds to render besides RENDER_TIMEOUT_RATIO, 0 - no deadline
+    RENDER_TIMEOUT_RATIO: float = 1.0  # Seconds to render per second of audio
+    RENDER_WORKERS: int = 0  # 0 - use count of CPUs
+    RENDER_WORKER_MAX_TASKS: int = 100  # Restart worker after N tasks, 0 - never
+    RENDER_WORKER_MEMORY: int = 1024  # In megabytes, 0 - unlimited
+    SOX_SPARES: int = 2  # Pre-forked sox processes per render worker, 0 - spawn on demand
     TASK_LIMIT: int = 2
+    TASK_LEASE_TIMEOUT: int = 900  # Seconds before the slot of a lost job is freed
     THROTTLE_RATE: int = 15  # In seconds
 
+    @field_validator("AUDIO_ENGINE")
+    @classmethod
+    def check_audio_engine(cls, value: str) -> str:
+        """Checks that the engine is known and its optional modules are installed."""
+
+        if value not in ("sox", "numpy"):
+            raise ValueError("must be sox or numpy")
+        if value == "numpy" and importlib.util.find_spec("soundfile") is None:
+            raise ValueError("numpy engine requires `soundfile` module, run pip install soundfile")
+        return value
+
 
 try:
     config = AppConfig.model_validate({})
-except ValidationError:
-    sys.exit(1)
+except ValidationError as error:
+    sys.exit(str(error))
@@ -1,42 +1,294 @@
+import asyncio
+import queue
 import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator
 
 from bot.config import config
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import DB_QUERY, MATCH_CACHE
 
 LOG = get_logger()
 
+# Applied once to every connection
+PRAGMAS = (
+    "pragma journal_mode=wal;",
+    "pragma synchronous=normal;",  # With WAL it syncs on checkpoints only
+    "pragma cache_size=-16384;",  # In KB
+    "pragma mmap_size=268435456;",  # In bytes
+    "pragma temp_store=memory;",
+    "pragma busy_timeout=5000;",  # In milliseconds
+)
+STATEMENT_CACHE = 256  # Prepared statements kept by every connection
+MAX_BATCH = 100  # Writes committed in one transaction at most
+
 
 class Error(Exception):
     """Custom exception class for database."""
 
 
-def sqlite_connect(db_file: str) -> sqlite3.Connection:
+class Result:
+    """Rows and counters of the executed query. The cursor is already closed."""
+
+    __slots__ = ("rows", "rowcount", "lastrowid")
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self.rows = iter(cursor.fetchall())
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        cursor.close()
+
+    def fetchone(self) -> tuple | None:
+        """Returns the next row or None."""
+
+        return next(self.rows, None)
+
+    def fetchall(self) -> list:
+        """Returns the remaining rows."""
+
+        return list(self.rows)
+
+
+def sqlite_connect(db_file: str, readonly: bool = False) -> sqlite3.Connection:
     """Connect to the database file."""
 
     try:
-        conn = sqlite3.connect(db_file, check_same_thread=False)
-        conn.execute("pragma journal_mode=wal;")
+        conn = sqlite3.connect(
+            db_file, check_same_thread=False, cached_statements=STATEMENT_CACHE
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("pragma query_only=on;")
         return conn
     except sqlite3.Error as error:
         LOG.critical("Can't connect to the database - %s", error)
         raise error
 
 
-def send_query(query: str, args: tuple | None = None) -> sqlite3.Cursor:  # type: ignore
-    """Send query to database and return cursor object."""
+class Connections:
+    """
+    A class that keeps connections to the database for the life of the
+    process: one writer and a pool of up to `readers` readers, which can
+    read while the writer writes (WAL). Connections are opened on demand.
+    """
+
+    def __init__(self, db_file: str, readers: int = 4) -> None:
+        self.db_file = db_file
+        self.readers = max(readers, 1)
+        self.__lock = threading.Lock()
+        self.__writer: sqlite3.Connection | None = None
+        self.__pool: queue.SimpleQueue = queue.SimpleQueue()
+        self.__opened: list[sqlite3.Connection] = []
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Returns the writer connection, one caller at a time."""
+
+        with self.__lock:
+            if self.__writer is None:
+                self.__writer = sqlite_connect(self.db_file)
+            yield self.__writer
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Returns a free reader connection, it waits if all are busy."""
+
+        try:
+            conn = self.__pool.get_nowait()
+        except queue.Empty:
+            with self.__lock:
+                opened = len(self.__opened) < self.readers
+                if opened:
+                    conn = sqlite_connect(self.db_file, readonly=True)
+                    self.__opened.append(conn)
+            if not opened:
+                conn = self.__pool.get()
+        try:
+            yield conn
+        finally:
+            self.__pool.put(conn)
+
+    def close(self) -> None:
+        """Closes all connections."""
+
+        with self.__lock:
+            if self.__writer is not None:
+                self.__writer.execute("pragma optimize;")
+                self.__writer.close()
+                self.__writer = None
+            for conn in self.__opened:
+                conn.close()
+            self.__opened.clear()
+            self.__pool = queue.SimpleQueue()
+
+
+def read_query(query: str, args: tuple) -> Result:
+    """Runs the read query by a reader connection."""
+
+    with connections.reader() as conn:
+        return Result(conn.execute(query, args))
 
-    if not args:
-        args = tuple()
 
-    with sqlite_connect(config.DB_FILE) as conn:
-        cursor = conn.cursor()
+def write_queries(queries: list[tuple[str, tuple]]) -> list[Result | Exception]:
+    """
+    Runs write queries in one transaction and commits it once. Every query
+    runs in its own savepoint, so the error of one query (e.g. `OverflowError`
+    of too big integer argument) is returned in its place and doesn't roll
+    back others.
+    """
+
+    results: list[Result | Exception] = []
+    with connections.writer() as conn:
         try:
-            cursor.execute(query, args)
+            conn.execute("BEGIN;")
+            for query, args in queries:
+                conn.execute("SAVEPOINT query;")
+                try:
+                    results.append(Result(conn.execute(query, args)))
+                except Exception as error:  # pylint: disable=broad-except
+                    conn.execute("ROLLBACK TO query;")
+                    results.append(error)
+                conn.execute("RELEASE query;")
             conn.commit()
-        except sqlite3.Error as error:
-            LOG.error("Can't send query to the database - %s", error)
-            raise error
-        return cursor
+        except Exception as error:  # pylint: disable=broad-except
+            if conn.in_transaction:
+                conn.rollback()
+            return [error] * len(queries)
+    return results
+
+
+def resolve(future: asyncio.Future, result: Result | Exception) -> None:
+    """Sets the result or the error of the query to its future."""
+
+    if future.done():
+        return
+    if isinstance(result, Exception):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+class Executor:
+    """
+    A class that runs queries off the event loop. Reads run by a pool of
+    `readers` threads. Writes are sent to the writer thread which collects
+    writes sent within `delay` seconds and commits them in one transaction
+    (group commit), every caller still gets the result of its own query.
+    """
+
+    def __init__(self, readers: int = 4, delay: float = 0.005, max_batch: int = MAX_BATCH):
+        self.readers = max(readers, 1)
+        self.delay = delay
+        self.max_batch = max(max_batch, 1)
+        self.__lock = threading.Lock()
+        self.__reads: ThreadPoolExecutor | None = None
+        self.__writes: queue.SimpleQueue = queue.SimpleQueue()
+        self.__writer: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Starts reader threads and the writer thread."""
+
+        with self.__lock:
+            if self.__reads is None:
+                self.__reads = ThreadPoolExecutor(self.readers, thread_name_prefix="db-read")
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.writer, name="db-write", daemon=True)
+                self.__writer.start()
+
+    def close(self) -> None:
+        """Commits pending writes and stops threads."""
+
+        with self.__lock:
+            reads, self.__reads = self.__reads, None
+            writer, self.__writer = self.__writer, None
+        if writer is not None:
+            self.__writes.put(None)
+            writer.join()
+        if reads is not None:
+            reads.shutdown(wait=True)
+
+    async def read(self, query: str, args: tuple) -> Result:
+        """Runs the read query by a reader thread."""
+
+        self.start()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.__reads, read_query, query, args
+        )
+
+    async def write(self, query: str, args: tuple) -> Result:
+        """Sends the write query to the writer thread and waits for its commit."""
+
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.__writes.put((query, args, future))
+        return await future
+
+    def writer(self) -> None:
+        """Commits batches of writes until the stop sentinel (None)."""
+
+        while (item := self.__writes.get()) is not None:
+            batch = [item]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.__writes.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:  # Stop after the batch
+                    self.__writes.put(None)
+                    break
+                batch.append(item)
+
+            queries = [(query, args) for query, args, _ in batch]
+            try:
+                results = write_queries(queries)
+            except Exception as error:  # pylint: disable=broad-except
+                # E.g. the database can't be opened, the writer must keep running
+                LOG.error("Can't write batch of %d queries - %s", len(batch), error)
+                results = [error] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                try:
+                    future.get_loop().call_soon_threadsafe(resolve, future, result)
+                except RuntimeError:  # The event loop is closed
+                    pass
+
+
+connections = Connections(config.DB_FILE, readers=config.DB_READERS)
+executor = Executor(readers=config.DB_READERS, delay=config.DB_COMMIT_DELAY / 1000)
+
+
+async def send_query(query: str, args: tuple | None = None) -> Result:  # type: ignore
+    """Send query to database and return its result."""
+
+    if not args:
+        args = tuple()
+
+    # Name of the function which sends the query
+    name = sys._getframe(1).f_code.co_name  # pylint: disable=protected-access
+    start = time.perf_counter()
+
+    try:
+        if query.lstrip()[:6].upper() == "SELECT":
+            return await executor.read(query, args)
+        return await executor.write(query, args)
+    except sqlite3.Error as error:
+        LOG.error("Can't send query to the database - %s", error)
+        raise error
+    finally:
+        DB_QUERY.observe(time.perf_counter() - start, query=name)
+
+
+def close() -> None:
+    """Commits pending writes and closes connections to the database."""
+
+    executor.close()
+    connections.close()
 
 
 def execute_script(script_file: str):
@@ -49,10 +301,9 @@ def execute_script(script_file: str):
         LOG.critical("Can't read from SQL script file: %s", error)
         raise SystemExit from error
 
-    with sqlite_connect(config.DB_FILE) as conn:
-        cursor = conn.cursor()
+    with connections.writer() as conn:
         try:
-            cursor.executescript(sql)
+            conn.executescript(sql)
             conn.commit()
         except sqlite3.Error as error:
             LOG.error("Can't send query to the database - %s", error)
@@ -60,13 +311,17 @@ def execute_script(script_file: str):
 
 
 async def create_empty_match(file_unique_id: str) -> int | None:
-    """Create new match id for pair of original and slowed file ids. Returns id of new row"""
+    """
+    Create new match id for pair of original and slowed file ids. Returns id of new row.
+    The row gets the original id in `update_match`, so it isn't found by `get_match`
+    until the slowed file is sent and concurrent renders don't violate its uniqueness.
+    """
 
-    query = send_query(
+    query = await send_query(
         """INSERT INTO match (original, slowed, user_id, private, forbidden)
         VALUES (?, ?, ?, ?, ?);""",
         (
-            file_unique_id,
+            f"{file_unique_id}:pending:{uuid.uuid4().hex}",
             0,
             0,
             True,
@@ -76,51 +331,59 @@ async def create_empty_match(file_unique_id: str) -> int | None:
     return query.lastrowid
 
 
-async def update_match(
-    id_: int,
-    original: str,
-    slowed: str,
-    user_id: int,
-    private: bool = True,
-    forbidden: bool = False,
-) -> int | None:
-    """Update row with original and slowed file ids."""
+async def update_match(id_: int, original: str, slowed: str, user_id: int) -> int | None:
+    """
+    Update row with original and slowed file ids. Returns id of the row of the
+    original. If the original is already slowed by another row, the new row
+    is removed and id of that row is returned. The row keeps flags of
+    `create_empty_match` until they are toggled.
+    """
 
-    query = send_query(
+    query = await send_query(
         """UPDATE
         match
-        SET original = ?,
-            slowed = ?,
-            user_id = ?,
-            private = ?,
-            forbidden = ?
+        SET slowed = ?,
+            user_id = ?
         WHERE id = ?;""",
         (
-            original,
             slowed,
             user_id,
-            private,
-            forbidden,
             id_,
         ),
     )
-    return query.rowcount
+    if not query.rowcount:
+        return None
+
+    # The original is set after the slowed file id, so `get_match` finds complete rows only
+    query = await send_query(
+        "UPDATE OR IGNORE match SET original = ? WHERE id = ?;",
+        (original, id_),
+    )
+    if query.rowcount:
+        return id_
+
+    # The placeholder would be counted in stats and lists of tunes
+    await send_query("DELETE FROM match WHERE id = ?;", (id_,))
+    row = await get_match(original)
+    return row[0] if row else None
 
 
 async def get_match(original: str) -> tuple | None:
     """Get row of pair original and slowed file ids."""
 
-    query = send_query(
+    query = await send_query(
         "SELECT * FROM match WHERE original = ? LIMIT 1;",
         (original,),
     )
-    return query.fetchone()
+    row = query.fetchone()
+    MATCH_CACHE.inc(result="hit" if row else "miss")
+    return row
 
 
 async def get_random_ids() -> list:
     """Get list of random public match ids."""
 
-    query = send_query(
+    query = await send_query(
         """SELECT id FROM match
         WHERE private = ? AND forbidden = ?
         ORDER BY RANDOM();""",
@@ -135,7 +398,7 @@ async def get_random_ids() -> list:
 async def get_random_match() -> tuple | None:
     """Get random row from match table."""
 
-    query = send_query(
+    query = await send_query(
         """SELECT * FROM match
         WHERE private = ? AND forbidden = ?
         ORDER BY RANDOM() LIMIT 1;""",
@@ -150,7 +413,7 @@ async def get_random_match() -> tuple | None:
 async def get_by_pk(table: str, pk: int) -> tuple | None:
     """Get the row by its id from a given table."""
 
-    query = send_query(
+    query = await send_query(
         f"SELECT * FROM {table} WHERE id = ? LIMIT 1;",
         (pk,),
     )
@@ -160,7 +423,7 @@ async def get_by_pk(table: str, pk: int) -> tuple | None:
 async def toggle_private(idc: int, is_private: bool = True) -> None:
     """Toggle private status for slowed row."""
 
-    send_query(
+    await send_query(
         "UPDATE match SET private = ? WHERE id = ?;",
         (
             is_private,
@@ -172,7 +435,7 @@ async def toggle_private(idc: int, is_private: bool = True) -> None:
 async def toggle_forbidden(idc: int, is_forbidden: bool = True) -> None:
     """Toggle forbidden status for slowed row."""
 
-    send_query(
+    await send_query(
         "UPDATE match SET forbidden = ? WHERE id = ?;",
         (
             is_forbidden,
@@ -185,7 +448,7 @@ async def toggle_like(toggle: bool, match_id: int, user_id: int) -> None:
     """Toggle likes for /random audio."""
 
     if toggle:
-        send_query(
+        await send_query(
             "INSERT OR IGNORE INTO likes (match_id, user_id) VALUES (?, ?);",
             (
                 match_id,
@@ -193,7 +456,7 @@ async def toggle_like(toggle: bool, match_id: int, user_id: int) -> None:
             ),
         )
     else:
-        send_query(
+        await send_query(
             "DELETE FROM likes WHERE match_id = ? AND user_id = ?;",
             (
                 match_id,
@@ -205,7 +468,7 @@ async def toggle_like(toggle: bool, match_id: int, user_id: int) -> None:
 async def is_liked(match_id: int, user_id: int) -> bool:
     """Check if audio is already liked."""
 
-    query = send_query(
+    query = await send_query(
         "SELECT * FROM likes WHERE match_id = ? AND user_id = ? LIMIT 1;",
         (
             match_id,
@@ -219,7 +482,7 @@ async def is_liked(match_id: int, user_id: int) -> bool:
 async def get_queue_count(user_id: int) -> int:
     """Returns cout of task in queue for user."""
 
-    query = send_query(
+    query = await send_query(
         "SELECT * FROM queue WHERE user_id = ?;",
         (user_id,),
     )
@@ -230,10 +493,10 @@ async def get_queue_count(user_id: int) -> int:
     return 0
 
 
-async def inc_queue_count(user_id: int) -> sqlite3.Cursor:
+async def inc_queue_count(user_id: int) -> Result:
     """Increase count for queue of user tasks."""
 
-    return send_query(
+    return await send_query(
         """INSERT OR REPLACE INTO queue
         VALUES (
             NULL,
@@ -244,10 +507,10 @@ async def inc_queue_count(user_id: int) -> sqlite3.Cursor:
     )
 
 
-async def dec_queue_count(user_id: int) -> sqlite3.Cursor:
+async def dec_queue_count(user_id: int) -> Result:
     """Decrease count for queue of user tasks."""
 
-    return send_query(
+    return await send_query(
         """INSERT OR REPLACE INTO queue
         VALUES (
             NULL,
@@ -267,7 +530,7 @@ async def dec_queue_count(user_id: int) -> sqlite3.Cursor:
 async def add_user(user_id: int, username: str) -> None:
     """Add new user to database."""
 
-    send_query(
+    await send_query(
         """INSERT OR IGNORE INTO
         users (user_id, username)
         VALUES (?, ?);""",
@@ -281,21 +544,21 @@ async def add_user(user_id: int, username: str) -> None:
 async def users_count() -> int:
     """Returns count of users in database."""
 
-    query = send_query("""SELECT COUNT(id) FROM users;""")
+    query = await send_query("""SELECT COUNT(id) FROM users;""")
     return query.fetchone()[0]
 
 
 async def slowed_count() -> int:
     """Returns count of slowed audios in database."""
 
-    query = send_query("""SELECT COUNT(id) FROM match;""")
+    query = await send_query("""SELECT COUNT(id) FROM match;""")
     return query.fetchone()[0]
 
 
 async def random_count() -> int:
     """Returns count of public audios in database."""
 
-    query = send_query(
+    query = await send_query(
         """SELECT COUNT(id) FROM match WHERE private = 0 and forbidden = 0;"""
     )
     return query.fetchone()[0]
@@ -304,7 +567,7 @@ async def random_count() -> int:
 async def get_matches(limit: int = 10, offset: int = 0) -> list | None:
     """Get rows from match table."""
 
-    query = send_query(
+    query = await send_query(
         """SELECT * FROM match
         ORDER BY id DESC LIMIT ? OFFSET ?;""",
         (
@@ -318,8 +581,44 @@ async def get_matches(limit: int = 10, offset: int = 0) -> list | None:
 async def get_match_by_pk(pk: int) -> tuple | None:
     """Get the match by its id."""
 
-    query = send_query(
+    query = await send_query(
         "SELECT * FROM match WHERE id = ? LIMIT 1;",
         (pk,),
     )
     return query.fetchone()
+
+
+async def add_fingerprint(match_id: int, duration: int, preset: str, fingerprint: int) -> None:
+    """Add acoustic fingerprint of the original audio rendered with the preset."""
+
+    await send_query(
+        """INSERT OR IGNORE INTO fingerprint (match_id, duration, preset, hash)
+        VALUES (?, ?, ?, ?);""",
+        (
+            match_id,
+            duration,
+            preset,
+            fingerprint,
+        ),
+    )
+
+
+async def get_fingerprint_matches(duration: int, preset: str, delta: int = 2) -> list:
+    """
+    Get rows of matches with fingerprints of audio of similar duration
+    rendered with the preset. The last column of the row is the fingerprint.
+    """
+
+    query = await send_query(
+        """SELECT match.*, fingerprint.hash FROM fingerprint
+        JOIN match ON match.id = fingerprint.match_id
+        WHERE fingerprint.preset = ?
+            AND fingerprint.duration BETWEEN ? AND ?
+            AND match.slowed != '0';""",
+        (
+            preset,
+            duration - delta,
+            duration + delta,
+        ),
+    )
+    return query.fetchall()
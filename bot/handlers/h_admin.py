@@ -4,7 +4,8 @@ from aiogram import types
 
 from bot import db
 from bot.keyboards.k_admin import tune_buttons, tunes_pagging_buttons
-from bot.utils.u_admin import get_tunes_list, get_username_by_id
+from bot.utils.u_admin import get_queue_list, get_tunes_list, get_username_by_id
+from bot.utils.u_brand import brand
 from bot.utils.u_logger import get_logger
 
 LOG = get_logger()
@@ -17,12 +18,25 @@ async def command_admin(message: types.Message):
     await message.reply(
         "<b>Admin commands:</b>"
         "\n\n/all - list of all tunes."
+        "\n/queue - list of queued tasks."
+        "\n/refresh - reload bot info and album art."
         "\n/dump - TODO."
         "\n/import - TODO.",
         disable_notification=True,
     )
 
 
+async def command_refresh(message: types.Message):
+    """Handler for `/refresh` command. Refreshes the brand cache."""
+
+    await brand.refresh(message.bot)
+    await message.reply(
+        f"Brand cache is refreshed: {brand.mention}, "
+        f"album art {'loaded' if brand.thumb else 'not found'}.",
+        disable_notification=True,
+    )
+
+
 async def command_all(message: types.Message):
     """Handler for `/all` command. Returns a list of all tunes from database."""
 
@@ -39,6 +53,22 @@ async def command_all(message: types.Message):
     return await message.reply("Sorry! I don't have any tunes yet.")
 
 
+async def command_queue(message: types.Message):
+    """Handler for `/queue` command. Returns a list of queued tasks."""
+
+    if jobs := await message.bot.data["queue"].jobs():
+        return await message.answer(get_queue_list(jobs))
+    return await message.reply("The queue is empty.")
+
+
+async def move_up(message: types.Message, regexp_command):
+    """Handler for `/up_<id>` command. Moves the queued task to the priority lane."""
+
+    if await message.bot.data["queue"].reprioritize(regexp_command.group(1)):
+        return await message.reply("The task is moved to the priority lane.")
+    return await message.reply("Sorry! The task isn't in the queue anymore.")
+
+
 async def tunes_pagging(query: types.CallbackQuery, callback_data: dict):
     """Handler for change page in tunes list."""
 
@@ -1,22 +1,61 @@
+import asyncio
+import io
 import os
+import time
+from typing import AsyncIterator, Callable, TypedDict
 
 from aiogram import types
+from aiogram.dispatcher import FSMContext
 from aiogram.types.mixins import Downloadable
 from aiogram.utils.exceptions import FileIsTooBig, TelegramAPIError
+from sox.core import SoxError
 
 from bot import db
 from bot.config import config
 from bot.keyboards.k_public import please_wait_button, public_buttons
+from bot.keyboards.k_queue import cancel_button
 from bot.keyboards.k_share import share_button
-from bot.utils import u_audio
-from bot.utils.u_brand import get_branded_file_name, get_caption
-from bot.utils.u_exceptions import NotSupportedFormat, QueueLimitReached
+from bot.utils import u_audio, u_fingerprint, u_profile, u_segments
+from bot.utils.u_brand import brand, get_branded_file_name, get_caption
+from bot.handlers.h_presets import get_user_preset
+from bot.utils.u_exceptions import (
+    NotSupportedFormat,
+    QueueLimitReached,
+    QueueOverloaded,
+    RenderTimeout,
+)
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import JOB_STAGE, QUEUE_REJECTED, RENDER_TIMEOUTS, SOX_FAILURES
+from bot.utils.u_presets import Preset
+from bot.utils.u_progress import editor, progress_text, watcher
+from bot.utils.u_queue import Job, on_drop, task
+from bot.utils.u_spool import spool
 
 LOG = get_logger()
 
+TIMEOUT_TEXT = (
+    "⏱ Your audio takes too long to process, so I've stopped it. "
+    "Please send me another file."
+)
+REQUEUED_TEXT = "🕙 I'm restarting, your request is back in the queue..."
+FAILED_TEXT = (
+    "⚠ I have some issues with processing your audio. "
+    "Please send me another file or try again later."
+)
+CANCELLED_TEXT = (
+    "✖ Recording of this track is cancelled by the user who sent it first. "
+    "Please send me the file again."
+)
 
-async def processing_audio(message: types.Message):
+
+class Prefetched(TypedDict):
+    """Audio downloaded and fingerprinted by the Bot before its job is queued."""
+
+    path: str
+    fingerprint: int | None
+
+
+async def processing_audio(message: types.Message, state: FSMContext):
     """Slow down uploaded audio track and send it to user."""
 
     await message.answer_chat_action(types.ChatActions.TYPING)
@@ -29,125 +68,563 @@ async def processing_audio(message: types.Message):
     if message.audio.file_name[-3:].lower() != "mp3":
         raise NotSupportedFormat(message.audio.file_name)
 
-    # Checks if the audio has already slowed down then returns it
-    # from telegram servers directly avoiding the queue
-    if from_db := await db.get_match(message.audio.file_unique_id):
-        (idc, file_unique_id, file_id, user_id, is_private, *_) = from_db
+    # Checks if the audio has already slowed down with the same preset
+    # then returns it from telegram servers directly avoiding the queue
+    preset = await get_user_preset(state)
+    if from_db := await db.get_match(preset.match_key(message.audio.file_unique_id)):
+        return await answer_match(message, from_db)
+
+    # Choose bitrate of the result before the job is queued,
+    # raises OutputTooBig if it can't be uploaded
+    duration = message.audio.duration or 0
+    bitrate = u_profile.get_bitrate(
+        u_profile.get_source_bitrate(message.audio.file_size, duration),
+        duration,
+        preset.speed,
+    )
 
-        if user_id == message.from_user.id:
-            keyboard = share_button(
-                file_unique_id, is_private=is_private, is_random=False
-            )
-        else:
-            is_liked = await db.is_liked(idc, message.from_user.id)
-            keyboard = public_buttons(idc, is_like=is_liked, is_random=False)
+    # Re-encoded copies of slowed audio are answered before the job is queued,
+    # the downloaded file is handed to the job
+    prefetched = await prefetch_audio(message.audio)
+    if prefetched and prefetched["fingerprint"] is not None and (
+        from_db := await u_fingerprint.find_match(prefetched["fingerprint"], duration, preset.name)
+    ):
+        spool.remove(prefetched["path"])
+        LOG.info(
+            "Found similar audio <file_unique_id=%s match_id=%d>",
+            message.audio.file_unique_id,
+            from_db[0],
+        )
+        return await answer_match(message, from_db)
+
+    queued = False
+    try:
+        queued = await queue_render(message, preset, bitrate, prefetched)
+    finally:
+        if prefetched and not queued:
+            spool.remove(prefetched["path"])
+
+
+async def prefetch_audio(audio: types.Audio) -> Prefetched | None:
+    """
+    Downloads the audio and returns path to the file and its fingerprint.
+    It's None if fingerprints are off and the fingerprint is None if it fails.
+    """
+
+    if not config.FINGERPRINT or config.STREAMING:
+        return None
+
+    with JOB_STAGE.time(stage="download"):
+        downloaded = await download_file(audio)
+    if not downloaded:
+        return None
 
-        return await message.answer_audio(
-            file_id,
-            caption=await get_caption(),
-            reply_markup=keyboard,
+    with JOB_STAGE.time(stage="fingerprint"):
+        return Prefetched(
+            path=downloaded, fingerprint=await u_fingerprint.get_fingerprint(downloaded)
         )
 
-    queue = message.bot.data["queue"]
-    queue_count = await queue.get_user_queue(message.from_user.id)
-    if queue_count >= config.TASK_LIMIT:
-        raise QueueLimitReached(queue_count)
 
-    await queue.inc_user_queue(message.from_user.id)
+async def queue_render(
+    message: types.Message,
+    preset: Preset,
+    bitrate: float,
+    prefetched: Prefetched | None = None,
+) -> bool:
+    """Adds the render of the audio to the queue. Returns False if it isn't queued."""
 
-    # Add slowing down audio task to the queue
-    task = queue.enqueue(slowing_down_task, message)
+    duration = message.audio.duration or 0
 
-    if task > 1:
+    # The limit of user jobs is tightened under load, new jobs are rejected
+    # if they would miss the SLA. The admin has the reserved priority lane.
+    queue = message.bot.data["queue"]
+    is_admin = message.from_user.id == config.ADMIN_ID
+    limit = config.TASK_LIMIT if is_admin else queue.task_limit(duration / preset.speed)
+
+    # The slot of the user is taken by the lease of the job, it's freed
+    # when the job is done or its lease expires
+    lease, queue_count = await queue.acquire(message.from_user.id, max(limit, 1))
+    if lease is None:
+        raise QueueLimitReached(queue_count)
+
+    # The same audio with the same preset is rendered once, the message
+    # gets the result of the job which is already in the queue
+    match_key = preset.match_key(message.audio.file_unique_id)
+    leader = await queue.join_inflight(match_key, message, lead=limit > 0)
+    if not leader:
+        await queue.release(message.from_user.id, lease)
+        if leader is None:
+            QUEUE_REJECTED.inc()
+            raise QueueOverloaded(queue.drain_time(duration / preset.speed))
         await message.reply(
-            f"🕙 Added your request to the queue. Your position: {task}.",
+            "🕙 This track is already being recorded, I'll send it to you when it's ready.",
             disable_notification=True,
         )
+        return False
 
+    try:
+        # Preview is rendered in the priority lane, so it is sent
+        # in seconds even if the full track waits in the queue
+        if config.PREVIEW and duration > config.PREVIEW_LENGTH * 2:
+            await queue.add_preview(*preview_key(message))
+            await queue.enqueue(preview_task, message, preset, bitrate, priority=True)
+
+        # The status message is edited with position in the queue
+        # and progress of the job until the slowed audio is sent.
+        # The lease is the id of the job, so it can be cancelled.
+        info_message = await message.reply(
+            "🕙 Adding your request to the queue...",
+            disable_notification=True,
+            reply_markup=cancel_button(lease),
+        )
 
-async def slowing_down_task(message: types.Message) -> bool:
-    """Slowing down audio Task."""
+        # The file can be swept when it gets old, the job may run in another process
+        spool.hand_over(prefetched["path"] if prefetched else None)
+
+        # Add slowing down audio task to the queue
+        job = await queue.enqueue(
+            slowing_down_task,
+            message,
+            preset,
+            bitrate,
+            info_message,
+            prefetched,
+            priority=is_admin,
+            user_id=message.from_user.id,
+            duration=duration / preset.speed,
+            lease=lease,
+        )
+    except Exception:
+        # The job isn't queued, so nothing would free the render and the lease
+        await queue.pop_preview(*preview_key(message))
+        await answer_waiters(await queue.finish_inflight(match_key), None)
+        await queue.release(message.from_user.id, lease)
+        raise
+
+    watcher.watch(job, info_message)
+    return True
+
+
+async def cancel_job(query: types.CallbackQuery, callback_data: dict):
+    """Handler for Cancel button of the queued job. It frees the slot of the user."""
+
+    queue = query.bot.data["queue"]
+    job = await queue.get(callback_data["job_id"])
+    if job is None:
+        return await query.answer("Your request is already done.")
+    if query.from_user.id not in (job.user_id, config.ADMIN_ID):
+        return await query.answer("It isn't your request.")
+    if await queue.cancel(job.id) is None:
+        return await query.answer("Your track is already being recorded.", show_alert=True)
+
+    await query.answer("Cancelled.")
+    await editor.finish(query.message, "✖ Your request is cancelled.", reply_markup=None)
+
+    message, preset = Job.decode(job.args[0]), Job.decode(job.args[1])
+    if len(job.args) > 4 and job.args[4]:  # The file downloaded by the Bot
+        spool.remove(job.args[4]["path"])
+    if preview_id := await queue.pop_preview(*preview_key(message)):
+        try:
+            await query.bot.delete_message(message.chat.id, preview_id)
+        except TelegramAPIError as error:
+            LOG.warning("Can't delete preview: %s", error)
+    await answer_waiters(
+        await queue.finish_inflight(preset.match_key(message.audio.file_unique_id)),
+        None,
+        text=CANCELLED_TEXT,
+    )
 
-    queue = message.bot.data["queue"]
-    info_message = await message.reply(
-        "💿 Start recording at 33 rpm for you...",
-        disable_notification=True,
-        reply_markup=please_wait_button(),
+
+async def answer_match(message: types.Message, match: tuple) -> types.Message:
+    """Answer with already slowed down audio from the match row."""
+
+    (_, _, file_id, *_) = match
+
+    return await message.answer_audio(
+        file_id,
+        caption=await get_caption(),
+        reply_markup=await match_buttons(match, message.from_user.id),
     )
 
-    if not (downloaded := await download_file(message.audio)):
-        await info_message.edit_text(
-            "💾 Can't download your file. Please try again or come back later."
+
+async def match_buttons(match: tuple, user_id: int) -> types.InlineKeyboardMarkup:
+    """Returns markup of the audio of the match row for the user."""
+
+    (idc, _, _, owner_id, is_private, *_) = match
+
+    if owner_id == user_id:
+        return share_button(idc, is_private=is_private, is_random=False)
+    is_liked = await db.is_liked(idc, user_id)
+    return public_buttons(idc, is_like=is_liked, is_random=False)
+
+
+def spool_size(audio: types.Audio, preset: Preset, bitrate: float) -> int:
+    """Returns predicted size of temporary files of the job in bytes."""
+
+    if config.STREAMING:
+        return 0
+
+    duration = audio.duration or 0
+    size = audio.file_size + u_profile.predict_size(bitrate, duration, preset.speed)
+    if u_audio.is_segmented(duration):
+        size += u_segments.predict_size(duration, preset.speed)
+    return size
+
+
+def preview_key(message: types.Message) -> tuple[int, int]:
+    """Returns key of the preview of the audio message."""
+
+    return (message.chat.id, message.message_id)
+
+
+@task
+async def preview_task(message: types.Message, preset: Preset, bitrate: float) -> bool:
+    """Sends slowed beginning of audio while the full track is in the queue."""
+
+    queue = message.bot.data["queue"]
+    key = preview_key(message)
+    if not await queue.has_preview(*key):  # The full track is already sent
+        return False
+
+    try:
+        with JOB_STAGE.time(stage="preview"):
+            preview = await u_audio.render_preview(
+                stream_file(message.audio), preset, config.PREVIEW_LENGTH, bitrate
+            )
+        file_name = await get_branded_file_name(
+            f"Preview {message.audio.file_name or message.audio.file_unique_id}"
         )
-        await queue.dec_user_queue(message.from_user.id)
+        audio_info = message.audio.to_python()
+        sent = await message.reply_audio(
+            audio=types.InputFile(io.BytesIO(preview), filename=file_name),
+            caption="👂 Preview. The full track is on its way...",
+            performer=audio_info.get("performer"),
+            title=audio_info.get("title"),
+            thumb=brand.thumb_file(),
+            disable_notification=True,
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        LOG.warning("Can't send preview: %s", error)
+        if isinstance(error, SoxError):
+            SOX_FAILURES.inc(mode="preview")
+        elif isinstance(error, RenderTimeout):
+            RENDER_TIMEOUTS.inc(mode="preview")
         return False
 
-    await message.answer_chat_action(types.ChatActions.RECORD_AUDIO)
+    if not await queue.set_preview(*key, sent.message_id):
+        await sent.delete()
+
+    return True
+
+
+@task
+async def slowing_down_task(
+    message: types.Message,
+    preset: Preset,
+    bitrate: float = 320.0,
+    info_message: types.Message | None = None,
+    prefetched: Prefetched | None = None,
+) -> bool:
+    """
+    Slowing down audio Task. The sent track is saved by the Bot, see
+    `save_match_task`, users waiting for the render are answered on failure.
+    The audio `prefetched` by the Bot is used if it's on the same node.
+    """
+
+    queue = message.bot.data["queue"]
+    match_key = preset.match_key(message.audio.file_unique_id)
+    sent = False
+    requeued = False
+    try:
+        await queue.touch_inflight(match_key)
+        # Waits while temporary files of other jobs exhaust the spool quota
+        async with spool.reserve(spool_size(message.audio, preset, bitrate)):
+            with JOB_STAGE.time(stage="total"):
+                sent = await slow_down_and_send(
+                    message, preset, bitrate, info_message, prefetched
+                )
+        return sent
+    except asyncio.CancelledError:
+        # The queue is drained, the job is run again by the next worker
+        # with the same preview and users waiting for it
+        requeued = True
+        if info_message is not None:
+            try:
+                await editor.finish(info_message, REQUEUED_TEXT, reply_markup=please_wait_button())
+            except TelegramAPIError as error:
+                LOG.warning("Can't edit status message: %s", error)
+        raise
+    finally:
+        if not requeued and not sent:
+            await finish_job(message, match_key, None)
+
+
+@task
+async def save_match_task(
+    message: types.Message,
+    preset: Preset,
+    uploaded: types.Message,
+    fingerprint: int | None = None,
+) -> None:
+    """
+    Saves the track uploaded by a worker to the database, adds its buttons,
+    replaces the preview by it and sends it to users who sent the same audio.
+    """
 
-    if not (slowed := await u_audio.slow_down(downloaded, config.SPEED_RATIO)):
-        await info_message.edit_text(
-            (
-                "⚠ I have some issues with processing your audio. "
-                "Please send me another file or try again later."
-            ),
-            reply_markup=None,
+    match = None
+    try:
+        match = await save_match(message, preset, uploaded.audio.file_id, fingerprint)
+        await uploaded.edit_reply_markup(await match_buttons(match, message.from_user.id))
+    except db.Error as error:
+        LOG.error("Database error: %s", error)
+        await uploaded.reply(
+            "💾 Can't save your file info to database. Please try again later."
         )
-        await queue.dec_user_queue(message.from_user.id)
-        return False
+    except TelegramAPIError as error:
+        LOG.warning("Can't add buttons to the track: %s", error)
+    finally:
+        await finish_job(message, preset.match_key(message.audio.file_unique_id), match)
+
+
+async def save_match(
+    message: types.Message, preset: Preset, file_id: str, fingerprint: int | None
+) -> tuple:
+    """
+    Saves the slowed track and returns its match row. The row of the same
+    audio saved by another render is returned instead of the duplicate.
+    """
+
+    match_key = preset.match_key(message.audio.file_unique_id)
+    match_id = await db.create_empty_match(match_key)
+    if not match_id:
+        raise db.Error("Can't create match in database")
+    saved_id = await db.update_match(match_id, match_key, file_id, message.from_user.id)
+    if not saved_id:
+        raise db.Error("Can't save match in database")
+    if saved_id == match_id and fingerprint is not None:
+        await db.add_fingerprint(match_id, message.audio.duration, preset.name, fingerprint)
+    return await db.get_match_by_pk(saved_id)
+
+
+@on_drop(slowing_down_task)
+async def drop_slowing_down(
+    message: types.Message,
+    preset: Preset,
+    _bitrate: float = 320.0,
+    info_message: types.Message | None = None,
+    prefetched: Prefetched | None = None,
+) -> None:
+    """
+    Answers the user and users waiting for the render of the job which is
+    dropped after its workers were lost. The render is forgotten, so the
+    audio can be sent again.
+    """
+
+    if info_message is not None:
+        try:
+            await editor.finish(info_message, FAILED_TEXT, reply_markup=None)
+        except TelegramAPIError as error:
+            LOG.warning("Can't edit status message: %s", error)
+    spool.remove(prefetched["path"] if prefetched else None)
+    await finish_job(message, preset.match_key(message.audio.file_unique_id), None)
+
+
+async def finish_job(message: types.Message, match_key: str, match: tuple | None) -> None:
+    """Replaces the preview by the full track and answers users waiting for it."""
+
+    queue = message.bot.data["queue"]
+    preview_id = await queue.pop_preview(*preview_key(message))
+    if preview_id and match is not None:
+        try:
+            await message.bot.delete_message(message.chat.id, preview_id)
+        except TelegramAPIError as error:
+            LOG.warning("Can't delete preview: %s", error)
+    await answer_waiters(await queue.finish_inflight(match_key), match)
+
+
+async def answer_waiters(
+    waiters: list[types.Message], match: tuple | None, text: str = FAILED_TEXT
+) -> None:
+    """Answers messages attached to the job with its match row or the `text` without it."""
+
+    for waiter in waiters:
+        try:
+            if match is None:
+                await waiter.reply(text)
+            else:
+                await answer_match(waiter, match)
+        except TelegramAPIError as error:
+            LOG.warning("Can't answer waiting user: %s", error)
+
+
+async def slow_down_and_send(
+    message: types.Message,
+    preset: Preset,
+    bitrate: float = 320.0,
+    info_message: types.Message | None = None,
+    prefetched: Prefetched | None = None,
+) -> bool:
+    """
+    Slows down audio and sends it to user. The progress is shown in `info_message`.
+    The audio is downloaded unless the file `prefetched` by the Bot exists.
+    Returns True if the audio is sent.
+    """
+
+    started = time.monotonic()
+    info_message = await show_status(message, preset, info_message)
+
+    if config.STREAMING:
+        # Audio is piped from Telegram through sox to the upload request
+        slowed = u_audio.slow_down_stream(
+            stream_file(message.audio),
+            preset,
+            duration=message.audio.duration or 0,
+            bitrate=bitrate,
+        )
+        sent = await send_slowed(message, preset, slowed, info_message)
+    else:
+        downloaded = prefetched["path"] if prefetched else None
+        if downloaded is not None and os.path.exists(downloaded):
+            spool.take_over(downloaded)
+        else:
+            # The Bot runs on another node or the file is swept while queued
+            with JOB_STAGE.time(stage="download"):
+                downloaded = await download_file(message.audio)
+        if not downloaded:
+            await editor.finish(
+                info_message,
+                "💾 Can't download your file. Please try again or come back later.",
+            )
+            return False
+
+        slowed_file = None
+        try:
+            slowed_file = await render_file(message, preset, bitrate, downloaded, info_message)
+            if slowed_file is None:
+                return False
+            fingerprint = prefetched["fingerprint"] if prefetched else None
+            sent = await send_slowed(message, preset, slowed_file, info_message, fingerprint)
+        finally:
+            spool.remove(downloaded, slowed_file)
+
+    # Throughput for estimated time of queued jobs, only rendered audio counts
+    if sent:
+        await message.bot.data["queue"].observe_ratio(
+            time.monotonic() - started, (message.audio.duration or 0) / preset.speed
+        )
+    return sent
+
+
+async def show_status(
+    message: types.Message, preset: Preset, info_message: types.Message | None
+) -> types.Message:
+    """Shows the start of recording in the status message, it's sent if there is none."""
+
+    text = f"{preset.title} - start recording for you..."
+    if info_message is None:
+        return await message.reply(
+            text, disable_notification=True, reply_markup=please_wait_button()
+        )
+    editor.update(info_message, text, please_wait_button())
+    return info_message
+
+
+def show_progress(info_message: types.Message, preset: Preset) -> Callable[[float], None]:
+    """Returns the callback which shows the done fraction of the render in the status message."""
+
+    def on_progress(fraction: float) -> None:
+        editor.update(info_message, progress_text(preset.title, fraction), please_wait_button())
+
+    return on_progress
+
+
+async def render_file(
+    message: types.Message,
+    preset: Preset,
+    bitrate: float,
+    downloaded: str,
+    info_message: types.Message,
+) -> str | None:
+    """Renders the downloaded audio and returns path to the slowed file or None."""
+
+    await message.answer_chat_action(types.ChatActions.RECORD_AUDIO)
 
-    await message.answer_chat_action(types.ChatActions.UPLOAD_AUDIO)
     try:
-        match_id = await db.create_empty_match(message.audio.file_unique_id)
-        if not match_id:
-            raise db.Error("Can't create match in database")
+        with JOB_STAGE.time(stage="render"):
+            slowed = await u_audio.slow_down(
+                downloaded,
+                preset,
+                duration=message.audio.duration or 0,
+                bitrate=bitrate,
+                on_progress=show_progress(info_message, preset),
+            )
+    except RenderTimeout:
+        await editor.finish(info_message, TIMEOUT_TEXT, reply_markup=None)
+        return None
+
+    if not slowed:
+        await editor.finish(info_message, FAILED_TEXT, reply_markup=None)
+        return None
 
+    return slowed
+
+
+async def send_slowed(
+    message: types.Message,
+    preset: Preset,
+    slowed: str | AsyncIterator[bytes],
+    info_message: types.Message,
+    fingerprint: int | None = None,
+) -> bool:
+    """
+    Uploads the slowed file (or the stream rendered while it is uploaded)
+    and publishes it to the Bot to be saved. Returns True if it's sent.
+    """
+
+    await message.answer_chat_action(types.ChatActions.UPLOAD_AUDIO)
+    try:
         file_name = await get_branded_file_name(
             message.audio.file_name or message.audio.file_unique_id
         )
-        thumb_file_exists = os.path.exists(config.ALBUM_ART)
         audio_info = message.audio.to_python()
-        tags = {
-            "performer": audio_info.get("performer"),
-            "title": audio_info.get("title"),
-            "thumb": types.InputFile(config.ALBUM_ART) if thumb_file_exists else None,
-        }
-        uploaded = await message.reply_audio(
-            audio=types.InputFile(slowed, filename=file_name),
-            caption=await get_caption(),
-            reply_markup=share_button(
-                str(match_id),
-                is_private=True,
-                is_random=False,
-            ),
-            **tags,
-        )
-        await info_message.delete()
-        await db.update_match(
-            match_id,
-            message.audio.file_unique_id,
-            uploaded.audio.file_id,
-            message.from_user.id,
+        if isinstance(slowed, str):
+            audio = types.InputFile(slowed, filename=file_name)
+        else:
+            audio = (file_name, slowed)
+        # Streamed audio is rendered while it is uploaded,
+        # buttons are added by the Bot when the track is saved
+        with JOB_STAGE.time(stage="upload" if isinstance(slowed, str) else "stream"):
+            uploaded = await message.reply_audio(
+                audio=audio,
+                caption=await get_caption(),
+                performer=audio_info.get("performer"),
+                title=audio_info.get("title"),
+                thumb=brand.thumb_file(),
+            )
+        await editor.finish(info_message)
+        await message.bot.data["queue"].publish(
+            save_match_task, message, preset, uploaded, fingerprint
         )
         return True
 
-    except db.Error as error:
-        LOG.error("Database error: %s", error)
-        await info_message.edit_text(
-            "💾 Can't save your file info to database. Please try again later."
-        )
-        return False
+    except RenderTimeout as error:
+        LOG.warning(error)
+        RENDER_TIMEOUTS.inc(mode="stream")
+        await editor.finish(info_message, TIMEOUT_TEXT, reply_markup=None)
+
+    except SoxError as error:
+        LOG.error(error)
+        SOX_FAILURES.inc(mode="stream")
+        await editor.finish(info_message, FAILED_TEXT, reply_markup=None)
 
     except TelegramAPIError as error:
         LOG.error(error)
-        await info_message.edit_text(
-            (f"🤷‍♂️ I'm sorry {message.from_user.username}, I'm afraid I can't do that.")
+        await editor.finish(
+            info_message,
+            f"🤷‍♂️ I'm sorry {message.from_user.username}, I'm afraid I can't do that.",
         )
-        return False
 
-    finally:
-        await queue.dec_user_queue(message.from_user.id)
-        os.remove(downloaded)
-        os.remove(slowed)
+    return False
 
 
 async def download_file(obj: Downloadable, **kwargs) -> str | None:
@@ -157,7 +634,7 @@ async def download_file(obj: Downloadable, **kwargs) -> str | None:
     """
 
     options = {
-        "destination_dir": config.DATA_DIR,
+        "destination_file": spool.new_file(),
         **kwargs,
     }
 
@@ -168,5 +645,26 @@ async def download_file(obj: Downloadable, **kwargs) -> str | None:
         return downloaded.name
     except Exception as error:  # pylint: disable=broad-except
         LOG.error(error)
+        spool.remove(options["destination_file"])
 
     return None
+
+
+async def stream_file(obj: Downloadable, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """
+    Yields chunks of the file directly from Telegram servers
+    without saving it to disk.
+    """
+
+    file = await obj.get_file()
+    bot = obj.bot
+    session = await bot.get_session()
+
+    async with session.get(
+        bot.get_file_url(file.file_path),
+        proxy=bot.proxy,
+        proxy_auth=bot.proxy_auth,
+        raise_for_status=True,
+    ) as response:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            yield chunk
@@ -46,11 +46,11 @@ async def command_random(message: types.Message):
 
     if match := await db.get_by_pk("match", int(random_id)):
         await message.answer_chat_action(types.ChatActions.UPLOAD_AUDIO)
-        (idc, file_unique_id, file_id, user_id, is_private, *_) = match
+        (idc, _, file_id, user_id, is_private, *_) = match
 
         if user_id == message.from_user.id:
             keyboard = share_button(
-                file_unique_id,
+                idc,
                 is_private=is_private,
                 is_random=True,
             )
@@ -135,6 +135,7 @@ async def command_help(message: types.Message):
         "Send me an <code>MP3</code> audio file "
         "or use one of the following commands:\n\n"
         "/random to get and listen shared tunes.\n"
+        "/preset to choose effects for your audio.\n"
         "/about additional info and author contacts.\n"
         "/help this help message.\n\n"
         "<b>How it works:</b>\n"
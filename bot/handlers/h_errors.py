@@ -1,6 +1,7 @@
 from aiogram import types
 
 from bot.utils.u_logger import get_logger
+from bot.utils.u_progress import format_duration
 
 LOG = get_logger()
 
@@ -75,3 +76,34 @@ async def queue_limit_reached(update: types.Update, error: Exception):
         )
     )
     return True
+
+
+async def queue_overloaded(update: types.Update, error: Exception):
+    """Error handler for QueueOverloaded exception."""
+
+    LOG.info(
+        "Queue is overloaded <user_id=%d drain_time=%s>",
+        update.message.from_user.id,
+        error,
+    )
+    await update.message.reply(
+        (
+            "🚦 I'm very busy right now, your track would wait about "
+            f"{format_duration(error.message)}. Please try again later."
+        )
+    )
+    return True
+
+
+async def output_too_big(update: types.Update, error: Exception):
+    """Error handler for OutputTooBig exception."""
+
+    LOG.info(
+        "Slowed audio is too big <file_id=%s predicted_size=%s>",
+        update.message.audio.file_id,
+        error,
+    )
+    await update.message.reply(
+        "💾 Sorry! Slowed audio will be too long to send it. Max upload size is 50 MB."
+    )
+    return True
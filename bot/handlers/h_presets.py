@@ -0,0 +1,43 @@
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.utils.exceptions import MessageNotModified
+
+from bot.keyboards.k_presets import presets_buttons
+from bot.utils.u_presets import PRESETS, get_preset
+
+
+async def get_user_preset(state: FSMContext):
+    """Returns preset selected by user."""
+
+    data = await state.get_data()
+    return get_preset(data.get("preset"))
+
+
+async def command_preset(message: types.Message, state: FSMContext):
+    """Handler for `/preset` command. Shows buttons to select the preset."""
+
+    preset = await get_user_preset(state)
+
+    await message.answer(
+        "🎚 Choose how to process your audio:",
+        reply_markup=presets_buttons(preset.name),
+        disable_notification=True,
+    )
+
+
+async def select_preset(
+    query: types.CallbackQuery, callback_data: dict, state: FSMContext
+):
+    """Handler for selection of the preset."""
+
+    if callback_data["name"] not in PRESETS:
+        return await query.answer("Sorry! This preset is not available anymore.")
+
+    preset = get_preset(callback_data["name"])
+    await state.update_data(preset=preset.name)
+    await query.answer(f"{preset.title} is selected.")
+
+    try:
+        await query.message.edit_reply_markup(presets_buttons(preset.name))
+    except MessageNotModified:
+        pass
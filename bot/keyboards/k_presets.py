@@ -0,0 +1,21 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.callback_data import CallbackData
+
+from bot.utils.u_presets import PRESETS
+
+presets_cbd = CallbackData("preset", "name")
+
+
+def presets_buttons(current: str) -> InlineKeyboardMarkup:
+    """Returns markup for selection of the preset."""
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    for preset in PRESETS.values():
+        markup.insert(
+            InlineKeyboardButton(
+                text=f"✅ {preset.title}" if preset.name == current else preset.title,
+                callback_data=presets_cbd.new(name=preset.name),
+            )  # pyright: ignore[reportArgumentType]
+        )
+
+    return markup
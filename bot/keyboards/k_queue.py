@@ -0,0 +1,19 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.callback_data import CallbackData
+
+queue_cbd = CallbackData("queue", "action", "job_id")
+
+
+def cancel_button(job_id: str) -> InlineKeyboardMarkup:
+    """Returns markup for Cancel button of the queued job."""
+
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✖ Cancel",
+                    callback_data=queue_cbd.new(action="cancel", job_id=job_id),
+                ),  # pyright: ignore[reportArgumentType]
+            ]
+        ]
+    )
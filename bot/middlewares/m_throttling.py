@@ -6,6 +6,7 @@ from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.utils.exceptions import Throttled
 
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import THROTTLED
 
 LOG = get_logger()
 
@@ -40,6 +41,7 @@ class ThrottlingMiddleware(BaseMiddleware):
         try:
             await dispatcher.throttle(key, rate=self.rate)
         except Throttled as error:
+            THROTTLED.inc(handler=key)
             LOG.debug(
                 "Prevent flooding <user_id=%s handler=%s>",
                 obj.from_user.id,
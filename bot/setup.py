@@ -1,10 +1,11 @@
 import asyncio
 from sqlite3 import Error as SqliteError
 
-from aiogram import Dispatcher, filters, types
+from aiogram import Bot, Dispatcher, filters, types
 from aiogram.utils.exceptions import FileIsTooBig, MessageNotModified
 
 from bot import db
+from bot.config import config
 from bot.handlers import (
     h_admin,
     h_audio,
@@ -12,18 +13,32 @@ from bot.handlers import (
     h_common,
     h_errors,
     h_likes,
+    h_presets,
     h_report,
     h_share,
 )
 from bot.keyboards.k_admin import tunes_list_cbd
+from bot.keyboards.k_presets import presets_cbd
 from bot.keyboards.k_public import public_cbd
+from bot.keyboards.k_queue import queue_cbd
 from bot.keyboards.k_random import random_cbd
 from bot.keyboards.k_share import share_cbd
-from bot.utils.u_exceptions import NotSupportedFormat, QueueLimitReached
+from bot.utils.u_brand import brand
+from bot.utils.u_exceptions import (
+    NotSupportedFormat,
+    OutputTooBig,
+    QueueLimitReached,
+    QueueOverloaded,
+)
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import MetricsServer
+from bot.utils.u_pool import render_pool
+from bot.utils.u_progress import editor, watcher
 from bot.utils.u_queue import Queue
+from bot.utils.u_spool import spool
 
 LOG = get_logger()
+metrics_server = MetricsServer(config.APP_HOST, config.APP_PORT)
 
 
 def register_handlers(dp: Dispatcher):
@@ -39,6 +54,10 @@ def register_handlers(dp: Dispatcher):
         h_errors.not_supported_format,
         exception=NotSupportedFormat,
     )
+    dp.register_errors_handler(
+        h_errors.output_too_big,
+        exception=OutputTooBig,
+    )
     dp.register_errors_handler(
         h_errors.database_error,
         exception=SqliteError,
@@ -51,6 +70,10 @@ def register_handlers(dp: Dispatcher):
         h_errors.queue_limit_reached,
         exception=QueueLimitReached,
     )
+    dp.register_errors_handler(
+        h_errors.queue_overloaded,
+        exception=QueueOverloaded,
+    )
     dp.register_errors_handler(
         h_errors.global_error_handler, exception=Exception
     )  # Should be last among errors handlers
@@ -71,10 +94,22 @@ def register_handlers(dp: Dispatcher):
         h_commands.command_random,
         commands=["random"],
     )
+    dp.register_message_handler(
+        h_presets.command_preset,
+        commands=["preset"],
+    )
+    dp.register_callback_query_handler(
+        h_presets.select_preset,
+        presets_cbd.filter(),
+    )
     dp.register_message_handler(
         h_audio.processing_audio,
         content_types=[types.ContentType.AUDIO],
     )
+    dp.register_callback_query_handler(
+        h_audio.cancel_job,
+        queue_cbd.filter(action="cancel"),
+    )
 
     # Admin handlers
     dp.register_message_handler(
@@ -91,6 +126,21 @@ def register_handlers(dp: Dispatcher):
         h_admin.tunes_pagging,
         tunes_list_cbd.filter(flag="ok"),
     )
+    dp.register_message_handler(
+        h_admin.command_queue,
+        is_admin=True,
+        commands=["queue"],
+    )
+    dp.register_message_handler(
+        h_admin.move_up,
+        filters.RegexpCommandsFilter(regexp_commands=["up_([0-9a-f]+)"]),
+        is_admin=True,
+    )
+    dp.register_message_handler(
+        h_admin.command_refresh,
+        is_admin=True,
+        commands=["refresh"],
+    )
     dp.register_message_handler(
         h_admin.command_admin,
         is_admin=True,
@@ -156,6 +206,49 @@ def register_handlers(dp: Dispatcher):
     dp.register_message_handler(h_common.answer_message)
 
 
+async def start_queue(bot: Bot, workers: int, collect: bool = False):
+    """
+    Connects the queue and starts render processes and loop workers for it.
+    The queue of the Bot `collect`s results of jobs to save them to the database.
+    """
+
+    # Sweeps temporary files left by the previous run, the Bot downloads
+    # audio to fingerprint it before the job is queued
+    await spool.start()
+    if workers:
+        render_pool.start()
+
+    bot.data.update(
+        queue=await Queue.create(
+            workers=workers, visibility=config.QUEUE_VISIBILITY_TIMEOUT, collect=collect
+        )
+    )
+    asyncio.create_task(bot.data["queue"].start())
+
+    # Status messages of queued and running jobs
+    editor.start()
+    watcher.start(bot.data["queue"])
+
+
+async def stop_queue(bot: Bot):
+    """
+    Stops the queue and render processes. Running jobs are given
+    QUEUE_DRAIN_TIMEOUT seconds to finish, then they are requeued.
+    """
+
+    await bot.data["queue"].drain(config.QUEUE_DRAIN_TIMEOUT)
+
+    watcher.stop()
+    editor.stop()
+
+    # Close Queue connection
+    await bot.data["queue"].stop()
+
+    # Stop render processes
+    render_pool.stop()
+    spool.stop()
+
+
 async def on_startup(dp: Dispatcher):
     """Execute function before Bot start polling."""
 
@@ -165,16 +258,22 @@ async def on_startup(dp: Dispatcher):
     await dp.bot.delete_webhook(drop_pending_updates=True)
     register_handlers(dp)
 
+    # Cache the Bot identity and album art for branding of audio
+    await brand.refresh(dp.bot)
+
     commands = [
         types.BotCommand("random", "get some slowed tune"),
+        types.BotCommand("preset", "choose effects for your audio"),
         types.BotCommand("help", "if you stuck"),
         types.BotCommand("about", "bot info"),
     ]
     await dp.bot.set_my_commands(commands)
 
-    # Starts loop worker for the queue
-    dp.bot.data.update(queue=await Queue.create())
-    asyncio.create_task(dp.bot.data["queue"].start())
+    if config.METRICS:
+        await metrics_server.start()
+
+    # Jobs are run by the bot itself or by standalone workers only
+    await start_queue(dp.bot, render_pool.workers if config.LOCAL_WORKERS else 0, collect=True)
 
 
 async def on_shutdown(dp: Dispatcher):
@@ -182,8 +281,9 @@ async def on_shutdown(dp: Dispatcher):
 
     LOG.info("Execute shutdown Bot functions...")
 
-    # Close Queue connection
-    await dp.bot.data["queue"].stop()
+    await stop_queue(dp.bot)
+    await metrics_server.stop()
+    db.close()
 
     # Close storage
     await dp.storage.close()
@@ -1,7 +1,10 @@
+import html
+
 from aiogram import Bot, types
 from aiogram.dispatcher.filters import BoundFilter
 
 from bot.config import config
+from bot.utils.u_queue import PRIORITY_LANE
 
 from .u_logger import get_logger
 
@@ -33,6 +36,26 @@ def get_tunes_list(data: list) -> str:
     return str_list
 
 
+def get_queue_list(jobs: list, limit: int = 30) -> str:
+    """Generate table for queued jobs list."""
+
+    str_list = "<b>Queued tasks:</b>\n\n"
+
+    for job in jobs[:limit]:
+        name = html.escape(job.audio.get("file_name") or job.func)
+        user = f'<a href="tg://user?id={job.user_id}">{job.user_id}</a>' if job.user_id else "-"
+        line = f"{job.position}. {name} ({round(job.duration)} s) by {user}"
+        if job.lane == PRIORITY_LANE:
+            str_list += f"{line} ⚡\n"
+        else:
+            str_list += f"{line} /up_{job.id}\n"
+
+    if len(jobs) > limit:
+        str_list += f"\n...and {len(jobs) - limit} more."
+
+    return str_list
+
+
 async def get_username_by_id(bot: Bot, user_id: int):
     """Retrieves the username or user ID."""
 
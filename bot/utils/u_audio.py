@@ -1,62 +1,279 @@
 import asyncio
+import io
+import signal
+from typing import AsyncIterable, AsyncIterator, Callable
+
+from sox.core import SoxError
 
 from bot.config import config
+from bot.utils.u_engine import Target, get_engine
+from bot.utils.u_exceptions import RenderTimeout
+from bot.utils.u_limits import limit_cpu
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import RENDER_TIMEOUTS, SOX_FAILURES
+from bot.utils.u_pool import render_deadline, render_pool
+from bot.utils.u_presets import Preset, get_preset
+from bot.utils.u_segments import render_by_segments
+from bot.utils.u_soxex import ExtTransformer
+from bot.utils.u_spool import spool
 from bot.utils.u_tagging import Tagging
 
-from .u_soxex import ExtTransformer
-
 LOG = get_logger()
+CHUNK_SIZE = 65536
+PROGRESS_POLL = 1  # Seconds between reads of the render progress
+REPLACED_FRAMES = ("APIC", "WOAR")  # Frames which the brand replaces
+
+
+def render(
+    file_path: str, target: Target, preset_name: str, progress_path: str | None = None
+) -> None:
+    """
+    This function applies effects chain of the preset to audio file
+    and writes it to the `target` file. Seconds of audio processed
+    are written to `progress_path` if given.
+    It runs in the worker process of the render pool.
+    """
+
+    def report(seconds: float) -> None:
+        with open(progress_path, "w", encoding="utf-8") as file:  # type: ignore
+            file.write(f"{seconds:.1f}")
 
+    options = {"spares": config.SOX_SPARES} if config.AUDIO_ENGINE == "sox" else {}
+    engine = get_engine(config.AUDIO_ENGINE, **options)
+    engine.render(
+        file_path,
+        target,
+        get_preset(preset_name),
+        progress=report if progress_path else None,
+    )
 
-async def slow_down(file_path: str, speed: float = 33 / 45) -> str | None:
-    """This function slow down audio file."""
+
+async def slow_down(
+    file_path: str,
+    preset: Preset,
+    duration: float = 0,
+    bitrate: float = 320.0,
+    on_progress: Callable[[float], None] | None = None,
+) -> str | None:
+    """
+    This function slow down audio file. Audio longer than `SEGMENT_THRESHOLD`
+    is rendered by segments in parallel. `on_progress` is called with
+    the done fraction of the render if the audio is rendered at once.
+    Raises RenderTimeout if rendering exceeds the deadline.
+    """
 
     slowed_file_path = f"{file_path[:-4]}_slow.mp3"
+    segmented = is_segmented(duration)
+    mode = "segments" if segmented else config.AUDIO_ENGINE
+    timeout = render_deadline(duration)
+    progress_path = None
+    poller = None
+    if on_progress is not None and not segmented and duration > 0:
+        progress_path = f"{file_path[:-4]}_progress.txt"
+        poller = asyncio.create_task(poll_progress(progress_path, duration, on_progress))
 
     try:
-        chain = ExtTransformer()
-        chain.upsample(1)
-        chain.speed(speed)
-        chain.norm(-1)
-        chain.highpass(50)
-        chain.bass(1)
-        # chain.equalizer(85, 1, 5)  # bass boost
-        # chain.equalizer(120, 1, 5)  # bass boost
-        chain.reverb(
-            reverberance=50,
-            high_freq_damping=50,
-            room_scale=100,
-            stereo_depth=50,
-        )
-        chain.lowpass(16000)
-        chain.fade(fade_out_len=1)
-
-        # Run function in separate thread to non-blocking stack
-        await asyncio.to_thread(
-            chain.build,
-            input_filepath=file_path,
-            output_filepath=slowed_file_path,
-            bitrate=320.0,
-        )
-
-        await fill_id3_tags(file_path, slowed_file_path)
+        # Tags are rendered before audio, so the file is written once
+        target = Target(slowed_file_path, await render_id3_tags(file_path), bitrate)
+
+        if segmented:
+            await render_by_segments(file_path, target, preset, timeout=timeout)
+        else:
+            # Run function in separate process to not block the event loop
+            await render_pool.run(
+                render, file_path, target, preset.name, progress_path, timeout=timeout
+            )
+
+    except RenderTimeout:
+        LOG.warning("Rendering of %s exceeded deadline of %s s.", file_path, timeout)
+        RENDER_TIMEOUTS.inc(mode=mode)
+        spool.remove(slowed_file_path)
+        raise
 
     except Exception as error:  # pylint: disable=broad-except
         LOG.error(error)
+        SOX_FAILURES.inc(mode=mode)
+        spool.remove(slowed_file_path)
         slowed_file_path = None
 
+    finally:
+        if poller is not None:
+            poller.cancel()
+            spool.remove(progress_path)
+
     return slowed_file_path
 
 
-async def fill_id3_tags(src_path: str, dst_path: str) -> None:
+async def poll_progress(
+    progress_path: str, duration: float, on_progress: Callable[[float], None]
+) -> None:
+    """Reads progress written by the render worker and reports its fraction."""
+
+    while True:
+        await asyncio.sleep(PROGRESS_POLL)
+        try:
+            with open(progress_path, encoding="utf-8") as file:
+                seconds = float(file.read())
+        except (OSError, ValueError):  # Not written yet or being written
+            continue
+        on_progress(min(seconds / duration, 0.99))
+
+
+def is_segmented(duration: float) -> bool:
+    """Returns True if audio of the `duration` is rendered by segments."""
+
+    return bool(
+        config.AUDIO_ENGINE == "sox"
+        and config.SEGMENT_THRESHOLD
+        and duration >= config.SEGMENT_THRESHOLD
+        and render_pool.workers > 1
+    )
+
+
+async def slow_down_stream(
+    chunks: AsyncIterable[bytes],
+    preset: Preset,
+    duration: float = 0,
+    bitrate: float = 320.0,
+) -> AsyncIterator[bytes]:
+    """
+    This function slow down audio stream. It pipes chunks of the source
+    MP3 to sox and yields ID3 tags followed by chunks of slowed audio.
+    Nothing is written to disk.
+    """
+
+    head, chunks = await split_id3_head(chunks)
+    yield await render_id3_tags(io.BytesIO(head))
+
+    chain = preset.chain(duration=duration)
+    async for chunk in pipe(chain, chunks, bitrate, timeout=render_deadline(duration)):
+        yield chunk
+
+
+async def render_preview(
+    chunks: AsyncIterable[bytes],
+    preset: Preset,
+    length: float,
+    bitrate: float = 320.0,
+) -> bytes:
+    """
+    This function slow down the first `length` seconds of audio stream.
+    Only the beginning of the stream is read.
+    """
+
+    chain = preset.preview_chain(length)
+    timeout = render_deadline(length)
+    return b"".join([chunk async for chunk in pipe(chain, chunks, bitrate, timeout=timeout)])
+
+
+async def pipe(
+    chain: ExtTransformer,
+    chunks: AsyncIterable[bytes],
+    bitrate: float = 320.0,
+    timeout: float | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    It pipes chunks of MP3 through sox process with the chain. The process
+    is killed and RenderTimeout is raised after `timeout` seconds.
+    """
+
+    process = await asyncio.create_subprocess_exec(
+        *chain.stream_args(bitrate=bitrate),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    if timeout:
+        limit_cpu(timeout, pid=process.pid)
+    expired = False
+
+    def expire():
+        nonlocal expired
+        expired = True
+        process.kill()
+
+    timer = asyncio.get_running_loop().call_later(timeout, expire) if timeout else None
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)  # type: ignore
+                await process.stdin.drain()  # type: ignore
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Sox stops reading when the chain ends (e.g. by `trim`)
+        finally:
+            process.stdin.close()  # type: ignore
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()  # type: ignore
+
+    feeder = asyncio.create_task(feed())
+    errors = asyncio.create_task(process.stderr.read())  # type: ignore
+
+    try:
+        while chunk := await process.stdout.read(CHUNK_SIZE):  # type: ignore
+            yield chunk
+
+        await feeder
+        if await process.wait() != 0:
+            if expired or process.returncode == -signal.SIGXCPU:
+                raise RenderTimeout("Rendering exceeded its deadline")
+            raise SoxError(f"Stderr: {(await errors).decode()}")
+
+        LOG.info("Streamed audio with effects: %s", " ".join(chain.effects_log))
+
+    finally:
+        if timer is not None:
+            timer.cancel()
+        feeder.cancel()
+        errors.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+async def split_id3_head(
+    chunks: AsyncIterable[bytes],
+) -> tuple[bytes, AsyncIterator[bytes]]:
+    """
+    It reads ID3v2 tag from the beginning of the stream.
+    Returns bytes of the tag and iterator over the rest of the stream.
+    """
+
+    iterator = aiter(chunks)
+    buffer = b""
+    size = 0
+
+    async for chunk in iterator:
+        buffer += chunk
+        if len(buffer) < 10:
+            continue
+        if buffer[:3] != b"ID3":
+            break
+        # Tag size is stored as 28 bit syncsafe integer
+        size = 10 + sum((byte & 0x7F) << (7 * (3 - i)) for i, byte in enumerate(buffer[6:10]))
+        if buffer[5] & 0x10:  # Footer is present
+            size += 10
+        if len(buffer) >= size:
+            break
+
+    head, rest = buffer[:size], buffer[size:]
+
+    async def tail():
+        if rest:
+            yield rest
+        async for chunk in iterator:
+            yield chunk
+
+    return head, tail()
+
+
+async def render_id3_tags(source: str | io.BytesIO) -> bytes:
     """
-    It opies the ID3 tags from the source file to the destination file,
-    adds a brand text, and attach album art image.
+    It copies the ID3 tags from the source, adds a brand text and
+    album art image and returns them as bytes.
     """
 
-    tags = Tagging(dst_path)
-    tags.copy_from(src_path)
+    tags = Tagging(io.BytesIO())
+    tags.copy_from(source, skip=REPLACED_FRAMES)
     await tags.add_brand()
-    tags.add_cover(config.ALBUM_ART)
-    tags.save()
+    return tags.to_bytes()
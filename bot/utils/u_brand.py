@@ -1,21 +1,110 @@
+from __future__ import annotations
+
+import io
 import os
 
-from aiogram import Bot
+from aiogram import Bot, types
+from mutagen import id3
+
+from bot.config import config
+
+from .u_logger import get_logger
+
+LOG = get_logger()
+
+
+class Brand:
+    """
+    Cache of the Bot identity and branding of processed audio. It is filled
+    at startup and on explicit refresh, so jobs don't call `getMe` and
+    don't read the album art from disk.
+    """
+
+    def __init__(self) -> None:
+        self.username: str | None = None
+        self.mention = ""
+        self.caption = ""
+        self.comment = ""
+        self.thumb: bytes | None = None
+        self.cover: id3.APIC | None = None
+
+    @property
+    def is_loaded(self) -> bool:
+        """True if the cache is filled."""
+
+        return self.username is not None
+
+    async def refresh(self, bot: Bot | None = None) -> None:
+        """Fetches the Bot identity and rereads the album art."""
+
+        bot_info = await (bot or Bot.get_current()).get_me()
+        self.load(bot_info.username)
+
+        LOG.info("Brand cache is refreshed for %s.", self.mention)
+
+    def load(self, username: str, album_art: str | None = None) -> None:
+        """Fills the cache for the Bot with the given username."""
+
+        self.username = username
+        self.mention = f"@{username}"
+        self.caption = f"Slowed by {self.mention}"
+        self.comment = f"Slowed down by {self.mention}"
+        self.thumb = self.read_image(album_art or config.ALBUM_ART)
+        self.cover = (
+            id3.APIC(
+                type=id3.PictureType.COVER_FRONT,
+                mime="image/jpeg",
+                desc="Cover",
+                data=self.thumb,
+            )
+            if self.thumb
+            else None
+        )
+
+    def thumb_file(self) -> types.InputFile | None:
+        """Returns the album art to upload as thumbnail of audio."""
+
+        if self.thumb is None:
+            return None
+        return types.InputFile(io.BytesIO(self.thumb), filename="thumb.jpg")
+
+    @staticmethod
+    def read_image(file_path: str) -> bytes | None:
+        """
+        If the file exists, read it and return the bytes,
+        otherwise return None.
+        """
+
+        try:
+            with open(file_path, "rb") as raw:
+                return raw.read()
+        except IOError as error:
+            LOG.warning("Can't read image file %s - %s", file_path, error)
+
+        return None
+
+
+brand = Brand()
+
+
+async def get_brand() -> Brand:
+    """Returns the brand cache, fills it on first use."""
+
+    if not brand.is_loaded:
+        await brand.refresh()
+    return brand
 
 
 async def get_bot_mention() -> str:
     """Returns mention to Bot."""
 
-    bot = Bot.get_current()
-    bot_info = await bot.get_me()
-    return f"@{bot_info.username}"
+    return (await get_brand()).mention
 
 
 async def get_caption() -> str:
     """Returns branded caption for audio message."""
 
-    mention = await get_bot_mention()
-    return f"Slowed by {mention}"
+    return (await get_brand()).caption
 
 
 async def get_branded_file_name(full_path: str) -> str:
@@ -29,5 +118,4 @@ async def get_branded_file_name(full_path: str) -> str:
 async def get_tag_comment() -> str:
     """Returns branded comment for audio tag."""
 
-    mention = await get_bot_mention()
-    return f"Slowed down to 44/33 vinyl rpm ratio by {mention}"
+    return (await get_brand()).comment
@@ -0,0 +1,403 @@
+import io
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Callable
+
+import numpy as np
+
+from bot.utils.u_exceptions import EngineNotAvailable
+from bot.utils.u_logger import get_logger
+
+from .u_presets import BASS, FADE_OUT, HIGHPASS, LOWPASS, NORM, Preset
+from .u_soxex import ExtTransformer, SoxSpares
+
+try:
+    import soundfile
+except ImportError:  # NumPy engine is optional
+    soundfile = None
+
+LOG = get_logger()
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    Slowed file which audio is rendered to. The `header` (ID3 tag) is
+    written before the audio data, so the file is never rewritten to tag it.
+    """
+
+    path: str
+    header: bytes = b""
+    bitrate: float = 320.0
+
+
+class Engine(ABC):
+    """Base class of the engine which applies effects chain to audio file."""
+
+    name = ""
+
+    @abstractmethod
+    def render(
+        self,
+        file_path: str,
+        target: Target,
+        preset: Preset,
+        progress: Callable[[float], None] | None = None,
+    ) -> None:
+        """
+        Slow down audio file and save result to the `target` file.
+        The engine may call `progress` with seconds of the source audio processed.
+        """
+
+
+class SoxEngine(Engine):
+    """Reference engine which runs effects chain by sox process."""
+
+    name = "sox"
+
+    def __init__(self, spares: int = 0) -> None:
+        # Warm sox processes of the worker of the render pool
+        self.spares = SoxSpares(spares) if spares else None
+
+    def render(self, file_path, target, preset, progress=None):
+        # Reuse prebuilt effects arguments of the preset
+        chain = ExtTransformer()
+        chain.effects, chain.effects_log = preset.effects, preset.effects_log
+        with open(file_path, "rb") as source, open(target.path, "wb") as output:
+            output.write(target.header)
+            chain.build_pipe(
+                source, output, bitrate=target.bitrate, spares=self.spares, progress=progress
+            )
+
+
+class OffsetFile:
+    """
+    File object which hides the first `offset` bytes of the file,
+    so `soundfile` can write audio after the header already written.
+    """
+
+    def __init__(self, file: BinaryIO, offset: int) -> None:
+        self.file = file
+        self.offset = offset
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        """Moves to the position counted from the end of the header."""
+
+        if whence == io.SEEK_SET:
+            position += self.offset
+        return self.file.seek(position, whence) - self.offset
+
+    def tell(self) -> int:
+        """Returns the position counted from the end of the header."""
+
+        return self.file.tell() - self.offset
+
+    def read(self, size: int = -1) -> bytes:
+        """Reads from the current position of the file."""
+
+        return self.file.read(size)
+
+    def write(self, data: bytes) -> int:
+        """Writes at the current position of the file."""
+
+        return self.file.write(data)
+
+
+class Resampler:
+    """
+    Streaming windowed sinc resampler. It changes speed (and pitch)
+    of audio by `ratio` like sox `speed` effect.
+    """
+
+    BATCH = 1 << 15
+    PHASES = 1024
+
+    def __init__(self, ratio: float, channels: int, taps: int = 32) -> None:
+        self.step = ratio
+        self.half = taps // 2
+        self.offsets = np.arange(-self.half + 1, self.half + 1)
+        self.cutoff = min(1.0, 1.0 / ratio)
+        self.buffer = np.zeros((self.half, channels), dtype=np.float32)
+        self.position = float(self.half)
+        # Polyphase table of filter weights for quantized fractional positions
+        self.table = self.weights(np.arange(self.PHASES + 1) / self.PHASES)
+
+    def weights(self, fractions: np.ndarray) -> np.ndarray:
+        """Returns sinc filter weights for fractional positions."""
+
+        x = fractions[:, None] - self.offsets[None, :]
+        window = (
+            0.42
+            + 0.5 * np.cos(np.pi * x / self.half)
+            + 0.08 * np.cos(2 * np.pi * x / self.half)
+        )
+        return (self.cutoff * np.sinc(self.cutoff * x) * window).astype(np.float32)
+
+    def push(self, block: np.ndarray) -> np.ndarray:
+        """Add block of samples and return resampled samples available so far."""
+
+        self.buffer = np.concatenate((self.buffer, block))
+        limit = len(self.buffer) - self.half
+        count = max(int(np.ceil((limit - self.position) / self.step)), 0)
+        result = np.empty((count, self.buffer.shape[1]), dtype=np.float32)
+
+        for start in range(0, count, self.BATCH):
+            steps = np.arange(start, min(start + self.BATCH, count))
+            positions = self.position + steps * self.step
+            index = np.floor(positions).astype(np.int64)
+            samples = self.buffer[index[:, None] + self.offsets[None, :]]
+            phases = np.rint((positions - index) * self.PHASES).astype(np.int64)
+            result[start : start + len(positions)] = np.einsum(
+                "nt,ntc->nc", self.table[phases], samples
+            )
+
+        position = self.position + count * self.step
+        cut = int(position) - self.half
+        self.buffer = self.buffer[cut:]
+        self.position = position - cut
+
+        return result
+
+    def flush(self) -> np.ndarray:
+        """Returns the rest of resampled samples."""
+
+        padding = self.half + int(np.ceil(self.step)) + 1
+        return self.push(np.zeros((padding, self.buffer.shape[1]), dtype=np.float32))
+
+
+class Convolver:
+    """
+    Streaming FFT convolution (overlap-add) of multichannel audio
+    with per channel impulse responses.
+    """
+
+    def __init__(self, impulse_response: np.ndarray) -> None:
+        channels, length = impulse_response.shape
+        self.fft_size = 1 << int(np.ceil(np.log2(2 * length)))
+        self.hop = self.fft_size - length + 1
+        self.spectrum = np.fft.rfft(impulse_response, n=self.fft_size, axis=1).T
+        self.pending = np.zeros((0, channels), dtype=np.float32)
+        self.tail = np.zeros((self.fft_size - self.hop, channels), dtype=np.float32)
+
+    def push(self, block: np.ndarray) -> np.ndarray:
+        """Add block of samples and return convolved samples available so far."""
+
+        buffer = np.concatenate((self.pending, block))
+        count = len(buffer) // self.hop
+        self.pending = buffer[count * self.hop :]
+        if not count:
+            return np.zeros((0, buffer.shape[1]), dtype=np.float32)
+
+        chunks = buffer[: count * self.hop].reshape(count, self.hop, -1)
+        spectrum = np.fft.rfft(chunks, n=self.fft_size, axis=1) * self.spectrum[None]
+        convolved = np.fft.irfft(spectrum, n=self.fft_size, axis=1).astype(np.float32)
+
+        overlap = self.fft_size - self.hop
+        result = convolved[:, : self.hop].copy()
+        result[1:, :overlap] += convolved[:-1, self.hop :]
+        result[0, :overlap] += self.tail
+        self.tail = convolved[-1, self.hop :].copy()
+
+        return result.reshape(count * self.hop, -1)
+
+    def flush(self) -> np.ndarray:
+        """Returns the rest of convolved samples."""
+
+        padding = self.hop - len(self.pending)
+        return self.push(np.zeros((padding, self.pending.shape[1]), dtype=np.float32))
+
+
+def biquad_response(b: tuple, a: tuple, frequencies: np.ndarray, sample_rate: int):
+    """Returns complex frequency response of the biquad filter."""
+
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    return (b[0] + b[1] * z + b[2] * z**2) / (a[0] + a[1] * z + a[2] * z**2)
+
+
+def filters_response(frequencies: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Returns frequency response of highpass, bass and lowpass filters.
+    Coefficients are the same as sox uses (RBJ Audio EQ Cookbook).
+    """
+
+    def coefficients(frequency):
+        w0 = 2 * np.pi * frequency / sample_rate
+        return np.cos(w0), np.sin(w0)
+
+    # Highpass and lowpass with Q = 0.707
+    cos, sin = coefficients(HIGHPASS)
+    alpha = sin / (2 * 0.707)
+    response = biquad_response(
+        ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2),
+        (1 + alpha, -2 * cos, 1 - alpha),
+        frequencies,
+        sample_rate,
+    )
+
+    cos, sin = coefficients(LOWPASS)
+    alpha = sin / (2 * 0.707)
+    response *= biquad_response(
+        ((1 - cos) / 2, 1 - cos, (1 - cos) / 2),
+        (1 + alpha, -2 * cos, 1 - alpha),
+        frequencies,
+        sample_rate,
+    )
+
+    # Bass is a low shelf at 100 Hz with slope 0.5
+    cos, sin = coefficients(100)
+    gain = 10 ** (BASS / 40)
+    alpha = sin / 2 * np.sqrt((gain + 1 / gain) * (1 / 0.5 - 1) + 2)
+    beta = 2 * np.sqrt(gain) * alpha
+    response *= biquad_response(
+        (
+            gain * ((gain + 1) - (gain - 1) * cos + beta),
+            2 * gain * ((gain - 1) - (gain + 1) * cos),
+            gain * ((gain + 1) - (gain - 1) * cos - beta),
+        ),
+        (
+            (gain + 1) + (gain - 1) * cos + beta,
+            -2 * ((gain - 1) + (gain + 1) * cos),
+            (gain + 1) + (gain - 1) * cos - beta,
+        ),
+        frequencies,
+        sample_rate,
+    )
+
+    return response
+
+
+# pylint: disable-next=too-many-locals
+def reverb_response(sample_rate: int, channels: int, reverb: dict) -> np.ndarray:
+    """
+    Returns impulse responses of the reverb for every channel. It is
+    exponentially decaying noise, high frequencies decay faster.
+    The `reverb` has parameters of sox `reverb` effect of the preset.
+    """
+
+    reverberance, room_scale = reverb["reverberance"], reverb["room_scale"]
+    high_freq_damping, stereo_depth = reverb["high_freq_damping"], reverb["stereo_depth"]
+    rt60 = 0.2 + 2.8 * reverberance / 100 * (0.5 + room_scale / 200)
+    length = int(rt60 * sample_rate)
+    time = np.arange(length) / sample_rate
+    noise = np.random.default_rng(0).standard_normal((2, length))
+
+    # Decorrelate channels according to stereo depth
+    depth = stereo_depth / 100
+    noise[1] = (1 - depth) * noise[0] + depth * noise[1]
+
+    spectrum = np.fft.rfft(noise, axis=1)
+    low = np.fft.irfft(
+        spectrum * (np.fft.rfftfreq(length, 1 / sample_rate) < 2000), n=length, axis=1
+    )
+    high = noise - low
+    damping = 1 - 0.8 * high_freq_damping / 100
+    wet = low * np.exp(-6.9 * time / rt60) + high * np.exp(-6.9 * time / (rt60 * damping))
+
+    # Wet part is -6 dB to the dry signal and starts after 10 ms of pre-delay
+    wet[:, : int(0.01 * sample_rate)] = 0
+    wet *= np.sqrt(0.25 / np.sum(wet**2, axis=1, keepdims=True))
+    wet[:, 0] += 1
+
+    return wet[:channels] if channels <= 2 else np.resize(wet, (channels, length))
+
+
+class NumpyEngine(Engine):
+    """
+    Engine which applies effects chain to decoded audio in process
+    with vectorized NumPy operations. It requires `soundfile` module.
+    """
+
+    name = "numpy"
+    BLOCK_SIZE = 1 << 17
+    FILTER_LENGTH = 8192
+
+    def __init__(self) -> None:
+        if soundfile is None:
+            raise EngineNotAvailable("NumPy engine requires `soundfile` module.")
+        self.__responses: dict[tuple, np.ndarray] = {}
+
+    def impulse_response(self, sample_rate: int, channels: int, preset: Preset) -> np.ndarray:
+        """Returns cached impulse response of filters and reverb of the preset."""
+
+        key = (sample_rate, channels, preset.name)
+        if key not in self.__responses:
+            size = self.FILTER_LENGTH * 4
+            frequencies = np.fft.rfftfreq(size, 1 / sample_rate)
+            filters = np.fft.irfft(filters_response(frequencies, sample_rate), n=size)
+            reverb = reverb_response(sample_rate, channels, preset.reverb)
+            length = reverb.shape[1] + self.FILTER_LENGTH - 1
+            self.__responses[key] = np.fft.irfft(
+                np.fft.rfft(reverb, n=length, axis=1)
+                * np.fft.rfft(filters[: self.FILTER_LENGTH], n=length),
+                n=length,
+                axis=1,
+            )
+        return self.__responses[key]
+
+    # pylint: disable-next=too-many-locals
+    def render(self, file_path, target, preset, progress=None):
+        speed = preset.speed
+        bitrate = target.bitrate
+
+        with soundfile.SoundFile(file_path) as source:  # type: ignore
+            sample_rate, channels = source.samplerate, source.channels
+
+            # First pass to find peak level and length for `norm` and `fade`
+            peak, frames = 0.0, 0
+            for block in source.blocks(self.BLOCK_SIZE, dtype="float32", always_2d=True):
+                peak = max(peak, float(np.abs(block).max(initial=0)))
+                frames += len(block)
+            source.seek(0)
+
+            gain = 10 ** (NORM / 20) / peak if peak else 1.0
+            total = round(frames / speed)
+            fade_length = FADE_OUT * sample_rate
+            written = 0
+
+            resampler = Resampler(speed, channels)
+            convolver = Convolver(self.impulse_response(sample_rate, channels, preset))
+
+            with open(target.path, "wb") as raw, soundfile.SoundFile(  # type: ignore
+                OffsetFile(raw, raw.write(target.header)),
+                "w",
+                sample_rate,
+                channels,
+                format="MP3",
+                subtype="MPEG_LAYER_III",
+                compression_level=1 - (min(max(bitrate, 32), 320) - 32) / 288,
+                bitrate_mode="CONSTANT",
+            ) as output:
+
+                def write(samples: np.ndarray) -> None:
+                    nonlocal written
+                    samples = samples[: total - written]
+                    positions = written + np.arange(len(samples))
+                    fade = np.clip((total - positions) / fade_length, 0, 1)
+                    samples *= np.sin(np.pi / 2 * fade)[:, None]
+                    output.write(np.clip(samples, -1, 1))
+                    written += len(samples)
+
+                processed = 0
+                for block in source.blocks(self.BLOCK_SIZE, dtype="float32", always_2d=True):
+                    write(convolver.push(resampler.push(block * gain)))
+                    processed += len(block)
+                    if progress is not None:
+                        progress(processed / sample_rate)
+                write(convolver.push(resampler.flush()))
+                write(convolver.flush())
+
+        LOG.info("Created %s with NumPy engine", target.path)
+
+
+ENGINES = {engine.name: engine for engine in (SoxEngine, NumpyEngine)}
+_instances: dict[str, Engine] = {}
+
+
+def get_engine(name: str, **options) -> Engine:
+    """Returns cached instance of the engine by its name."""
+
+    if name not in _instances:
+        if name not in ENGINES:
+            raise EngineNotAvailable(f"Unknown audio engine: {name}")
+        _instances[name] = ENGINES[name](**options)
+    return _instances[name]
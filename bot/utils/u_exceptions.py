@@ -10,5 +10,21 @@ class QueueLimitReached(AppException):
     """This exception is raised when the queue limit is reached."""
 
 
+class QueueOverloaded(AppException):
+    """This exception is raised when the job would wait in the queue longer than its SLA."""
+
+
 class NotSupportedFormat(AppException):
     """This exception is raised when audio format is not equal to MP3."""
+
+
+class EngineNotAvailable(AppException):
+    """This exception is raised when audio engine can't be used."""
+
+
+class OutputTooBig(AppException):
+    """This exception is raised when slowed audio won't fit the upload limit."""
+
+
+class RenderTimeout(AppException):
+    """This exception is raised when rendering exceeds its deadline or CPU limit."""
@@ -0,0 +1,122 @@
+import subprocess
+
+import numpy as np
+
+from bot import db
+from bot.config import config
+from bot.utils.u_limits import child_cpu_limit
+from bot.utils.u_logger import get_logger
+from bot.utils.u_pool import render_deadline, render_pool
+
+try:
+    import soundfile
+except ImportError:  # Fallback to decoding by sox
+    soundfile = None
+
+LOG = get_logger()
+
+LENGTH = 60  # Seconds of audio to fingerprint
+SAMPLE_RATE = 11025  # Sample rate of audio decoded by sox
+SEGMENTS = 8
+BANDS = 9
+
+
+def decode(file_path: str) -> tuple[np.ndarray, int]:
+    """Returns mono samples of the beginning of audio file and its sample rate."""
+
+    if soundfile is not None:
+        with soundfile.SoundFile(file_path) as source:
+            samples = source.read(
+                (LENGTH + 10) * source.samplerate, dtype="float32", always_2d=True
+            )
+            return samples.mean(axis=1), source.samplerate
+
+    # pylint: disable-next=subprocess-popen-preexec-fn
+    output = subprocess.run(
+        [
+            "sox", "-V1", file_path,
+            "-t", "raw", "-e", "signed-integer", "-b", "16", "-c", "1", "-r", str(SAMPLE_RATE),
+            "-", "trim", "0", str(LENGTH + 10),
+        ],
+        capture_output=True,
+        check=True,
+        preexec_fn=child_cpu_limit(),
+    )
+    return np.frombuffer(output.stdout, dtype=np.int16) / 32768.0, SAMPLE_RATE
+
+
+def fingerprint(samples: np.ndarray, sample_rate: int) -> int | None:
+    """
+    Returns 64 bit acoustic fingerprint of audio. Every bit is a sign of
+    the change between neighbour time segments of the difference of
+    energies of neighbour frequency bands (like Haitsma-Kalker hash),
+    so it survives re-encoding and volume changes.
+    """
+
+    # Skip leading silence to align copies with different encoder delays
+    loud = np.flatnonzero(np.abs(samples) > 0.01 * np.abs(samples).max(initial=0))
+    if loud.size == 0:
+        return None
+    samples = samples[loud[0] : loud[0] + LENGTH * sample_rate]
+
+    frame = 1 << int(np.ceil(np.log2(sample_rate * 0.1)))
+    if len(samples) < frame * SEGMENTS * 4:
+        return None
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, frame)[:: frame // 2]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame), axis=1)) ** 2
+    bands = np.digitize(
+        np.fft.rfftfreq(frame, 1 / sample_rate), np.geomspace(300, 3000, BANDS + 1)
+    )
+
+    # Energy of every band (index 0 and BANDS + 1 are out of range)
+    energy = np.stack(
+        [spectrum[:, bands == band].sum(axis=1) for band in range(1, BANDS + 1)], axis=1
+    )
+    segments = np.stack([part.mean(axis=0) for part in np.array_split(energy, SEGMENTS + 1)])
+    bands_diff = np.diff(np.log(segments + 1e-12), axis=1)
+    bits = (np.diff(bands_diff, axis=0) > 0).flatten()
+
+    value = int(np.packbits(bits).view(">u8")[0])
+    # SQLite stores signed 64 bit integers
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fingerprint_file(file_path: str) -> int | None:
+    """
+    Returns acoustic fingerprint of audio file.
+    It runs in the worker process of the render pool.
+    """
+
+    return fingerprint(*decode(file_path))
+
+
+def distance(first: int, second: int) -> int:
+    """Returns count of different bits of two fingerprints."""
+
+    return bin((first ^ second) & ((1 << 64) - 1)).count("1")
+
+
+async def get_fingerprint(file_path: str) -> int | None:
+    """Returns acoustic fingerprint of audio file or None if error occured."""
+
+    try:
+        return await render_pool.run(
+            fingerprint_file, file_path, timeout=render_deadline(LENGTH)
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        LOG.warning("Can't fingerprint file %s - %s", file_path, error)
+
+    return None
+
+
+async def find_match(value: int, duration: int, preset: str) -> tuple | None:
+    """Returns the row of the match of the preset with the nearest fingerprint if any."""
+
+    candidates = await db.get_fingerprint_matches(duration, preset)
+    nearest = min(candidates, key=lambda row: distance(value, row[-1]), default=None)
+
+    if nearest is not None and distance(value, nearest[-1]) <= config.FINGERPRINT_DISTANCE:
+        return nearest[:-1]
+
+    return None
@@ -0,0 +1,91 @@
+import contextlib
+import functools
+import signal
+from typing import Callable
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def limit_cpu(seconds: float | None, pid: int = 0) -> None:
+    """
+    Limits CPU time of the process (the worker by default) to `seconds`
+    from now (None - unlimited). The limit counts CPU time of the process
+    from its start, so subprocesses are limited by `child_cpu_limit`.
+    """
+
+    if resource is None or (pid and not hasattr(resource, "prlimit")):
+        return
+
+    if pid:
+        _, hard = resource.prlimit(pid, resource.RLIMIT_CPU)
+    else:
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+
+    soft = hard
+    if seconds is not None:
+        used = 0.0
+        if not pid:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = usage.ru_utime + usage.ru_stime
+        soft = int(used + seconds) + 1
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+
+    if pid:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, hard))
+    else:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def cpu_budget() -> float | None:
+    """Returns seconds of CPU time left to the process under its limit or None."""
+
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_CPU)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return max(soft - usage.ru_utime - usage.ru_stime, 0.0)
+
+
+def child_cpu_limit() -> Callable[[], None] | None:
+    """
+    Returns `preexec_fn` for subprocesses which limits their CPU time to
+    the time left to the process, or None if it isn't limited. A child
+    starts with no CPU time used, so the inherited limit would give it
+    the time already used by the process.
+    """
+
+    if (budget := cpu_budget()) is None:
+        return None
+    return functools.partial(limit_cpu, budget)
+
+
+@contextlib.contextmanager
+def deferred_signals(*signums: int):
+    """
+    Defers the signals (e.g. the deadline of the job) until the block
+    ends, so the cleanup in it isn't interrupted.
+    """
+
+    if not hasattr(signal, "pthread_sigmask"):
+        yield
+        return
+
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, signums)
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+def reset_cpu_limit() -> None:
+    """Removes the soft limit of CPU time inherited by the process."""
+
+    if resource is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
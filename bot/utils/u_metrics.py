@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError
+from aiohttp import web
+
+from bot.utils.u_logger import get_logger
+
+LOG = get_logger()
+
+REGISTRY: list[Metric] = []
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    """Returns labels in Prometheus text format."""
+
+    if not names:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Metric:
+    """Base class of the metric with labels."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        """Returns values of the labels in order of the label names."""
+
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> list[str]:
+        """Returns lines of samples of the metric."""
+
+        return [
+            f"{self.name}{format_labels(self.labels, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+    def collect(self) -> list[str]:
+        """Returns lines of the metric in Prometheus text format."""
+
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    """Metric which value only goes up."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increments the counter."""
+
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Metric which value can go up and down."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self.functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        """Sets value of the gauge."""
+
+        self.values[self.key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        """Value of the gauge will be returned by the function on collect."""
+
+        self.functions[self.key(labels)] = function
+
+    def samples(self) -> list[str]:
+        for key, function in self.functions.items():
+            self.values[key] = function()
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Metric which counts observations in buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = (*sorted(buckets), float("inf"))
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """Observes the value."""
+
+        key = self.key(labels)
+        counts = self.counts.setdefault(key, [0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.sums[key] = self.sums.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes duration of the block in seconds."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == float("inf") else bound
+                labels = format_labels((*self.labels, "le"), (*key, le))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {self.sums[key]}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+def render() -> str:
+    """Returns all metrics in Prometheus text format."""
+
+    return "\n".join(line for metric in REGISTRY for line in metric.collect()) + "\n"
+
+
+QUEUE_DEPTH = Gauge("queue_depth", "Count of queued and running tasks.")
+QUEUE_WAIT = Histogram(
+    "queue_wait_seconds", "Time from enqueue to start of the task.", ("lane",), JOB_BUCKETS
+)
+JOB_STAGE = Histogram(
+    "job_stage_seconds", "Duration of stages of slowing down task.", ("stage",), JOB_BUCKETS
+)
+QUEUE_REJECTED = Counter("queue_rejected_total", "Count of tasks shed by admission control.")
+SOX_FAILURES = Counter("sox_failures_total", "Count of failed renders.", ("mode",))
+RENDER_TIMEOUTS = Counter(
+    "render_timeouts_total", "Count of renders killed by the deadline.", ("mode",)
+)
+DB_QUERY = Histogram("db_query_seconds", "Latency of database queries.", ("query",))
+TELEGRAM_REQUEST = Histogram(
+    "telegram_request_seconds", "Latency of Telegram API requests.", ("method",)
+)
+TELEGRAM_ERRORS = Counter(
+    "telegram_errors_total", "Count of Telegram API errors.", ("method", "error")
+)
+THROTTLED = Counter("throttled_total", "Count of throttled updates.", ("handler",))
+MATCH_CACHE = Counter(
+    "match_cache_requests_total", "Lookups of slowed audio by original.", ("result",)
+)
+
+
+class MetricsBot(Bot):
+    """Bot which measures latency and errors of Telegram API requests."""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        try:
+            with TELEGRAM_REQUEST.time(method=method):
+                return await super().request(method, data, files, **kwargs)
+        except TelegramAPIError as error:
+            TELEGRAM_ERRORS.inc(method=method, error=error.__class__.__name__)
+            raise
+
+
+class MetricsServer:
+    """HTTP server which exposes metrics on `/metrics`."""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.__runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        """Starts the server. The app runs without metrics if the port is taken."""
+
+        async def metrics(_request: web.Request) -> web.Response:
+            return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        try:
+            await web.TCPSite(self.__runner, self.host, self.port).start()
+        except OSError as error:
+            LOG.error("Can't serve metrics on %s:%d - %s", self.host, self.port, error)
+            await self.stop()
+            return
+        LOG.info("Serve metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        """Stops the server."""
+
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
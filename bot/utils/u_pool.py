@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from multiprocessing.connection import Connection
+from multiprocessing.pool import Pool
+from typing import Callable
+
+from bot.config import config
+from bot.utils.u_exceptions import RenderTimeout
+from bot.utils.u_limits import limit_cpu
+from bot.utils.u_logger import get_logger
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+LOG = get_logger()
+GRACE = 10  # Seconds to wait for the worker after the deadline
+
+# Pipe of the worker process to report ids of the jobs it starts
+WORKER_PIPES: dict[str, Connection] = {}
+
+
+def init_worker(memory_limit: int, started: Connection | None = None) -> None:
+    """
+    Initializer of the worker process. It limits the address space
+    of the worker (and sox processes spawned by it) to `memory_limit` MB
+    and prebuilds effects chains, so the first job doesn't wait for them.
+    Ids of started jobs are sent to the `started` pipe.
+    """
+
+    if started is not None:
+        WORKER_PIPES["started"] = started
+
+    if memory_limit and resource is not None:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    # pylint: disable-next=import-outside-toplevel
+    from bot.utils.u_presets import PRESETS
+
+    for preset in PRESETS.values():
+        preset.effects  # pylint: disable=pointless-statement
+
+
+def render_deadline(duration: float) -> float | None:
+    """Returns deadline in seconds to render audio of the `duration` or None."""
+
+    if not config.RENDER_TIMEOUT:
+        return None
+    return config.RENDER_TIMEOUT + duration * config.RENDER_TIMEOUT_RATIO
+
+
+def raise_timeout(signum: int, _frame) -> None:
+    """Signal handler which interrupts the job of the worker."""
+
+    reason = "deadline" if signum == signal.SIGALRM else "CPU limit"
+    raise RenderTimeout(f"Rendering exceeded its {reason}")
+
+
+def call_with_deadline(
+    func,
+    timeout: float | None,
+    args: tuple,
+    job_id: str | None = None,
+    deadline: float | None = None,
+):
+    """
+    Calls function in the worker process under the deadline. The job is
+    interrupted by RenderTimeout when it exceeds `timeout` seconds of wall
+    clock or CPU time, so the worker is free for the next job. The time
+    is counted till the `deadline` of `time.monotonic()` instead if it's
+    given. The start of the job is reported by its `job_id`.
+    """
+
+    if job_id is not None and "started" in WORKER_PIPES:
+        # Small messages are written to the pipe at once, so workers share it
+        WORKER_PIPES["started"].send(job_id)
+
+    if deadline is not None:
+        # The monotonic clock is shared by processes of the node
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise RenderTimeout("Rendering exceeded its deadline")
+
+    if timeout is None or resource is None:
+        return func(*args)
+
+    signal.signal(signal.SIGALRM, raise_timeout)
+    signal.signal(signal.SIGXCPU, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    limit_cpu(timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        limit_cpu(None)
+
+
+class RenderPool:
+    """A class that implements pool of processes for CPU bound audio rendering."""
+
+    def __init__(
+        self,
+        workers: int = 0,
+        memory_limit: int = 0,
+        max_tasks: int | None = None,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self.max_tasks = max_tasks or None
+        self.__pool: Pool | None = None
+        self.__started: tuple[Connection, Connection] | None = None
+        self.__listener: threading.Thread | None = None
+        self.__pending: dict[str, Callable[[], None]] = {}
+
+    def start(self) -> None:
+        """Starts worker processes of the pool."""
+
+        if self.__pool is not None:
+            return
+
+        LOG.info(
+            "Start render pool with %d workers (memory limit: %s MB, max tasks: %s).",
+            self.workers,
+            self.memory_limit or "unlimited",
+            self.max_tasks or "unlimited",
+        )
+
+        # Use `spawn` to not inherit the event loop and threads of the Bot
+        context = multiprocessing.get_context("spawn")
+        self.__started = context.Pipe(duplex=False)
+        self.__pool = context.Pool(
+            processes=self.workers,
+            initializer=init_worker,
+            initargs=(self.memory_limit, self.__started[1]),
+            maxtasksperchild=self.max_tasks,
+        )
+        self.__listener = threading.Thread(
+            target=self.listen, args=(self.__started[0],), name="render-started", daemon=True
+        )
+        self.__listener.start()
+
+    def stop(self) -> None:
+        """Stops worker processes of the pool."""
+
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+        if self.__started is not None:
+            reader, writer = self.__started
+            writer.send(None)
+            self.__listener.join()  # type: ignore
+            reader.close()
+            writer.close()
+            self.__started = None
+            self.__listener = None
+
+    def listen(self, reader: Connection) -> None:
+        """Notifies jobs started by workers until the stop sentinel (None)."""
+
+        while (job_id := reader.recv()) is not None:
+            if notify := self.__pending.pop(job_id, None):
+                notify()
+
+    async def run(
+        self, func, *args, timeout: float | None = None, deadline: float | None = None
+    ):
+        """
+        Run function in the worker process and wait for the result
+        without blocking the event loop. The function is interrupted
+        by RenderTimeout after `timeout` seconds from its start or at
+        the `deadline` of `time.monotonic()` shared by several jobs.
+        """
+
+        if self.__pool is None:
+            self.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        started = loop.create_future()
+        job_id = uuid.uuid4().hex
+
+        def set_result(result):
+            if not future.done():
+                future.set_result(result)
+
+        def set_exception(error):
+            if not future.done():
+                future.set_exception(error)
+
+        def set_started():
+            if not started.done():
+                started.set_result(None)
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(set_started)
+            except RuntimeError:  # The event loop is closed
+                pass
+
+        if timeout is not None:
+            self.__pending[job_id] = notify
+
+        self.__pool.apply_async(  # type: ignore
+            call_with_deadline,
+            (func, timeout, args, job_id if timeout is not None else None, deadline),
+            callback=lambda result: loop.call_soon_threadsafe(set_result, result),
+            error_callback=lambda error: loop.call_soon_threadsafe(
+                set_exception, error
+            ),
+        )
+
+        if timeout is None and deadline is None:
+            return await future
+
+        try:
+            if deadline is None:
+                # The deadline of the job starts when a worker takes it,
+                # the time in the queue of the pool isn't counted
+                await asyncio.wait((future, started), return_when=asyncio.FIRST_COMPLETED)
+                deadline = time.monotonic() + timeout  # type: ignore
+            return await asyncio.wait_for(future, max(deadline - time.monotonic(), 0) + GRACE)
+        except asyncio.TimeoutError as error:
+            # The worker doesn't respond to signals, so it stays busy
+            # until the job ends, but the caller moves on
+            LOG.error("Render worker is stuck in %s after the deadline.", func.__name__)
+            raise RenderTimeout("Rendering exceeded its deadline") from error
+        finally:
+            self.__pending.pop(job_id, None)
+
+
+render_pool = RenderPool(
+    workers=config.RENDER_WORKERS,
+    memory_limit=config.RENDER_WORKER_MEMORY,
+    max_tasks=config.RENDER_WORKER_MAX_TASKS,
+)
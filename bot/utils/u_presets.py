@@ -0,0 +1,126 @@
+from bot.config import config
+
+from .u_soxex import ExtTransformer
+
+HIGHPASS = 50  # Hz
+BASS = 1  # dB
+LOWPASS = 16000  # Hz
+NORM = -1  # dB
+FADE_OUT = 1  # In seconds
+
+
+class Preset:
+    """Named set of effects parameters to slow down audio."""
+
+    def __init__(self, name: str, title: str, speed: float, reverberance: float) -> None:
+        self.name = name
+        self.title = title
+        self.speed = speed
+        self.reverb = {
+            "reverberance": reverberance,
+            "high_freq_damping": 50,
+            "room_scale": 100,
+            "stereo_depth": 50,
+        }
+        self.__chain: ExtTransformer | None = None
+
+    def chain(self, duration: float | None = None) -> ExtTransformer:
+        """
+        Returns sox effects chain to slow down audio. If `duration` of the source
+        audio is given the chain doesn't buffer whole audio, so it can be
+        used with streams.
+        """
+
+        chain = ExtTransformer()
+        chain.upsample(1)
+        chain.speed(self.speed)
+        if duration is None:
+            chain.norm(NORM)
+        else:
+            chain.gain(NORM, normalize=False, limiter=True)
+        self.__add_filters(chain)
+        if duration is None:
+            chain.fade(fade_out_len=FADE_OUT)
+        elif duration > 0:
+            chain.fade_out(duration / self.speed, fade_out_len=FADE_OUT)
+
+        return chain
+
+    def preview_chain(self, length: float) -> ExtTransformer:
+        """
+        Returns the chain for the first `length` seconds of audio. It doesn't
+        buffer audio and sox stops reading the input after the `length`.
+        """
+
+        chain = ExtTransformer()
+        chain.trim(0, length)
+        full = self.chain(duration=length)
+        chain.effects.extend(full.effects)
+        chain.effects_log.extend(full.effects_log)
+
+        return chain
+
+    def linear_chain(self) -> ExtTransformer:
+        """
+        Returns the chain without `norm` and `fade`. All its effects are
+        linear and have finite memory, so audio can be rendered by
+        segments and the gain of `norm` can be applied after them.
+        """
+
+        chain = ExtTransformer()
+        # Full precision of the factor keeps segments sample aligned
+        chain.effects.extend(["speed", repr(self.speed)])
+        chain.effects_log.append("speed")
+        self.__add_filters(chain)
+
+        return chain
+
+    def __add_filters(self, chain: ExtTransformer) -> None:
+        chain.highpass(HIGHPASS)
+        chain.bass(BASS)
+        # chain.equalizer(85, 1, 5)  # bass boost
+        # chain.equalizer(120, 1, 5)  # bass boost
+        chain.reverb(**self.reverb)
+        chain.lowpass(LOWPASS)
+
+    @property
+    def effects(self) -> list:
+        """Prebuilt sox effects arguments of the preset."""
+
+        return self.__prebuilt().effects
+
+    @property
+    def effects_log(self) -> list:
+        """Names of prebuilt sox effects of the preset."""
+
+        return self.__prebuilt().effects_log
+
+    def __prebuilt(self) -> ExtTransformer:
+        if self.__chain is None:
+            self.__chain = self.chain()
+        return self.__chain
+
+    def match_key(self, file_unique_id: str) -> str:
+        """Returns key of the original audio rendered with this preset in the database."""
+
+        if self.name == DEFAULT_PRESET:
+            return file_unique_id
+        return f"{file_unique_id}:{self.name}"
+
+
+DEFAULT_PRESET = "vinyl"
+PRESETS = {
+    preset.name: preset
+    for preset in (
+        Preset(DEFAULT_PRESET, "💿 Vinyl 33 rpm", config.SPEED_RATIO, 50),
+        Preset("light", "🍃 Light", 0.9, 30),
+        Preset("reverb", "🌊 Slowed + Reverb", 0.8, 80),
+        Preset("dreamy", "🌙 Dreamy", 0.65, 100),
+    )
+}
+
+
+def get_preset(name: str | None) -> Preset:
+    """Returns preset by its name or default preset."""
+
+    return PRESETS.get(name or DEFAULT_PRESET, PRESETS[DEFAULT_PRESET])
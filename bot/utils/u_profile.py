@@ -0,0 +1,43 @@
+from .u_exceptions import OutputTooBig
+
+BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)  # kbps
+MIN_BITRATE = 64  # kbps
+MAX_BITRATE = 320  # kbps
+UPLOAD_LIMIT = 50 * 1024 * 1024  # Telegram Bot API upload limit
+TAGS_SIZE = 1024 * 1024  # Reserve for ID3 tags with album art
+TAIL = 5  # Seconds of reverb tail added to the slowed audio
+
+
+def get_source_bitrate(file_size: int, duration: float) -> float:
+    """Returns average bitrate of the source audio in kbps or 0 if unknown."""
+
+    return file_size * 8 / 1000 / duration if duration > 0 else 0
+
+
+def predict_size(bitrate: float, duration: float, speed: float) -> int:
+    """Returns predicted size in bytes of the audio slowed down by `speed`."""
+
+    return int(bitrate * 1000 / 8 * (duration / speed + TAIL)) + TAGS_SIZE
+
+
+def get_bitrate(source_bitrate: float, duration: float, speed: float) -> float:
+    """
+    Returns CBR bitrate of the encoder for the slowed audio. It is the
+    nearest standard bitrate not lower than the source (no upscale to 320
+    for 128 kbps sources) and the highest one at which the result fits
+    the upload limit. Sources below `MIN_BITRATE` are encoded at it.
+    Raises `OutputTooBig` if even `MIN_BITRATE` doesn't fit.
+    """
+
+    if source_bitrate <= 0 or duration <= 0:
+        return float(MAX_BITRATE)
+
+    # 5% of tolerance for VBR sources and ID3 tags counted in the size
+    wanted = next((rate for rate in BITRATES if rate >= source_bitrate * 0.95), MAX_BITRATE)
+    wanted = max(wanted, MIN_BITRATE)
+    fits = (UPLOAD_LIMIT - TAGS_SIZE) * 8 / 1000 / (duration / speed + TAIL)
+
+    if fits < MIN_BITRATE:
+        raise OutputTooBig(predict_size(MIN_BITRATE, duration, speed))
+
+    return float(max(rate for rate in BITRATES if rate <= min(wanted, fits)))
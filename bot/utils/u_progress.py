@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from aiogram import types
+from aiogram.utils.exceptions import (
+    MessageNotModified,
+    MessageToEditNotFound,
+    RetryAfter,
+    TelegramAPIError,
+)
+
+from bot.config import config
+from bot.utils.u_logger import get_logger
+from bot.utils.u_queue import DEFAULT_RATIO
+
+LOG = get_logger()
+
+EDITS_PER_SECOND = 20  # Limit of edits of all messages, Telegram allows ~30 requests per second
+TICK = 0.5  # Seconds between flushes of pending edits
+
+
+def format_duration(seconds: float) -> str:
+    """Returns rough human readable duration."""
+
+    if seconds < 60:
+        return "less than a minute"
+    if seconds < 3600:
+        return f"{round(seconds / 60)} min"
+    return f"{int(seconds // 3600)} h {round(seconds % 3600 / 60)} min"
+
+
+def queue_text(position: int, eta: float) -> str:
+    """Returns the text of the status message of the queued job."""
+
+    return (
+        f"🕙 Added your request to the queue. Your position: {position}.\n"
+        f"Estimated time: {format_duration(eta)}."
+    )
+
+
+def progress_text(title: str, fraction: float) -> str:
+    """Returns the text of the status message of the running job."""
+
+    done = min(int(fraction * 10), 10)
+    return f"{title} - recording for you...\n{'▰' * done}{'▱' * (10 - done)} {fraction:.0%}"
+
+
+class MessageEditor:
+    """
+    A class that edits status messages. Edits are coalesced, so only the
+    latest text of the message is sent, every message is edited once per
+    `interval` seconds at most and all edits are rate limited.
+    """
+
+    def __init__(self, interval: float = 5) -> None:
+        self.interval = interval
+        self.__pending: dict[tuple[int, int], tuple[types.Message, str, object]] = {}
+        self.__sent: dict[tuple[int, int], tuple[float, str]] = {}
+        self.__task: asyncio.Task | None = None
+
+    @staticmethod
+    def key(message: types.Message) -> tuple[int, int]:
+        """Returns key of the message."""
+
+        return (message.chat.id, message.message_id)
+
+    def start(self) -> None:
+        """Starts flushing of pending edits."""
+
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.flusher())
+
+    def stop(self) -> None:
+        """Stops flushing, pending edits are dropped."""
+
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        self.__pending.clear()
+        self.__sent.clear()
+
+    def update(self, message: types.Message, text: str, reply_markup=None) -> None:
+        """Schedules the edit of the message, it replaces the pending one."""
+
+        key = self.key(message)
+        if self.__sent.get(key, (0, ""))[1] == text:
+            self.__pending.pop(key, None)
+            return
+        self.__pending[key] = (message, text, reply_markup)
+
+    def forget(self, message: types.Message) -> None:
+        """Drops pending edits of the message."""
+
+        key = self.key(message)
+        self.__pending.pop(key, None)
+        self.__sent.pop(key, None)
+
+    async def finish(self, message: types.Message, text: str | None = None, **kwargs) -> None:
+        """Drops pending edits and edits the message now, or deletes it if no `text`."""
+
+        self.forget(message)
+        if text is None:
+            await message.delete()
+        else:
+            await message.edit_text(text, **kwargs)
+
+    async def flusher(self) -> None:
+        """Sends pending edits which are due."""
+
+        while True:
+            await asyncio.sleep(TICK)
+            now = time.monotonic()
+            budget = int(EDITS_PER_SECOND * TICK)
+            due = [
+                key
+                for key in self.__pending
+                if now - self.__sent.get(key, (0, ""))[0] >= self.interval
+            ]
+            for key in due[:budget]:
+                message, text, reply_markup = self.__pending.pop(key)
+                # The message is forgotten by `finish` while it's edited
+                self.__sent.setdefault(key, (0, ""))
+                try:
+                    await message.edit_text(text, reply_markup=reply_markup)
+                except MessageNotModified:
+                    pass
+                except MessageToEditNotFound:
+                    self.forget(message)
+                    continue
+                except RetryAfter as error:
+                    # The text is sent after the delay unless it's replaced meanwhile
+                    LOG.warning("Status edits are flooding: %s", error)
+                    self.__pending.setdefault(key, (message, text, reply_markup))
+                    await asyncio.sleep(error.timeout)
+                    break
+                except TelegramAPIError as error:
+                    LOG.warning("Can't edit status message: %s", error)
+                    continue
+                if key in self.__sent:
+                    self.__sent[key] = (now, text)
+
+
+class QueueWatcher:
+    """
+    A class that updates status messages of queued jobs with their
+    position and estimated time, until the jobs are started.
+    """
+
+    def __init__(self, message_editor: MessageEditor, interval: float = 5) -> None:
+        self.editor = message_editor
+        self.interval = interval
+        self.__jobs: dict[str, tuple[types.Message, float]] = {}
+        self.__task: asyncio.Task | None = None
+
+    def start(self, queue) -> None:
+        """Starts watching of the queue."""
+
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.watcher(queue))
+
+    def stop(self) -> None:
+        """Stops watching of the queue."""
+
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        self.__jobs.clear()
+
+    def watch(self, job, message: types.Message) -> None:
+        """Updates the status message of the job while it is pending."""
+
+        self.__jobs[job.id] = (message, job.duration)
+
+    async def estimate(self, queue) -> dict[str, tuple[int, float]]:
+        """
+        Returns position and ETA in seconds of watched jobs which are pending.
+        Audio ahead is rendered by all workers of the queue in parallel.
+        """
+
+        positions, busy = await queue.positions(list(self.__jobs))
+        ratio = await queue.get_ratio() or DEFAULT_RATIO
+        workers = max(queue.capacity, busy, 1)
+        return {
+            job_id: (position, (ahead / workers + self.__jobs[job_id][1]) * ratio)
+            for job_id, (position, ahead) in positions.items()
+        }
+
+    async def watcher(self, queue) -> None:
+        """Updates status messages of watched jobs."""
+
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.__jobs:
+                continue
+
+            try:
+                estimates = await self.estimate(queue)
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't estimate queue: %s", error)
+                continue
+
+            for job_id in list(self.__jobs):
+                message, _ = self.__jobs[job_id]
+                if job_id not in estimates:  # The job is started
+                    del self.__jobs[job_id]
+                    continue
+                position, eta = estimates[job_id]
+                self.editor.update(message, queue_text(position, eta), message.reply_markup)
+
+
+editor = MessageEditor(interval=config.PROGRESS_INTERVAL)
+watcher = QueueWatcher(editor, interval=config.PROGRESS_INTERVAL)
@@ -1,11 +1,20 @@
+# pylint: disable=too-many-lines
 from __future__ import annotations
 
 import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
 
+from aiogram import types
 from aioredis import Redis
 
 from bot.config import config
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import QUEUE_DEPTH, QUEUE_WAIT
+from bot.utils.u_presets import Preset, get_preset
 from bot.utils.u_redis import RedisClient
 
 LOG = get_logger()
@@ -15,102 +24,1020 @@ redis_client = RedisClient(
 )
 
 QUEUE_KEY = "queue"
+JOBS_KEY = "jobs"
+PRIORITY_LANE = 0  # Short tasks like previews
+DEFAULT_LANE = 1
+LANE_SPAN = 10**10  # Score of the lane in pending jobs, greater than any timestamp
+POLL_INTERVAL = 1  # Seconds between checks of pending jobs by idle worker
+MAX_ATTEMPTS = 3  # Deliveries of the job whose worker has gone
+RATIO_SMOOTHING = 0.2  # Weight of the last job in the measured throughput
+DEFAULT_RATIO = 0.2  # Seconds of a job per second of audio before it is measured
+INFLIGHT_KEY = "inflight"
+INFLIGHT_TTL = 3600  # Seconds before the render of a lost job is forgotten
+LEASE_GRACE = 60  # Seconds for the user lease to get its job before it is reconciled
 
+# Tasks which can be run by the job name
+TASKS: dict[str, Callable[..., Awaitable]] = {}
+# Handlers of jobs dropped after MAX_ATTEMPTS by the job name, see `on_drop`
+DROP_HANDLERS: dict[str, Callable[..., Awaitable]] = {}
 
-class Queue:
-    """A class that implements async queue for tasks."""
+# Fields of Telegram objects which are kept in jobs, see `compact`
+MESSAGE_FIELDS = ("message_id", "date", "chat", "from", "audio")
+CHAT_FIELDS = ("id", "type")
+USER_FIELDS = ("id", "is_bot", "first_name", "username")
+AUDIO_FIELDS = (
+    "file_id",
+    "file_unique_id",
+    "file_name",
+    "file_size",
+    "duration",
+    "performer",
+    "title",
+    "mime_type",
+)
+
+# Same as `fair_score`
+# KEYS: pending, specs, notify, leases, user finish
+# ARGV: job id, spec, lane, cost, is fair (1 or 0), lane span
+ENQUEUE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local start = now
+if ARGV[5] == '1' then
+    start = math.max(now, tonumber(redis.call('GET', KEYS[5]) or 0))
+    local finish = start + tonumber(ARGV[4])
+    redis.call('SET', KEYS[5], finish, 'EX', math.ceil(finish - now) + 1)
+end
+local score = tonumber(ARGV[3]) * tonumber(ARGV[6]) + start + tonumber(ARGV[4])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+redis.call('LPUSH', KEYS[3], 1)
+redis.call('LTRIM', KEYS[3], 0, 99)
+return redis.call('ZRANK', KEYS[1], ARGV[1]) + redis.call('ZCARD', KEYS[4]) + 1
+"""
+
+# KEYS: pending, leases, specs; ARGV: visibility timeout
+DEQUEUE = """
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then
+    return nil
+end
+local now = redis.call('TIME')
+redis.call('ZADD', KEYS[2], tonumber(now[1]) + tonumber(ARGV[1]), item[1])
+return {item[1], redis.call('HGET', KEYS[3], item[1])}
+"""
+
+# KEYS: leases, user leases (optional); ARGV: job id, visibility timeout, user lease timeout
+RENEW = """
+local now = redis.call('TIME')
+if KEYS[2] then
+    redis.call('ZADD', KEYS[2], 'XX', tonumber(now[1]) + tonumber(ARGV[3]), ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', tonumber(now[1]) + tonumber(ARGV[2]), ARGV[1])
+"""
+
+# KEYS: leases, specs, attempts, user leases (optional); ARGV: job id
+ACK = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if KEYS[4] then
+    redis.call('ZREM', KEYS[4], ARGV[1])
+end
+redis.call('HDEL', KEYS[3], ARGV[1])
+return redis.call('HDEL', KEYS[2], ARGV[1])
+"""
+
+# Returns specs of dropped jobs
+# KEYS: leases, pending, specs, attempts, notify; ARGV: max attempts, lane span
+REQUEUE = """
+local now = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now[1])
+local dropped = {}
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], id)
+    local spec = redis.call('HGET', KEYS[3], id)
+    if spec then
+        if redis.call('HINCRBY', KEYS[4], id, 1) >= tonumber(ARGV[1]) then
+            redis.call('HDEL', KEYS[3], id)
+            redis.call('HDEL', KEYS[4], id)
+            table.insert(dropped, spec)
+        else
+            -- The job is returned to the head of its lane
+            redis.call('ZADD', KEYS[2], cjson.decode(spec).lane * tonumber(ARGV[2]), id)
+            redis.call('LPUSH', KEYS[5], 1)
+        end
+    end
+end
+return dropped
+"""
+
+# KEYS: leases, pending, specs, notify; ARGV: lane span, job ids
+RETURN = """
+for i = 2, #ARGV do
+    if redis.call('ZREM', KEYS[1], ARGV[i]) == 1 then
+        local spec = redis.call('HGET', KEYS[3], ARGV[i])
+        if spec then
+            redis.call('ZADD', KEYS[2], cjson.decode(spec).lane * tonumber(ARGV[1]), ARGV[i])
+            redis.call('LPUSH', KEYS[4], 1)
+        end
+    end
+end
+"""
+
+# KEYS: pending, specs; ARGV: job id, spec, score
+REPRIORITIZE = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1]) + 1
+"""
+
+# KEYS: pending, specs, attempts, user leases (optional); ARGV: job id
+CANCEL = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if KEYS[4] then
+    redis.call('ZREM', KEYS[4], ARGV[1])
+end
+return 1
+"""
+
+# Leases of the user are sorted by their expiration time
+# KEYS: user leases; ARGV: lease id, limit, lease timeout
+ACQUIRE = """
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= tonumber(ARGV[2]) then
+    return {0, count}
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, count + 1}
+"""
+
+# Leases of queued and running jobs are renewed, leases of lost jobs are removed
+# KEYS: user leases, specs; ARGV: lease timeout, grace
+RECONCILE = """
+local now = tonumber(redis.call('TIME')[1])
+local timeout = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local removed = 0
+for _, id in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if redis.call('HEXISTS', KEYS[2], id) == 1 then
+        redis.call('ZADD', KEYS[1], now + timeout, id)
+    elseif tonumber(redis.call('ZSCORE', KEYS[1], id)) < now + timeout - tonumber(ARGV[2]) then
+        redis.call('ZREM', KEYS[1], id)
+        removed = removed + 1
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], timeout)
+end
+return removed
+"""
+
+# KEYS: in-flight render, its waiters; ARGV: waiter, ttl, can lead (1 or 0)
+JOIN = """
+if ARGV[3] == '0' then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return -1
+    end
+elseif redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 0
+"""
+
+# KEYS: in-flight render, its waiters
+FINISH = """
+local waiters = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+return waiters
+"""
+
+
+def fair_score(now: float, finish: float, lane: int, cost: float) -> tuple[float, float]:
+    """
+    Returns the score of the job among pending jobs and the new finish
+    time of its user (start-time fair queueing). Jobs of the user start
+    after the finish of the previous one, so users are served by turns,
+    and the `cost` of long audio moves the job back. The cost is in seconds
+    of wall clock, so newer jobs get behind the job after its cost (aging).
+    """
+
+    start = max(now, finish)
+    return lane * LANE_SPAN + start + cost, start + cost
+
+
+def task(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Registers the function as a task of the queue, so jobs can refer to it by name."""
+
+    TASKS[func.__name__] = func
+    return func
+
+
+def on_drop(func: Callable[..., Awaitable]) -> Callable:
+    """
+    Registers the handler of jobs of the task which are dropped after
+    MAX_ATTEMPTS. It gets the arguments of the job, so users can be answered.
+    """
+
+    def register(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        DROP_HANDLERS[func.__name__] = handler
+        return handler
+
+    return register
+
+
+def compact(data: dict, fields: tuple) -> dict:
+    """Returns the data of the Telegram object with the fields only."""
+
+    return {field: data[field] for field in fields if field in data}
+
+
+def waiter_data(message: types.Message) -> dict:
+    """Returns the ids of the message which are enough to answer it."""
+
+    data = {
+        "message_id": message.message_id,
+        "chat": {"id": message.chat.id, "type": message.chat.type},
+    }
+    if message.from_user is not None:
+        data["from"] = {"id": message.from_user.id}
+    return data
+
+
+@dataclass(eq=False, repr=False, slots=True)
+class Job:  # pylint: disable=too-many-instance-attributes
+    """
+    Serializable spec of the task of the queue. Arguments are stored
+    as JSON, Telegram messages are stored by their ids, the user and the
+    audio metadata, presets are stored by their names. The coroutine of
+    the task is created when the job is run.
+    """
+
+    func: str
+    args: list
+    lane: int = DEFAULT_LANE
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    enqueued: float = field(default_factory=time.time)
+    user_id: int | None = None
+    duration: float = 0
+    position: int = 0  # In the queue including running jobs, see `jobs`
+
+    @classmethod
+    def create(cls, func: Callable[..., Awaitable], *args, **options) -> Job:
+        """Creates the job of the registered task with the arguments."""
+
+        if TASKS.get(func.__name__) is not func:
+            raise ValueError(f"Task {func.__name__} is not registered")
+        return cls(func.__name__, [cls.encode(arg) for arg in args], **options)
+
+    @staticmethod
+    def encode(value: Any) -> Any:
+        """Returns JSON serializable value of the argument."""
+
+        if isinstance(value, types.Message):
+            data = compact(value.to_python(), MESSAGE_FIELDS)
+            data["chat"] = compact(data["chat"], CHAT_FIELDS)
+            if "from" in data:
+                data["from"] = compact(data["from"], USER_FIELDS)
+            if "audio" in data:
+                data["audio"] = compact(data["audio"], AUDIO_FIELDS)
+            return {"message": data}
+        if isinstance(value, Preset):
+            return {"preset": value.name}
+        return value
+
+    @staticmethod
+    def decode(value: Any) -> Any:
+        """Returns the argument from its JSON serializable value."""
+
+        if isinstance(value, dict) and "message" in value:
+            return types.Message.to_object(value["message"])
+        if isinstance(value, dict) and "preset" in value:
+            return get_preset(value["preset"])
+        return value
+
+    def dumps(self) -> str:
+        """Returns the job as JSON."""
+
+        return json.dumps(
+            {
+                "id": self.id,
+                "func": self.func,
+                "args": self.args,
+                "lane": self.lane,
+                "enqueued": self.enqueued,
+                "user_id": self.user_id,
+                "duration": self.duration,
+            }
+        )
+
+    @classmethod
+    def loads(cls, data: str) -> Job:
+        """Returns the job from JSON."""
+
+        spec = json.loads(data)
+        return cls(
+            spec["func"],
+            spec["args"],
+            lane=spec["lane"],
+            id=spec["id"],
+            enqueued=spec["enqueued"],
+            user_id=spec.get("user_id"),
+            duration=spec.get("duration", 0),
+        )
+
+    @property
+    def cost(self) -> float:
+        """Seconds which the job is moved back in the queue for its audio duration."""
+
+        return self.duration * config.SCHEDULER_WEIGHT
 
-    def __init__(self, maxsize: int = 0) -> None:
-        self.__queue = asyncio.Queue(maxsize=maxsize)
+    def coro(self) -> Awaitable:
+        """Returns the coroutine of the task with decoded arguments."""
+
+        return TASKS[self.func](*(self.decode(arg) for arg in self.args))
+
+    def drop_coro(self) -> Awaitable | None:
+        """Returns the coroutine of the drop handler of the task if any."""
+
+        if (handler := DROP_HANDLERS.get(self.func)) is None:
+            return None
+        return handler(*(self.decode(arg) for arg in self.args))
+
+    @property
+    def audio(self) -> dict:
+        """Returns metadata of the audio of the first message argument."""
+
+        for arg in self.args:
+            if isinstance(arg, dict) and "message" in arg:
+                return arg["message"].get("audio", {})
+        return {}
+
+    def __repr__(self) -> str:
+        return f"<Job {self.func} id={self.id} lane={self.lane}>"
+
+
+class Queue:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    A class that implements durable queue for tasks in Redis. A job is
+    leased by the worker for `visibility` seconds and the lease is renewed
+    while the job runs. Jobs of crashed workers are returned to the queue
+    when their lease expires, jobs of drained workers are returned at once.
+    """
+
+    def __init__(self, workers: int = 1, visibility: int = 60, collect: bool = False) -> None:
         self.__running = False
+        self.__collecting = False
+        self.collect = collect  # Runs results published by workers, see `publish`
+        self.workers = max(workers, 0)
+        self.visibility = visibility
         self.__storage: Redis | None = None
-        self.__size = 0
+        self.__scripts: dict[str, Any] = {}
+        self.__notified = asyncio.Condition()
+        self.__tasks: list[asyncio.Task] = []
+        self.__collector: asyncio.Task | None = None
+        self.__workers: list[asyncio.Task] = []
+        self.__jobs: dict[int, Job] = {}  # Running jobs by worker id
         self.count = 1
+        self.node = uuid.uuid4().hex
+        self.backlog = 0.0  # Seconds of audio of queued and running jobs
+        self.capacity = 0  # Count of workers of all processes
+        self.ratio = 0.0
 
     @classmethod
-    async def create(cls, maxsize: int = 0) -> Queue:
+    async def create(cls, workers: int = 1, visibility: int = 60, collect: bool = False) -> Queue:
         """It creates a Queue object."""
 
-        self = Queue(maxsize=maxsize)
+        self = Queue(workers=workers, visibility=visibility, collect=collect)
         self.__storage = await redis_client.redis()
+        self.__scripts = {
+            name: self.__storage.register_script(script)
+            for name, script in (
+                ("enqueue", ENQUEUE),
+                ("dequeue", DEQUEUE),
+                ("renew", RENEW),
+                ("ack", ACK),
+                ("requeue", REQUEUE),
+                ("return", RETURN),
+                ("reprioritize", REPRIORITIZE),
+                ("cancel", CANCEL),
+                ("acquire", ACQUIRE),
+                ("reconcile", RECONCILE),
+                ("join", JOIN),
+                ("finish", FINISH),
+            )
+        }
         return self
 
+    @staticmethod
+    def key(name: str) -> str:
+        """Returns the Redis key of the queue."""
+
+        return redis_client.generate_key(JOBS_KEY, name)
+
+    def user_key(self, user_id: int | None) -> list:
+        """Returns list with the Redis key of leases of the user, empty if no user."""
+
+        return [] if user_id is None else [self.key(f"users:{user_id}")]
+
     async def start(self):
-        """Starts loop worker for the queue."""
+        """Starts loop workers for the queue."""
 
-        LOG.info("Start tasks queue.")
+        LOG.info("Start tasks queue with %d workers.", self.workers)
 
         self.__running = True
+        self.__workers = [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        self.__tasks = [
+            asyncio.create_task(self.requeuer()),
+            asyncio.create_task(self.reconciler()),
+            *self.__workers,
+        ]
+        if self.workers:
+            self.__tasks.append(asyncio.create_task(self.listener()))
+        if self.collect:
+            self.__collecting = True
+            self.__collector = asyncio.create_task(self.collector())
+            self.__tasks.append(self.__collector)
+
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    async def worker(self, worker_id: int):
+        """Loop worker that runs jobs from the queue one by one."""
 
         while self.__running:
             try:
-                coro = await self.__queue.get()
-                LOG.debug("Run task #%d from the queue %s", self.count, coro)
-                await asyncio.create_task(coro)
+                job = await self.dequeue()
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.error("Can't get job from the queue: %s", error)
+                job = None
+
+            if job is None:
+                await self.wait()
+                continue
+
+            QUEUE_WAIT.observe(
+                max(time.time() - job.enqueued, 0),
+                lane="priority" if job.lane == PRIORITY_LANE else "default",
+            )
+            count = self.count
+            self.count += 1
+            renewer = asyncio.create_task(self.renewer(job))
+            self.__jobs[worker_id] = job
+            try:
+                LOG.debug("Run task #%d from the queue by worker #%d %s", count, worker_id, job)
+                await asyncio.create_task(job.coro())
             except (asyncio.CancelledError, ValueError) as error:
-                LOG.debug("Queue task #%d canceled %s", self.count, error)
+                if isinstance(error, asyncio.CancelledError) and not self.__running:
+                    raise
+                LOG.debug("Queue task #%d canceled %s", count, error)
             except Exception as error:  # pylint: disable=broad-except
                 LOG.error("Exception in queue task: %s", error)
             else:
-                LOG.debug("Queue task #%d done", self.count)
+                LOG.debug("Queue task #%d done", count)
             finally:
-                self.__size -= 1
-                self.count += 1
+                renewer.cancel()
+
+            # The job isn't acknowledged if the worker is stopped while it runs,
+            # so it is returned to the queue by `drain` or after its lease
+            await self.ack(job)
+            del self.__jobs[worker_id]
+
+    async def wait(self):
+        """Waits for a new job notification or the poll interval."""
+
+        try:
+            async with self.__notified:
+                await asyncio.wait_for(self.__notified.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def listener(self):
+        """Wakes up an idle worker when a job is added to the queue."""
+
+        while self.__running:
+            try:
+                if await self.__storage.blpop(self.key("notify"), timeout=5):  # type: ignore
+                    async with self.__notified:
+                        self.__notified.notify()
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't wait for jobs notification: %s", error)
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def collector(self):
+        """
+        Runs results published by workers one by one. Only the Bot collects
+        them, so it's the only writer of the database and workers on other
+        nodes don't need `DATA_DIR`.
+        """
+
+        while self.__collecting:
+            try:
+                result = await self.__storage.blpop(  # type: ignore
+                    self.key("results"), timeout=POLL_INTERVAL
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't wait for results: %s", error)
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            if result:
+                await self.run_result(Job.loads(result[1]))
+
+    async def run_result(self, job: Job) -> None:
+        """Runs the task of the result published by a worker."""
+
+        try:
+            await job.coro()
+        except Exception as error:  # pylint: disable=broad-except
+            LOG.error("Exception in result %s: %s", job, error)
+
+    async def publish(self, func: Callable[..., Awaitable], *args) -> None:
+        """
+        Publishes the result of the job as the task with arguments,
+        it's run by the Bot even if it's restarted meanwhile.
+        """
+
+        await self.__storage.rpush(  # type: ignore
+            self.key("results"), Job.create(func, *args).dumps()
+        )
+
+    async def renewer(self, job: Job):
+        """Renews the lease of the running job."""
+
+        while True:
+            await asyncio.sleep(self.visibility / 3)
+            try:
+                await self.__scripts["renew"](
+                    keys=[self.key("leases"), *self.user_key(job.user_id)],
+                    args=[job.id, self.visibility, config.TASK_LEASE_TIMEOUT],
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't renew lease of %s: %s", job, error)
+
+    async def requeuer(self):
+        """Returns jobs with expired leases to the queue."""
+
+        while self.__running:
+            try:
+                dropped = await self.__scripts["requeue"](
+                    keys=[
+                        self.key("leases"),
+                        self.key("pending"),
+                        self.key("specs"),
+                        self.key("attempts"),
+                        self.key("notify"),
+                    ],
+                    args=[MAX_ATTEMPTS, LANE_SPAN],
+                )
+                for spec in dropped:
+                    await self.drop(Job.loads(spec))
+                QUEUE_DEPTH.set(await self.size())
+                await self.refresh_load()
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't requeue expired jobs: %s", error)
+
+            await asyncio.sleep(self.visibility / 4)
+
+    async def drop(self, job: Job) -> None:
+        """Runs the drop handler of the job which is dropped after MAX_ATTEMPTS."""
+
+        LOG.error("Job %s is dropped after %d attempts.", job, MAX_ATTEMPTS)
+        if (coro := job.drop_coro()) is None:
+            return
+        try:
+            await coro
+        except Exception as error:  # pylint: disable=broad-except
+            LOG.error("Exception in drop handler of %s: %s", job, error)
+
+    async def reconciler(self):
+        """
+        Fixes leases of users, e.g. after a restart. Leases of jobs which
+        are neither queued nor running are removed, others are renewed.
+        """
+
+        while self.__running:
+            try:
+                removed = 0
+                async for key in self.__storage.scan_iter(  # type: ignore
+                    match=self.key("users:*"), count=100
+                ):
+                    removed += await self.__scripts["reconcile"](
+                        keys=[key, self.key("specs")],
+                        args=[config.TASK_LEASE_TIMEOUT, LEASE_GRACE],
+                    )
+                if removed:
+                    LOG.warning("Removed %d leases of lost jobs.", removed)
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning("Can't reconcile user leases: %s", error)
+
+            await asyncio.sleep(config.TASK_LEASE_TIMEOUT / 4)
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Stops taking new jobs and waits up to `timeout` seconds for running
+        jobs. Jobs which are still running are cancelled and returned to the
+        head of the queue, so they are picked up by other or next workers.
+        """
+
+        self.__running = False
+        async with self.__notified:
+            self.__notified.notify_all()
+        if not self.__workers:
+            await self.stop_collector()
+            return
+
+        if self.__jobs:
+            LOG.info("Wait %d seconds for %d running jobs.", timeout, len(self.__jobs))
+        _, pending = await asyncio.wait(self.__workers, timeout=timeout or None)
+        jobs = list(self.__jobs.values())
+        for worker in pending:
+            worker.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # Results of the finished jobs are collected, the rest are left in Redis
+        await self.stop_collector()
+
+        if jobs and self.__storage is not None:
+            LOG.warning("Return %d unfinished jobs to the queue.", len(jobs))
+            try:
+                await self.__scripts["return"](
+                    keys=[
+                        self.key("leases"),
+                        self.key("pending"),
+                        self.key("specs"),
+                        self.key("notify"),
+                    ],
+                    args=[LANE_SPAN, *(job.id for job in jobs)],
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.error("Can't return jobs to the queue, they're retried after lease: %s", error)
+
+    async def stop_collector(self) -> None:
+        """Stops the collector after the result it runs."""
+
+        self.__collecting = False
+        if self.__collector is not None:
+            await asyncio.gather(self.__collector, return_exceptions=True)
 
     async def stop(self):
-        """Stops loop worker for the queue."""
+        """Stops loop workers for the queue."""
 
+        self.__running = False
+        for worker in self.__tasks:
+            worker.cancel()
         if self.__storage is not None:
             await self.__storage.close()
             # await self.__storage.wait_closed()
-        self.__running = False
 
-    def enqueue(self, func, *args, **kwargs) -> int:
-        """Add a task into the queue."""
+    async def enqueue(
+        self,
+        func,
+        *args,
+        priority: bool = False,
+        user_id: int | None = None,
+        duration: float = 0,
+        lease: str | None = None,
+    ) -> Job:
+        """
+        Add a job of the task into the queue. Jobs with `priority` are run
+        before all others. Jobs of different users are run by turns and
+        jobs with long audio `duration` are moved back (see `fair_score`).
+        The job holds the user `lease` (see `acquire`) until it's done.
+        Returns the job with its position including running jobs.
+        """
 
-        self.__size += 1
-        self.__queue.put_nowait(func(*args, **kwargs))
-        LOG.debug("Task #%d added to the queue %s", self.count, func)
-        return self.__size
+        job = Job.create(
+            func,
+            *args,
+            lane=PRIORITY_LANE if priority else DEFAULT_LANE,
+            user_id=user_id,
+            duration=duration,
+        )
+        if lease is not None:
+            job.id = lease  # The lease is released by the id of its job
+        job.position = await self.__scripts["enqueue"](
+            keys=[
+                self.key("pending"),
+                self.key("specs"),
+                self.key("notify"),
+                self.key("leases"),
+                self.key(f"finish:{user_id}"),
+            ],
+            args=[
+                job.id,
+                job.dumps(),
+                job.lane,
+                job.cost,
+                int(user_id is not None),
+                LANE_SPAN,
+            ],
+        )
+        QUEUE_DEPTH.set(await self.size())
+        self.backlog += duration
+        LOG.debug("Job %s added to the queue", job)
+        return job
 
-    async def get_user_queue(self, user_id: int) -> int:
-        """It gets the user's queue from the database."""
+    async def dequeue(self) -> Job | None:
+        """Leases the next job of the queue."""
 
-        key = redis_client.generate_key(user_id, QUEUE_KEY)
-        if self.__storage is not None:
-            return int(await self.__storage.get(key) or 0)
-        return 0
+        result = await self.__scripts["dequeue"](
+            keys=[self.key("pending"), self.key("leases"), self.key("specs")],
+            args=[self.visibility],
+        )
+        if not result:
+            return None
+
+        job_id, spec = result[0], result[1] if len(result) > 1 else None
+        if spec is None:  # The job is already done
+            await self.ack(Job("", [], id=job_id))
+            return None
+        return Job.loads(spec)
+
+    async def ack(self, job: Job) -> None:
+        """Removes the done job from the queue."""
+
+        try:
+            await self.__scripts["ack"](
+                keys=[
+                    self.key("leases"),
+                    self.key("specs"),
+                    self.key("attempts"),
+                    *self.user_key(job.user_id),
+                ],
+                args=[job.id],
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            LOG.error("Can't acknowledge %s: %s", job, error)
+
+    async def get(self, job_id: str) -> Job | None:
+        """Returns the queued or running job by its id."""
+
+        if self.__storage is None:
+            return None
+        spec = await self.__storage.hget(self.key("specs"), job_id)
+        return Job.loads(spec) if spec else None
+
+    async def jobs(self, user_id: int | None = None) -> list[Job]:
+        """Returns pending jobs in order of the queue, only jobs of the user if given."""
+
+        if self.__storage is None:
+            return []
+        pending = await self.__storage.zrange(self.key("pending"), 0, -1)
+        running = await self.__storage.zcard(self.key("leases"))
+        specs = await self.__storage.hmget(self.key("specs"), pending) if pending else []
+
+        jobs = []
+        for index, spec in enumerate(specs):
+            if spec is None:
+                continue
+            job = Job.loads(spec)
+            job.position = index + 1 + running
+            if user_id is None or job.user_id == user_id:
+                jobs.append(job)
+        return jobs
+
+    async def reprioritize(self, job_id: str, priority: bool = True) -> bool:
+        """
+        Moves the pending job to the priority or the default lane. It keeps
+        its place among the jobs of the lane. Returns False if the job isn't
+        pending.
+        """
+
+        if (job := await self.get(job_id)) is None:
+            return False
+        score = await self.__storage.zscore(self.key("pending"), job_id)  # type: ignore
+        if score is None:
+            return False
+        job.lane = PRIORITY_LANE if priority else DEFAULT_LANE
+        return bool(
+            await self.__scripts["reprioritize"](
+                keys=[self.key("pending"), self.key("specs")],
+                args=[job_id, job.dumps(), job.lane * LANE_SPAN + score % LANE_SPAN],
+            )
+        )
+
+    async def cancel(self, job_id: str) -> Job | None:
+        """
+        Removes the pending job and releases the lease of its user. Returns
+        the job, or None if it isn't pending.
+        """
+
+        if (job := await self.get(job_id)) is None:
+            return None
+        cancelled = await self.__scripts["cancel"](
+            keys=[
+                self.key("pending"),
+                self.key("specs"),
+                self.key("attempts"),
+                *self.user_key(job.user_id),
+            ],
+            args=[job_id],
+        )
+        if not cancelled:
+            return None
+        self.backlog = max(self.backlog - job.duration, 0)
+        QUEUE_DEPTH.set(await self.size())
+        LOG.debug("Job %s is cancelled", job)
+        return job
+
+    async def positions(self, job_ids: list) -> tuple[dict[str, tuple[int, float]], int]:
+        """
+        Returns position and seconds of audio ahead of the pending jobs by
+        their ids, and the count of running jobs. Running jobs are counted
+        as half done.
+        """
+
+        if self.__storage is None or not job_ids:
+            return {}, 0
+
+        pending = await self.__storage.zrange(self.key("pending"), 0, -1)
+        running = await self.__storage.zrange(self.key("leases"), 0, -1)
+        ids = pending + running
+        specs = await self.__storage.hmget(self.key("specs"), ids) if ids else []
+        durations = [json.loads(spec).get("duration", 0) if spec else 0 for spec in specs]
+
+        watched = set(job_ids)
+        ahead = sum(durations[len(pending) :]) / 2
+        positions = {}
+        for index, job_id in enumerate(pending):
+            if job_id in watched:
+                positions[job_id] = (index + 1 + len(running), ahead)
+            ahead += durations[index]
+
+        return positions, len(running)
+
+    async def refresh_load(self) -> None:
+        """
+        Updates the backlog, the capacity and the throughput of the queue
+        for admission of new jobs. Workers of the process are registered
+        until the next refresh.
+        """
+
+        if self.__storage is None:
+            return
+        if self.workers:
+            await self.__storage.set(
+                self.key(f"workers:{self.node}"), self.workers, ex=self.visibility
+            )
+        keys = [
+            key
+            async for key in self.__storage.scan_iter(match=self.key("workers:*"), count=100)
+        ]
+        counts = await self.__storage.mget(keys) if keys else []
+        self.capacity = sum(int(count or 0) for count in counts)
+        specs = await self.__storage.hvals(self.key("specs"))
+        self.backlog = sum(json.loads(spec).get("duration", 0) for spec in specs)
+        self.ratio = await self.get_ratio()
+
+    def drain_time(self, duration: float = 0) -> float:
+        """
+        Returns projected seconds until queued and running jobs and a new
+        job with audio of the `duration` are done.
+        """
+
+        return (self.backlog + duration) * (self.ratio or DEFAULT_RATIO) / max(self.capacity, 1)
+
+    def task_limit(self, duration: float = 0) -> int:
+        """
+        Returns the limit of jobs of a user under the current load, or 0 if
+        a new job with audio of the `duration` would miss QUEUE_SLA. The
+        limit is tightened down to one job when the queue is half full.
+        """
+
+        if not config.QUEUE_SLA:
+            return config.TASK_LIMIT
+        load = self.drain_time(duration) / config.QUEUE_SLA
+        if load > 1:
+            return 0
+        return max(round(config.TASK_LIMIT * min(2 * (1 - load), 1)), 1)
+
+    async def get_ratio(self) -> float:
+        """Returns measured seconds of a job per second of its audio."""
+
+        if self.__storage is None:
+            return 0.0
+        return float(await self.__storage.get(self.key("ratio")) or 0)
+
+    async def observe_ratio(self, seconds: float, duration: float) -> None:
+        """Adds time of the done job with audio of the `duration` to the throughput."""
+
+        if self.__storage is None or duration <= 0:
+            return
+        ratio = seconds / duration
+        if previous := await self.get_ratio():
+            ratio = previous * (1 - RATIO_SMOOTHING) + ratio * RATIO_SMOOTHING
+        await self.__storage.set(self.key("ratio"), ratio)
+
+    async def size(self) -> int:
+        """Returns the count of pending and running jobs."""
+
+        if self.__storage is None:
+            return 0
+        return await self.__storage.zcard(self.key("pending")) + await self.__storage.zcard(
+            self.key("leases")
+        )
 
-    async def inc_user_queue(self, user_id: int) -> bool:
+    async def acquire(self, user_id: int, limit: int) -> tuple[str | None, int]:
         """
-        It increments the user's queue count by 1 and
-        returns True if the operation was successful.
+        Checks the limit of jobs of the user and takes a lease for the new
+        job in one step. Returns id of the lease, or None if the limit is
+        reached, and count of jobs of the user. The lease is released when
+        its job is done and expires if the job is lost.
         """
 
-        key = redis_client.generate_key(user_id, QUEUE_KEY)
+        if self.__storage is None:
+            return uuid.uuid4().hex, 0
+        lease = uuid.uuid4().hex
+        acquired, count = await self.__scripts["acquire"](
+            keys=self.user_key(user_id),
+            args=[lease, limit, config.TASK_LEASE_TIMEOUT],
+        )
+        return lease if acquired else None, count
+
+    async def release(self, user_id: int, lease: str) -> None:
+        """Releases the lease of the user which didn't get its job."""
+
         if self.__storage is not None:
-            return bool(await self.__storage.incr(key))
-        return False
+            await self.__storage.zrem(*self.user_key(user_id), lease)
+
+    async def add_preview(self, chat_id: int, message_id: int) -> None:
+        """Marks the preview of the audio message as pending."""
+
+        key = redis_client.generate_key(chat_id, message_id, "preview")
+        if self.__storage is not None:
+            await self.__storage.set(key, 0, ex=24 * 3600)
 
-    async def dec_user_queue(self, user_id: int) -> bool:
+    async def set_preview(self, chat_id: int, message_id: int, preview_id: int) -> bool:
         """
-        It decrements the user's queue count by 1 and
-        returns True if the operation was successful.
+        Stores id of the sent preview of the audio message. Returns False
+        if the full track is already sent.
         """
 
-        key = redis_client.generate_key(user_id, QUEUE_KEY)
+        key = redis_client.generate_key(chat_id, message_id, "preview")
         if self.__storage is not None:
-            return bool(await self.__storage.decr(key))
+            return bool(await self.__storage.set(key, preview_id, xx=True, keepttl=True))
         return False
 
-    @property
-    def size(self):
-        """Return the number of tasks in the queue."""
+    async def has_preview(self, chat_id: int, message_id: int) -> bool:
+        """Returns True if the preview of the audio message is pending."""
+
+        key = redis_client.generate_key(chat_id, message_id, "preview")
+        if self.__storage is not None:
+            return bool(await self.__storage.exists(key))
+        return False
 
-        return self.__size
+    async def pop_preview(self, chat_id: int, message_id: int) -> int:
+        """Returns id of the sent preview of the audio message (0 if not sent)."""
 
-    @property
-    def is_empty(self):
-        """Return True if the queue is empty, False otherwise."""
+        key = redis_client.generate_key(chat_id, message_id, "preview")
+        if self.__storage is not None:
+            return int(await self.__storage.getdel(key) or 0)
+        return 0
+
+    @staticmethod
+    def inflight_keys(match_key: str) -> list:
+        """Returns Redis keys of the in-flight render and its waiters."""
+
+        key = redis_client.generate_key(INFLIGHT_KEY, match_key)
+        return [key, f"{key}:waiters"]
+
+    async def join_inflight(
+        self, match_key: str, message: types.Message, lead: bool = True
+    ) -> bool | None:
+        """
+        Registers the render of the audio with the key. Returns True if the
+        render should be queued, or False if the same render is already in
+        flight and the message is attached to it. Without `lead` the message
+        is only attached, None is returned if there is no such render.
+        """
+
+        if self.__storage is None:
+            return True if lead else None
+        result = await self.__scripts["join"](
+            keys=self.inflight_keys(match_key),
+            args=[json.dumps(waiter_data(message)), INFLIGHT_TTL, int(lead)],
+        )
+        return None if result < 0 else bool(result)
+
+    async def touch_inflight(self, match_key: str) -> None:
+        """Extends the in-flight render while its job runs."""
+
+        if self.__storage is not None:
+            for key in self.inflight_keys(match_key):
+                await self.__storage.expire(key, INFLIGHT_TTL)
+
+    async def finish_inflight(self, match_key: str) -> list[types.Message]:
+        """Removes the in-flight render and returns messages attached to it."""
 
-        return not bool(self.__size)
+        if self.__storage is None:
+            return []
+        waiters = await self.__scripts["finish"](keys=self.inflight_keys(match_key))
+        return [types.Message.to_object(json.loads(waiter)) for waiter in waiters]
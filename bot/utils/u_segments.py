@@ -0,0 +1,288 @@
+"""
+Rendering of long audio by segments in parallel. Every segment is rendered
+with the linear part of the preset chain from a pre-roll before its start
+(so the reverb tail of the previous segment is rebuilt) and a short overlap
+after its end. Segments are stitched with crossfades over the overlap,
+then the gain of `norm` and the fade out are applied and the result is
+encoded once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from fractions import Fraction
+
+import numpy as np
+from sox import file_info
+from sox.core import SoxError
+
+from .u_engine import Target
+from .u_limits import child_cpu_limit
+from .u_logger import get_logger
+from .u_pool import render_pool
+from .u_presets import FADE_OUT, NORM, Preset, get_preset
+
+LOG = get_logger()
+
+PREROLL = 5.0  # Seconds of audio before segment to rebuild the reverb tail
+OVERLAP = 0.1  # Seconds of crossfade between segments
+MIN_SEGMENT = 60  # Seconds
+BLOCK_SIZE = 1 << 16  # Frames
+SAMPLE_SIZE = 4  # Bytes of float32 sample
+
+
+@dataclass(frozen=True)
+class Layout:
+    """
+    Segments of the source audio (see `split`) and raw files which they
+    are rendered to.
+    """
+
+    paths: list
+    segments: list
+    overlap: int
+    sample_rate: int
+    channels: int
+
+
+def probe(file_path: str) -> tuple[int, int, int]:
+    """Returns sample rate, count of channels and count of frames of audio file."""
+
+    return (
+        int(file_info.sample_rate(file_path)),
+        file_info.channels(file_path),
+        int(file_info.num_samples(file_path) or 0),
+    )
+
+
+# pylint: disable-next=too-many-locals
+def split(frames: int, sample_rate: int, speed: float, count: int) -> tuple[list, int]:
+    """
+    Splits audio of `frames` into `count` segments. Returns list of
+    `(start, length, skip, keep)` for every segment and the overlap.
+    `start` and `length` are frames of the source to render (`length` is 0
+    for the last segment which is rendered till the end). `skip` and `keep`
+    are frames of the rendered segment to use, `keep` includes the overlap
+    and is 0 for the last segment. Boundaries are aligned so they fall
+    on whole frames of the output.
+    """
+
+    ratio = Fraction(speed).limit_denominator(1000)
+    step = ratio.numerator
+
+    def align(position: float) -> int:
+        return int(position // step) * step
+
+    def output(position: int) -> int:
+        return int(position / ratio)
+
+    preroll = align(PREROLL * sample_rate)
+    overlap = align(OVERLAP * sample_rate) or step
+    bounds = [0, *(align(frames * i / count) for i in range(1, count)), frames]
+
+    segments = []
+    for i in range(count):
+        start = max(bounds[i] - preroll, 0)
+        skip = output(bounds[i]) - output(start)
+        if i == count - 1:
+            segments.append((start, 0, skip, 0))
+        else:
+            end = bounds[i + 1] + overlap
+            keep = output(end) - output(bounds[i])
+            segments.append((start, end - start, skip, keep))
+
+    return segments, output(overlap)
+
+
+def predict_size(duration: float, speed: float, sample_rate: int = 44100) -> int:
+    """Returns predicted size in bytes of rendered stereo segments of audio."""
+
+    # Pre-rolls of segments add 10% at most
+    return int(duration / speed * 1.1 * sample_rate) * 2 * SAMPLE_SIZE
+
+
+def sox_run(args: list) -> str:
+    """Runs sox process and returns its stderr."""
+
+    # pylint: disable-next=subprocess-popen-preexec-fn
+    process = subprocess.run(
+        ["sox", *args], capture_output=True, check=False, preexec_fn=child_cpu_limit()
+    )
+    if process.returncode != 0:
+        raise SoxError(f"Stderr: {process.stderr.decode()}")
+    return process.stderr.decode()
+
+
+def render_segment(
+    file_path: str, segment_path: str, preset_name: str, start: int, length: int
+) -> float:
+    """
+    Renders the segment of audio file with the linear part of the preset
+    chain to raw float32 file. Returns the peak level of the segment after
+    `speed` effect for `norm`. It runs in the worker process of the render pool.
+    """
+
+    chain = get_preset(preset_name).linear_chain()
+    trim = ["trim", f"{start}s", *([f"{length}s"] if length else [])]
+    speed = chain.effects[:2]  # The chain starts with `speed` effect
+
+    stat = sox_run([*chain.globals, file_path, "-n", *trim, *speed, "stat"])
+    peak = max(
+        abs(float(line.split(":")[1]))
+        for line in stat.splitlines()
+        if line.startswith(("Maximum amplitude", "Minimum amplitude"))
+    )
+
+    sox_run(
+        [*chain.globals, file_path, "-t", "f32", segment_path, *trim, *chain.effects]
+    )
+
+    return peak
+
+
+def read_frames(file, start: int, count: int, channels: int) -> np.ndarray:
+    """Reads `count` (-1 for all) frames of raw float32 file from `start`."""
+
+    file.seek(start * channels * SAMPLE_SIZE)
+    samples = np.fromfile(file, dtype="<f4", count=count * channels if count > 0 else -1)
+    return samples.reshape(-1, channels)
+
+
+# pylint: disable-next=too-many-locals
+def stitch(layout: Layout, target: Target, gain: float) -> None:
+    """
+    Stitches rendered segments, applies gain and fade out, and encodes
+    the result to the `target` file. It runs in the worker process of the render pool.
+    """
+
+    segment_paths, segments, overlap = layout.paths, layout.segments, layout.overlap
+    sample_rate, channels = layout.sample_rate, layout.channels
+    last = len(segments) - 1
+    tail_frames = os.path.getsize(segment_paths[last]) // (channels * SAMPLE_SIZE)
+    total = sum(keep - overlap for *_, keep in segments[:last])
+    total += tail_frames - segments[last][2]
+    fade_length = FADE_OUT * sample_rate
+    written = 0
+
+    with open(target.path, "wb") as output:
+        output.write(target.header)
+
+        # Sox writes to pipe, so it never seeks back to rewrite the header
+        # pylint: disable-next=subprocess-popen-preexec-fn
+        with subprocess.Popen(
+            [
+                "sox", "-D", "-V2",
+                "-t", "f32", "-r", str(sample_rate), "-c", str(channels), "-",
+                "-t", "mp3", "--comment", "", "-C", f"{target.bitrate:f}", "-",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=child_cpu_limit(),
+        ) as process:
+            copier = threading.Thread(target=shutil.copyfileobj, args=(process.stdout, output))
+            copier.start()
+
+            def write(samples: np.ndarray) -> None:
+                nonlocal written
+                samples = samples[: total - written]
+                positions = written + np.arange(len(samples))
+                fade = np.clip((total - positions) / fade_length, 0, 1)
+                samples = samples * gain * np.sin(np.pi / 2 * fade)[:, None]
+                process.stdin.write(np.clip(samples, -1, 1).astype("<f4").tobytes())  # type: ignore
+                written += len(samples)
+
+            try:
+                tail = None
+                for i, (path, (*_, skip, keep)) in enumerate(zip(segment_paths, segments)):
+                    end = tail_frames if i == last else skip + keep - overlap
+                    position = skip
+                    with open(path, "rb") as segment:
+                        if tail is not None:
+                            head = read_frames(segment, position, len(tail), channels)
+                            ramp = np.linspace(0, 1, len(head), dtype=np.float32)[:, None]
+                            write(tail[: len(head)] * (1 - ramp) + head * ramp)
+                            position += len(head)
+
+                        while position < end:
+                            block = read_frames(
+                                segment, position, min(BLOCK_SIZE, end - position), channels
+                            )
+                            if not block.size:
+                                break
+                            write(block)
+                            position += len(block)
+
+                        if i != last:
+                            tail = read_frames(segment, position, overlap, channels)
+            finally:
+                process.stdin.close()  # type: ignore
+                copier.join()
+                err = process.stderr.read().decode()  # type: ignore
+                process.wait()
+
+    if process.returncode != 0:
+        raise SoxError(f"Stderr: {err}")
+
+    LOG.info("Created %s from %d segments", target.path, len(segments))
+
+
+# pylint: disable-next=too-many-locals
+async def render_by_segments(
+    file_path: str,
+    target: Target,
+    preset: Preset,
+    count: int = 0,
+    timeout: float | None = None,
+) -> None:
+    """
+    Renders audio file to the `target` file by `count` segments in parallel in the render pool
+    (by one segment of `MIN_SEGMENT` at least per worker by default).
+    All steps share one deadline, so rendering is interrupted by
+    RenderTimeout after `timeout` seconds in total. Every step gets the
+    time left when a worker takes it, so segments waiting for a busy
+    worker don't extend the deadline.
+    """
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    sample_rate, channels, frames = await render_pool.run(
+        probe, file_path, deadline=deadline
+    )
+    if not count:
+        count = min(render_pool.workers, int(frames / sample_rate // MIN_SEGMENT))
+    count = max(count, 1)
+
+    segments, overlap = split(frames, sample_rate, preset.speed, count)
+    segment_paths = [f"{target.path[:-4]}_{i}.f32" for i in range(count)]
+
+    try:
+        peaks = await asyncio.gather(
+            *(
+                render_pool.run(
+                    render_segment,
+                    file_path,
+                    path,
+                    preset.name,
+                    start,
+                    length,
+                    deadline=deadline,
+                )
+                for path, (start, length, *_) in zip(segment_paths, segments)
+            )
+        )
+        peak = max(peaks)
+        gain = 10 ** (NORM / 20) / peak if peak else 1.0
+
+        layout = Layout(segment_paths, segments, overlap, sample_rate, channels)
+        await render_pool.run(stitch, layout, target, gain, deadline=deadline)
+    finally:
+        for path in segment_paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,112 +1,263 @@
-from sox import Transformer, file_info
-from sox.core import SoxError, sox
+import atexit
+import re
+import shutil
+import signal
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable
 
+from sox import Transformer
+from sox.core import SoxError
+
+from .u_exceptions import RenderTimeout
+from .u_limits import (
+    child_cpu_limit,
+    cpu_budget,
+    deferred_signals,
+    limit_cpu,
+    reset_cpu_limit,
+)
 from .u_logger import get_logger
 
 LOG = get_logger()
 
+# Progress line of sox: In:12.34% 00:00:05.12 [00:00:40.00] Out:...
+PROGRESS = re.compile(rb"In:\S*\s+(\d+):(\d\d):(\d\d(?:\.\d+)?)")
+
+
+class SoxSpares:
+    """
+    Pre-forked sox processes which wait for audio on stdin. A process is
+    forked in the background for the next job with the same arguments as
+    soon as the previous one is taken, so the job doesn't wait for sox to
+    start. Sox reads all arguments at start, so spares are kept for `size`
+    recently used arguments (presets and bitrates) and always report
+    progress. Spares don't inherit the CPU limit of the job which forked
+    them, the limit of the job which takes the spare is set instead.
+    """
+
+    def __init__(self, size: int = 1) -> None:
+        self.size = size
+        self.__spares: OrderedDict[tuple, subprocess.Popen] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__forker = ThreadPoolExecutor(1, thread_name_prefix="sox-spares")
+        atexit.register(self.close)
+
+    @staticmethod
+    def spawn(args: list, spare: bool = False) -> subprocess.Popen:
+        """
+        Starts sox process with pipes. The spare has no CPU limit,
+        others get CPU time left to the job.
+        """
+
+        # pylint: disable-next=subprocess-popen-preexec-fn
+        return subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=reset_cpu_limit if spare else child_cpu_limit(),
+        )
+
+    def take(self, args: list) -> subprocess.Popen:
+        """Returns pre-forked process with the arguments or starts a new one."""
+
+        with self.__lock:
+            process = self.__spares.pop(tuple(args), None)
+        if process is None or process.poll() is not None:
+            process = self.spawn(args)
+        else:
+            # CPU time left to the job (the worker is limited by the deadline)
+            limit_cpu(cpu_budget(), pid=process.pid)
+        if self.size:
+            self.__forker.submit(self.prefork, args)
+        return process
+
+    def prefork(self, args: list) -> None:
+        """Forks the process for the next job, spares of the oldest arguments are killed."""
+
+        process = self.spawn(args, spare=True)
+        with self.__lock:
+            self.__spares[tuple(args)] = process
+            self.__spares.move_to_end(tuple(args))
+            oldest = []
+            while len(self.__spares) > self.size:
+                oldest.append(self.__spares.popitem(last=False)[1])
+        for spare in oldest:
+            self.kill(spare)
+
+    @staticmethod
+    def kill(process: subprocess.Popen) -> None:
+        """Kills the idle process."""
+
+        process.kill()
+        process.communicate()
+
+    def close(self) -> None:
+        """Waits for the forks and kills all idle processes."""
+
+        self.__forker.shutdown(wait=True)
+        with self.__lock:
+            spares, self.__spares = list(self.__spares.values()), OrderedDict()
+        for process in spares:
+            self.kill(process)
+
 
 class ExtTransformer(Transformer):
     """Extend sox.Transformer class for bitrate support."""
 
-    def build(
-        self,
-        input_filepath=None,
-        output_filepath=None,
-        input_array=None,
-        sample_rate_in=None,
-        extra_args=None,
-        return_output=False,
-        bitrate=None,
-    ):
+    def fade_out(self, stop_position: float, fade_out_len: float = 1.0):
         """
-        Given an input file, creates an output_file on disk by
-        executing the current set of commands. This function returns True on
-        success. If return_output is True, this function returns a triple of
-        (status, out, err), giving the success state, along with stdout and
-        stderr returned by sox.
-
-        Parameters
-        ----------
-        input_filepath : str or None
-            Either path to input audio file or None for array input.
-        output_filepath : str
-            Path to desired output file. If a file already exists at
-            the given path, the file will be overwritten.
-            If '-n', no file is created.
-        input_array : np.ndarray or None
-            An np.ndarray of an waveform with shape (n_samples, n_channels).
-            sample_rate_in must also be provided.
-            If None, input_filepath must be specified.
-        sample_rate_in : int
-            Sample rate of input_array.
-            This argument is ignored if input_array is None.
-        extra_args : list or None, default=None
-            If a list is given, these additional arguments are passed to SoX
-            at the end of the list of effects.
-            Don't use this argument unless you know exactly what you're doing!
-        return_output : bool, default=False
-            If True, returns the status and information sent to stderr and
-            stdout as a tuple (status, stdout, stderr).
-            If output_filepath is None, return_output=True by default.
-            If False, returns True on success.
-        bitrate : float
-            Bitrate of output file or None.
-
-        Returns
-        -------
-        status : bool
-            True on success.
-        out : str (optional)
-            This is not returned unless return_output is True.
-            When returned, captures the stdout produced by sox.
-        err : str (optional)
-            This is not returned unless return_output is True.
-            When returned, captures the stderr produced by sox.
+        Add a fade out which ends at the given position (in seconds).
+        Unlike `fade` it doesn't reverse audio, so it doesn't buffer
+        whole audio and can be used with streams.
         """
 
-        input_format, input_filepath = self._parse_inputs(
-            input_filepath, input_array, sample_rate_in
-        )
+        self.effects.extend(["fade", "q", "0", f"{stop_position:f}", f"{fade_out_len:f}"])
+        self.effects_log.append("fade")
 
-        if output_filepath is None:
-            raise ValueError("output_filepath is not specified!")
+        return self
 
-        # set output parameters
-        if input_filepath == output_filepath:
-            raise ValueError("input_filepath must be different from output_filepath.")
-        file_info.validate_output_file(output_filepath)
+    def stream_args(
+        self,
+        file_type: str = "mp3",
+        bitrate: float | None = None,
+        input_filepath: str = "-",
+    ) -> list:
+        """
+        Returns arguments for sox process which reads audio from stdin
+        (or from `input_filepath`) and writes the result to stdout with
+        the current set of commands. Comments from the input are not copied
+        to the output stream.
+        """
 
-        args = []
+        args = ["sox"]
         args.extend(self.globals)
-        args.extend(self._input_format_args(input_format))
-        args.append(input_filepath)
-        args.extend(self._output_format_args(self.output_format))
+        args.extend(["-t", file_type, input_filepath])
+        args.extend(["-t", file_type, "--comment", ""])
 
         if bitrate is not None:
             if not isinstance(bitrate, float):
                 raise ValueError("bitrate must be a float.")
             args.extend(["-C", f"{bitrate:f}"])
 
-        args.append(output_filepath)
+        args.append("-")
         args.extend(self.effects)
 
-        if extra_args is not None:
-            if not isinstance(extra_args, list):
-                raise ValueError("extra_args must be a list.")
-            args.extend(extra_args)
+        return args
+
+    def build_fileobj(
+        self,
+        input_filepath: str,
+        output_file: BinaryIO,
+        file_type: str = "mp3",
+        bitrate: float | None = None,
+    ) -> int:
+        """
+        Given an input file, writes the result to the file object from its
+        current position, so the data written before (e.g. ID3 tag) is kept.
+        Sox writes to pipe, so it never seeks back to rewrite the output.
+        Returns count of bytes written.
+        """
+
+        # pylint: disable-next=subprocess-popen-preexec-fn
+        with subprocess.Popen(
+            self.stream_args(file_type, bitrate, input_filepath=input_filepath),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=child_cpu_limit(),
+        ) as process:
+            start = output_file.tell()
+            shutil.copyfileobj(process.stdout, output_file)  # type: ignore
+            err = process.stderr.read().decode()  # type: ignore
 
-        status, out, err = sox(args, input_array, True)
-        if status != 0:
-            raise SoxError(f"Stdout: {out}\nStderr: {err}")
+        if process.returncode != 0:
+            raise SoxError(f"Stderr: {err}")
 
         LOG.info(
             "Created %s with effects: %s",
-            output_filepath,
+            getattr(output_file, "name", "file"),
             " ".join(self.effects_log),
         )
 
-        if return_output:
-            return status, out, err
+        return output_file.tell() - start
+
+    # pylint: disable-next=too-many-locals
+    def build_pipe(
+        self,
+        input_file: BinaryIO,
+        output_file: BinaryIO,
+        bitrate: float | None = None,
+        spares: SoxSpares | None = None,
+        progress: Callable[[float], None] | None = None,
+    ) -> int:
+        """
+        Pipes MP3 from the input file object through sox process to the
+        output file object from its current position. The process is taken
+        from pre-forked `spares` if given. `progress` is called with seconds
+        of the input processed by sox. Returns count of bytes written.
+        """
+
+        args = self.stream_args(bitrate=bitrate)
+        # Spares always report progress, so jobs with and without it share them
+        if progress is not None or spares is not None:
+            args.insert(1, "-S")
+        process = spares.take(args) if spares is not None else SoxSpares.spawn(args)
+        errors: list[bytes] = []
+
+        def feed():
+            try:
+                shutil.copyfileobj(input_file, process.stdin)  # type: ignore
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Sox has failed, the error is read from stderr
+            finally:
+                process.stdin.close()  # type: ignore
+
+        def collect():
+            # Progress lines are separated by carriage returns
+            buffer = b""
+            while chunk := process.stderr.read1(4096):  # type: ignore
+                *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+                for line in lines:
+                    if match := PROGRESS.match(line):
+                        hours, minutes, seconds = match.groups()
+                        if progress is not None:
+                            progress(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+                    elif line.strip():
+                        errors.append(line)
+            errors.append(buffer)
+
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        collector = threading.Thread(target=collect)
+        collector.start()
+
+        start = output_file.tell()
+        try:
+            shutil.copyfileobj(process.stdout, output_file)  # type: ignore
+        except BaseException:
+            # The job is interrupted (e.g. by the deadline)
+            process.kill()
+            raise
+        finally:
+            # The deadline is raised after the cleanup, so threads and sox aren't left
+            with deferred_signals(signal.SIGALRM, signal.SIGXCPU):
+                feeder.join()
+                collector.join()
+                process.wait()
+        err = b"\n".join(errors).decode(errors="replace").strip()
+
+        if process.wait() == -signal.SIGXCPU:
+            raise RenderTimeout("Rendering exceeded its CPU limit")
+        if process.returncode != 0:
+            raise SoxError(f"Stderr: {err}")
+
+        LOG.info(
+            "Created %s with effects: %s",
+            getattr(output_file, "name", "file"),
+            " ".join(self.effects_log),
+        )
 
-        return True
+        return output_file.tell() - start
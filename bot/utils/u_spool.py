@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from bot.config import config
+from bot.utils.u_logger import get_logger
+
+LOG = get_logger()
+LOCK_FILE = ".lock"  # Locked by the process while it uses its directory
+STAGING_AGE = 60  # Seconds before the staging directory of a starting process is reclaimed
+
+
+class Spool:  # pylint: disable=too-many-instance-attributes
+    """
+    A class that manages directory for temporary audio files of the jobs.
+    The directory can be placed on tmpfs apart from the database. Jobs
+    reserve bytes of the quota before they write files and wait while
+    the quota is exhausted. Files left by crashed jobs are swept at
+    startup and periodically.
+
+    The directory can be shared by the Bot and render workers, so every
+    process keeps its files in its own subdirectory locked by the process
+    and sweeps only it. Subdirectories of exited processes are unlocked
+    and removed at startup.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        quota: int = 0,
+        sweep_interval: int = 600,
+        max_age: int = 3600,
+    ) -> None:
+        self.root = directory
+        self.directory = os.path.join(directory, uuid.uuid4().hex)
+        self.quota = quota
+        self.sweep_interval = sweep_interval
+        self.max_age = max_age
+        self.used = 0
+        self.__active: set[str] = set()
+        self.__condition: asyncio.Condition | None = None
+        self.__sweeper: asyncio.Task | None = None
+        self.__lock = None
+
+    async def start(self) -> None:
+        """
+        Creates and locks the directory of the process, removes files
+        left by exited processes and starts the sweeper.
+        """
+
+        # The directory is locked before it appears, so others don't reclaim it
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".", dir=self.root)
+        self.__lock = open(  # pylint: disable=consider-using-with
+            os.path.join(staging, LOCK_FILE), "w", encoding="utf-8"
+        )
+        fcntl.flock(self.__lock, fcntl.LOCK_EX)
+        os.rename(staging, self.directory)
+
+        removed = self.reclaim()
+        LOG.info(
+            "Start spool in %s (quota: %s bytes), removed %d orphaned files.",
+            self.directory,
+            self.quota or "unlimited",
+            removed,
+        )
+
+        if self.sweep_interval:
+            self.__sweeper = asyncio.create_task(self.sweeper())
+
+    def stop(self) -> None:
+        """Stops the sweeper and removes the directory of the process."""
+
+        if self.__sweeper is not None:
+            self.__sweeper.cancel()
+            self.__sweeper = None
+
+        if self.__lock is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.__lock.close()
+            self.__lock = None
+
+    def reclaim(self) -> int:
+        """
+        Removes subdirectories of exited processes (their locks are free)
+        and old files left in the shared directory by older versions.
+        Staging directories of processes which exited while they started
+        are removed after STAGING_AGE. Returns count of removed files.
+        """
+
+        now = time.time()
+        deadline = now - self.max_age
+        removed = 0
+
+        for entry in os.scandir(self.root):
+            if entry.path == self.directory:
+                continue
+            try:
+                if entry.name.startswith("."):
+                    if entry.is_dir() and entry.stat().st_mtime < now - STAGING_AGE:
+                        removed += self.reclaim_directory(entry.path)
+                elif entry.is_dir():
+                    removed += self.reclaim_directory(entry.path)
+                elif entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as error:
+                LOG.warning("Can't sweep %s - %s", entry.path, error)
+
+        return removed
+
+    @staticmethod
+    def reclaim_directory(directory: str) -> int:
+        """Removes the directory if its process has exited. Returns count of removed files."""
+
+        with open(os.path.join(directory, LOCK_FILE), "a", encoding="utf-8") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:  # The process is alive
+                return 0
+            count = sum(len(files) for _root, _dirs, files in os.walk(directory)) - 1
+            shutil.rmtree(directory)
+            return count
+
+    def new_file(self, suffix: str = ".mp3") -> str:
+        """
+        Returns path to the new file in the spool. Files which names
+        start with the name of this file (e.g. `_slow.mp3` outputs)
+        are not swept until `remove` is called.
+        """
+
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}{suffix}")
+        self.__active.add(path)
+        return path
+
+    def hand_over(self, path: str | None) -> None:
+        """
+        Lets the file be swept when it gets old. The file is handed to a job,
+        which may run in another process, see `take_over`.
+        """
+
+        if path is not None:
+            self.__active.discard(path)
+
+    def take_over(self, path: str) -> None:
+        """Keeps the file handed by another process until `remove` is called."""
+
+        self.__active.add(path)
+
+    def remove(self, *paths: str | None) -> None:
+        """Removes files of the spool if they exist."""
+
+        for path in paths:
+            if path is None:
+                continue
+            self.__active.discard(path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, size: int):
+        """
+        Reserves `size` bytes of the quota for the job and waits while
+        the quota is exhausted. A job bigger than the whole quota runs alone.
+        """
+
+        if not self.quota or size <= 0:
+            yield
+            return
+
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+
+        async with self.__condition:
+            if self.used and self.used + size > self.quota:
+                LOG.debug("Spool quota is exhausted, wait for %d bytes.", size)
+            await self.__condition.wait_for(
+                lambda: not self.used or self.used + size <= self.quota
+            )
+            self.used += size
+
+        try:
+            yield
+        finally:
+            async with self.__condition:
+                self.used -= size
+                self.__condition.notify_all()
+
+    def is_active(self, path: str) -> bool:
+        """True if the file belongs to the running job."""
+
+        return any(path.startswith(active[:-4]) for active in self.__active)
+
+    def sweep(self, max_age: int | None = None) -> int:
+        """
+        Removes files which are older than `max_age` seconds and don't
+        belong to the running jobs. Returns count of removed files.
+        """
+
+        max_age = self.max_age if max_age is None else max_age
+        deadline = time.time() - max_age
+        removed = 0
+
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name == LOCK_FILE and root == self.directory:
+                    continue
+                try:
+                    if self.is_active(path) or os.path.getmtime(path) > deadline:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                except OSError as error:
+                    LOG.warning("Can't sweep file %s - %s", path, error)
+
+        return removed
+
+    async def sweeper(self) -> None:
+        """Loop that periodically sweeps orphaned files."""
+
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            if removed := self.sweep():
+                LOG.warning("Removed %d orphaned files from the spool.", removed)
+
+
+spool = Spool(
+    config.SPOOL_DIR,
+    quota=config.SPOOL_QUOTA * 1024 * 1024,
+    sweep_interval=config.SPOOL_SWEEP_INTERVAL,
+)
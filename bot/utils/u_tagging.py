@@ -1,31 +1,37 @@
+import io
+from typing import Iterable
+
 from mutagen import MutagenError, id3
 
-from .u_brand import get_bot_mention, get_tag_comment
+from .u_brand import get_brand
 from .u_logger import get_logger
 
 LOG = get_logger()
+PADDING = 1024  # Bytes reserved in the tag for in-place updates
 
 
 class Tagging:
     """MP3 ID3 tagging class."""
 
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str | io.BytesIO) -> None:
         self.__file_path = file_path
         try:
             self.__id3 = id3.ID3(file_path)
         except id3.ID3NoHeaderError:
             self.__id3 = id3.ID3()
 
-    def copy_from(self, source_path: str) -> bool:
+    def copy_from(self, source_path: str | io.BytesIO, skip: Iterable[str] = ()) -> bool:
         """
-        It reads the ID3 tags from the file,
-        and adds them to the current file.
+        It reads the ID3 tags from the file (or file-like object),
+        and adds them to the current file. Frames with ids from `skip`
+        (e.g. APIC which will be replaced) are not copied.
         """
 
         try:
             source = id3.ID3(source_path)
             for frame in source.values():
-                self.__id3.add(frame)
+                if frame.FrameID not in skip:
+                    self.__id3.add(frame)
             return True
         except MutagenError as error:
             LOG.warning(
@@ -42,15 +48,19 @@ class Tagging:
         a link to the bot's telegram channel.
         """
 
-        bot_mention = await get_bot_mention()
-        comment_text = await get_tag_comment()
+        brand = await get_brand()
 
         # Add comment field
-        self.__id3.add(id3.COM(text=comment_text))
+        self.__id3.add(id3.COM(text=brand.comment))
 
         # Add website field
         self.__id3.delall("WOAR")
-        self.__id3.add(id3.WOAR(url=f"https://t.me/{bot_mention[1:]}"))
+        self.__id3.add(id3.WOAR(url=f"https://t.me/{brand.username}"))
+
+        # Add cached cover art
+        if brand.cover is not None:
+            self.__id3.delall("APIC")
+            self.__id3.add(brand.cover)
 
     def add_cover(self, image_path: str, desc: str | None = None) -> bool:
         """
@@ -87,6 +97,17 @@ class Tagging:
 
         return None
 
+    def to_bytes(self, padding: int = PADDING) -> bytes:
+        """
+        It renders the ID3 tags to bytes to put them before audio data.
+        The `padding` is reserved to update the tag later without
+        rewriting the whole file.
+        """
+
+        buffer = io.BytesIO()
+        self.__id3.save(buffer, v2_version=3, padding=lambda _info: padding)
+        return buffer.getvalue()
+
     def save(self, file_path: str | None = None) -> bool:
         """It tries to save the ID3 tags to the file."""
 
@@ -1,4 +1,7 @@
-from aiogram import Bot, Dispatcher, executor
+import asyncio
+import signal
+
+from aiogram import Dispatcher, executor
 from aiogram.contrib.fsm_storage.redis import RedisStorage2
 
 from bot.config import config
@@ -6,10 +9,24 @@ from bot.middlewares.m_throttling import ThrottlingMiddleware
 from bot.setup import on_shutdown, on_startup
 from bot.utils.u_admin import IsAdmin
 from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import MetricsBot
 
 LOG = get_logger()
 
 
+def stop_on_sigterm(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Stops polling on SIGTERM like on SIGINT. The executor handles only
+    SystemExit and KeyboardInterrupt, so without it `docker stop` kills
+    the Bot before `on_shutdown` drains the queue.
+    """
+
+    def stop() -> None:
+        raise SystemExit
+
+    loop.add_signal_handler(signal.SIGTERM, stop)
+
+
 def main():
     """Main app runner."""
 
@@ -27,12 +44,13 @@ def main():
     )
 
     storage = RedisStorage2(host=config.REDIS_HOST, port=config.REDIS_PORT)
-    bot = Bot(token=config.BOT_TOKEN, parse_mode="HTML")
+    bot = MetricsBot(token=config.BOT_TOKEN, parse_mode="HTML")
     dp = Dispatcher(bot, storage=storage)
     dp.errors_handlers.once = True  # Fix errors rethrowing
     dp.middleware.setup(throttling_middleware)  # Throttling middleware
     dp.filters_factory.bind(IsAdmin)
 
+    stop_on_sigterm(asyncio.get_event_loop())
     executor.start_polling(
         dp,
         skip_updates=True,  # reset pending updates
@@ -19,3 +19,13 @@ CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER NOT NULL UNIQUE,
     username CHAR NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS fingerprint (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    match_id INTEGER NOT NULL UNIQUE,
+    duration INTEGER NOT NULL,
+    preset CHAR NOT NULL,
+    hash INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS fingerprint_duration ON fingerprint (preset, duration);
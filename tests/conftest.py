@@ -0,0 +1,5 @@
+import os
+
+# The config is read on import of `bot`, so it needs the required settings
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("ADMIN_ID", "1")
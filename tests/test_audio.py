@@ -0,0 +1,74 @@
+import asyncio
+
+from bot.utils.u_audio import split_id3_head
+
+
+def syncsafe(size: int) -> bytes:
+    """Returns the syncsafe size of ID3 header."""
+
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def id3_tag(body: bytes, footer: bool = False) -> bytes:
+    """Returns ID3 tag with the body."""
+
+    flags = 0x10 if footer else 0
+    tag = b"ID3\x04\x00" + bytes([flags]) + syncsafe(len(body)) + body
+    if footer:
+        tag += b"3DI\x04\x00" + bytes([flags]) + syncsafe(len(body))
+    return tag
+
+
+def split(data: bytes, chunk_size: int) -> tuple[bytes, bytes]:
+    """Splits the stream of `chunk_size` chunks into the tag and the rest."""
+
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start : start + chunk_size]
+
+    async def run():
+        head, rest = await split_id3_head(chunks())
+        return head, b"".join([chunk async for chunk in rest])
+
+    return asyncio.run(run())
+
+
+def test_split_id3_head_by_small_chunks():
+    """The tag is collected from chunks smaller than its header."""
+
+    tag = id3_tag(b"\x00" * 300)
+    audio = b"\xff\xfb" + b"\x01" * 1000
+
+    assert split(tag + audio, 7) == (tag, audio)
+
+
+def test_split_id3_head_in_one_chunk():
+    """The tag and the audio are split inside one chunk."""
+
+    tag = id3_tag(b"TIT2" + b"\x00" * 50)
+    audio = b"\xff\xfb" * 100
+
+    assert split(tag + audio, 65536) == (tag, audio)
+
+
+def test_split_id3_head_with_footer():
+    """The footer is counted in the size of the tag."""
+
+    tag = id3_tag(b"\x00" * 20, footer=True)
+    audio = b"\xff\xfb" * 10
+
+    assert split(tag + audio, 16) == (tag, audio)
+
+
+def test_split_id3_head_without_tag():
+    """The stream without the tag is kept as is."""
+
+    audio = b"\xff\xfb" * 100
+
+    assert split(audio, 9) == (b"", audio)
+
+
+def test_split_id3_head_of_short_stream():
+    """The stream shorter than the header is kept as is."""
+
+    assert split(b"ID3", 2) == (b"", b"ID3")
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from bot import db
+
+SCHEMA = "CREATE TABLE likes (match_id INTEGER, user_id INTEGER, UNIQUE (match_id, user_id));"
+LIKE = "INSERT INTO likes (match_id, user_id) VALUES (?, ?);"
+
+
+@pytest.fixture(name="executor")
+def fixture_executor(tmp_path, monkeypatch):
+    """Executor of a temporary database with the schema."""
+
+    connections = db.Connections(str(tmp_path / "db.sqlite"))
+    with connections.writer() as conn:
+        conn.execute(SCHEMA)
+    monkeypatch.setattr(db, "connections", connections)
+
+    executor = db.Executor(readers=1, delay=0)
+    yield executor
+    executor.close()
+    connections.close()
+
+
+def count_likes() -> int:
+    """Returns count of rows of the likes table."""
+
+    return db.read_query("SELECT COUNT(*) FROM likes;", ()).fetchone()[0]
+
+
+def test_write_error_of_one_query_keeps_others(executor):
+    """Failed queries of the batch get their errors, others are written."""
+
+    async def run():
+        return await asyncio.gather(
+            executor.write(LIKE, (1, 1)),
+            executor.write(LIKE, (1, 1)),  # Violates the unique constraint
+            executor.write(LIKE, (1, 2**70)),  # Too big integer
+            executor.write(LIKE, (1, 2)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+
+    assert isinstance(results[1], db.sqlite3.IntegrityError)
+    assert isinstance(results[2], OverflowError)
+    assert results[0].rowcount == results[3].rowcount == 1
+    assert count_likes() == 2
+
+
+def test_writer_survives_failed_batch(executor, monkeypatch):
+    """The writer answers the failed batch and keeps serving next ones."""
+
+    write_queries = db.write_queries
+
+    def fail_once(_queries):
+        monkeypatch.setattr(db, "write_queries", write_queries)
+        raise RuntimeError("disk is gone")
+
+    monkeypatch.setattr(db, "write_queries", fail_once)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await executor.write(LIKE, (1, 1))
+        return await asyncio.wait_for(executor.write(LIKE, (1, 1)), timeout=5)
+
+    assert asyncio.run(run()).rowcount == 1
+    assert count_likes() == 1
+
+
+def test_update_match_removes_placeholder_of_saved_original(executor, monkeypatch):
+    """The second render of the same original leaves no placeholder row."""
+
+    monkeypatch.setattr(db, "executor", executor)
+    db.execute_script("./schema.sql")
+
+    async def run():
+        first = await db.create_empty_match("original")
+        second = await db.create_empty_match("original")
+        saved = [
+            await db.update_match(first, "original", "slowed-1", 1),
+            await db.update_match(second, "original", "slowed-2", 2),
+        ]
+        return first, saved
+
+    first, saved = asyncio.run(run())
+
+    assert saved == [first, first]
+    assert db.read_query("SELECT original, slowed FROM match;", ()).fetchall() == [
+        ("original", "slowed-1")
+    ]
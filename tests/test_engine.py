@@ -0,0 +1,90 @@
+import importlib.util
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from bot.config import AppConfig
+from bot.utils.u_engine import Convolver, Engine, Resampler
+
+
+def stream(processor, signal: np.ndarray, sizes: tuple[int, ...]) -> np.ndarray:
+    """Pushes the signal by blocks of repeating sizes and flushes the processor."""
+
+    blocks = []
+    start = 0
+    while start < len(signal):
+        for size in sizes:
+            blocks.append(processor.push(signal[start : start + size]))
+            start += size
+    blocks.append(processor.flush())
+    return np.concatenate(blocks)
+
+
+def test_convolver_matches_direct_convolution():
+    """Blocks of the convolver add up to the direct convolution."""
+
+    rng = np.random.default_rng(0)
+    signal = rng.standard_normal((5000, 2)).astype(np.float32)
+    impulse_response = rng.standard_normal((2, 300)).astype(np.float32)
+
+    result = stream(Convolver(impulse_response), signal, (1, 700, 4096, 33))
+
+    assert len(result) >= len(signal)
+    for channel in range(2):
+        expected = np.convolve(signal[:, channel], impulse_response[channel])[: len(signal)]
+        np.testing.assert_allclose(result[: len(signal), channel], expected, atol=1e-3)
+
+
+def test_convolver_with_unit_impulse():
+    """The unit impulse keeps the signal."""
+
+    signal = np.linspace(-1, 1, 1000, dtype=np.float32)[:, None]
+    impulse_response = np.zeros((1, 64), dtype=np.float32)
+    impulse_response[0, 0] = 1
+
+    result = stream(Convolver(impulse_response), signal, (100,))
+
+    np.testing.assert_allclose(result[: len(signal)], signal, atol=1e-5)
+
+
+def test_resampler_keeps_signal_at_unit_ratio():
+    """The signal is kept at the unit ratio."""
+
+    signal = np.random.default_rng(1).standard_normal((3000, 2)).astype(np.float32)
+
+    result = stream(Resampler(1.0, channels=2), signal, (500, 17))
+
+    np.testing.assert_allclose(result[: len(signal)], signal, atol=1e-5)
+
+
+def test_resampler_changes_length_by_ratio():
+    """The length of output is divided by the ratio."""
+
+    ratio = 0.75
+    signal = np.ones((40000, 1), dtype=np.float32)
+
+    result = stream(Resampler(ratio, channels=1), signal, (4096,))
+
+    assert abs(len(result) - len(signal) / ratio) < 64
+    # Constant signal stays constant apart from its edges
+    np.testing.assert_allclose(result[100:50000], 1, atol=1e-2)
+
+
+def test_engine_requires_render():
+    """Engines without `render` can't be created."""
+
+    with pytest.raises(TypeError):
+        Engine()  # pylint: disable=abstract-class-instantiated
+
+
+def test_numpy_engine_requires_soundfile(monkeypatch):
+    """Selection of the NumPy engine without `soundfile` is a config error."""
+
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+
+    with pytest.raises(ValidationError, match="soundfile"):
+        AppConfig.model_validate({"AUDIO_ENGINE": "numpy"})
+    with pytest.raises(ValidationError, match="sox or numpy"):
+        AppConfig.model_validate({"AUDIO_ENGINE": "ffmpeg"})
+    assert AppConfig.model_validate({}).AUDIO_ENGINE == "sox"
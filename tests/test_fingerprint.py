@@ -0,0 +1,82 @@
+import asyncio
+
+import numpy as np
+
+from bot import db
+from bot.config import config
+from bot.utils.u_fingerprint import distance, find_match, fingerprint
+
+SAMPLE_RATE = 11025
+
+
+def noise(seconds: int, seed: int) -> np.ndarray:
+    """Returns mono noise of the given seed."""
+
+    return np.random.default_rng(seed).standard_normal(seconds * SAMPLE_RATE) * 0.3
+
+
+def melody(seconds: int, seed: int) -> np.ndarray:
+    """Returns mono track of random notes with beats of the given seed."""
+
+    rng = np.random.default_rng(seed)
+    beat = SAMPLE_RATE // 2
+    time_ = np.arange(beat) / SAMPLE_RATE
+    notes = []
+    for freq in rng.choice([220, 247, 262, 294, 330, 349, 392, 440], seconds * 2):
+        note = 0.3 * np.sin(2 * np.pi * freq * time_) + 0.2 * np.sin(4 * np.pi * freq * time_)
+        note[:800] += rng.standard_normal(800) * 0.3
+        notes.append(note)
+    return np.concatenate(notes)
+
+
+def test_distance():
+    """The distance is the count of different bits of 64-bit hashes."""
+
+    assert distance(0, 0) == 0
+    assert distance(0b1011, 0b0001) == 2
+    assert distance(-1, 0) == 64
+    assert distance((1 << 64) - 1, 0) == 64
+
+
+def test_fingerprint_survives_volume_and_leading_silence():
+    """Quieter audio with leading silence has close fingerprint."""
+
+    samples = noise(30, seed=0)
+    shifted = np.concatenate((np.zeros(SAMPLE_RATE // 3), samples * 0.5))
+
+    assert distance(fingerprint(samples, SAMPLE_RATE), fingerprint(shifted, SAMPLE_RATE)) <= 4
+
+
+def test_fingerprint_tells_different_audio():
+    """Different audio has distant fingerprints."""
+
+    first = fingerprint(noise(30, seed=0), SAMPLE_RATE)
+    second = fingerprint(noise(30, seed=1), SAMPLE_RATE)
+
+    assert distance(first, second) > 10
+
+
+def test_fingerprint_of_silence_and_short_audio():
+    """Silence and too short audio have no fingerprint."""
+
+    assert fingerprint(np.zeros(SAMPLE_RATE * 10), SAMPLE_RATE) is None
+    assert fingerprint(noise(1, seed=0), SAMPLE_RATE) is None
+
+
+def test_different_tracks_of_same_duration_dont_match(monkeypatch):
+    """Tracks of the same duration and sound aren't taken for copies of each other."""
+
+    tracks = [fingerprint(melody(60, seed), SAMPLE_RATE) for seed in range(8)]
+    rows = [
+        (seed, f"original-{seed}", f"slowed-{seed}", 1, 1, 0, value)
+        for seed, value in enumerate(tracks)
+    ]
+
+    async def get_fingerprint_matches(_duration, _preset):
+        return rows[1:]
+
+    monkeypatch.setattr(db, "get_fingerprint_matches", get_fingerprint_matches)
+
+    assert min(distance(tracks[0], value) for value in tracks[1:]) > config.FINGERPRINT_DISTANCE
+    assert asyncio.run(find_match(tracks[0], 60, "vinyl")) is None
+    assert asyncio.run(find_match(tracks[1], 60, "vinyl"))[0] == 1
@@ -0,0 +1,56 @@
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from bot.utils.u_limits import child_cpu_limit, cpu_budget, deferred_signals, limit_cpu
+
+resource = pytest.importorskip("resource")
+
+READ_LIMIT = "import resource; print(resource.getrlimit(resource.RLIMIT_CPU)[0])"
+
+
+def test_child_gets_cpu_time_left():
+    """The limit of the child counts from its start, not from the start of the process."""
+
+    limit_cpu(100)
+    try:
+        budget = cpu_budget()
+        output = subprocess.run(
+            [sys.executable, "-c", READ_LIMIT],
+            capture_output=True,
+            check=True,
+            preexec_fn=child_cpu_limit(),  # pylint: disable=subprocess-popen-preexec-fn
+        )
+    finally:
+        limit_cpu(None)
+
+    assert budget is not None
+    assert int(output.stdout) <= int(budget) + 1
+    assert child_cpu_limit() is None
+
+
+def test_deferred_signals_wait_for_the_block():
+    """The deadline is raised after the block instead of inside it."""
+
+    class Deadline(Exception):
+        """Raised by the alarm."""
+
+    def raise_deadline(_signum, _frame):
+        raise Deadline
+
+    previous = signal.signal(signal.SIGALRM, raise_deadline)
+    done = False
+    try:
+        with pytest.raises(Deadline):
+            with deferred_signals(signal.SIGALRM):
+                signal.setitimer(signal.ITIMER_REAL, 0.01)
+                time.sleep(0.1)
+                done = True
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+    assert done
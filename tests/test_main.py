@@ -0,0 +1,47 @@
+import asyncio
+import os
+import signal
+
+from aiogram import Bot, Dispatcher, executor
+from aiogram.utils.executor import Executor
+
+import main
+from bot import db, setup
+
+
+def test_sigterm_drains_queue(monkeypatch):
+    """SIGTERM stops polling and runs `stop_queue` of the shutdown."""
+
+    stopped = []
+
+    async def noop(*_args, **_kwargs):
+        pass
+
+    async def poll(*_args, **_kwargs):
+        await asyncio.sleep(10)
+
+    async def stop_queue(bot):
+        stopped.append(bot)
+
+    async def on_startup(_dp):
+        asyncio.get_running_loop().call_later(0.1, os.kill, os.getpid(), signal.SIGTERM)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot = Bot(token="1:test")
+    dp = Dispatcher(bot)
+    monkeypatch.setattr(Executor, "_welcome", noop)
+    monkeypatch.setattr(dp, "start_polling", poll)
+    monkeypatch.setattr(bot, "set_my_commands", noop)
+    monkeypatch.setattr(setup, "stop_queue", stop_queue)
+    monkeypatch.setattr(db, "close", lambda: None)
+
+    try:
+        main.stop_on_sigterm(loop)
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=setup.on_shutdown)
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert stopped == [bot]
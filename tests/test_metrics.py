@@ -0,0 +1,32 @@
+from bot.utils import u_metrics
+from bot.utils.u_metrics import Histogram, format_labels
+
+
+def test_format_labels():
+    """Labels are formatted in their order in the exposition format."""
+
+    assert format_labels((), ()) == ""
+    assert format_labels(("stage", "code"), ("render", 1)) == '{stage="render",code="1"}'
+
+
+def test_format_labels_escapes_values():
+    """Quotes, backslashes and newlines of values are escaped."""
+
+    assert format_labels(("name",), ('a"b\\c\nd',)) == '{name="a\\"b\\\\c\\nd"}'
+
+
+def test_histogram_samples(monkeypatch):
+    """Buckets are cumulative and followed by the sum and the count."""
+
+    monkeypatch.setattr(u_metrics, "REGISTRY", [])
+    histogram = Histogram("test_seconds", "Test histogram.", ("stage",), buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value, stage="render")
+
+    assert histogram.samples() == [
+        'test_seconds_bucket{stage="render",le="1"} 1',
+        'test_seconds_bucket{stage="render",le="5"} 2',
+        'test_seconds_bucket{stage="render",le="+Inf"} 3',
+        'test_seconds_sum{stage="render"} 12.5',
+        'test_seconds_count{stage="render"} 3',
+    ]
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.utils import u_pool
+from bot.utils.u_exceptions import RenderTimeout
+from bot.utils.u_pool import RenderPool
+
+
+@pytest.fixture(name="pool")
+def fixture_pool(monkeypatch):
+    """Pool of one worker with short grace after the deadline."""
+
+    monkeypatch.setattr(u_pool, "GRACE", 0.5)
+    pool = RenderPool(workers=1)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def test_deadline_starts_when_worker_takes_job(pool):
+    """The job waiting for a busy worker isn't timed out by the wait."""
+
+    async def run():
+        # The second job waits for the worker longer than its deadline and grace
+        return await asyncio.gather(
+            pool.run(time.sleep, 1, timeout=1.2),
+            pool.run(time.sleep, 1, timeout=1.2),
+        )
+
+    assert asyncio.run(run()) == [None, None]
+
+
+def test_job_is_interrupted_by_deadline(pool):
+    """The worker is interrupted by the deadline."""
+
+    async def run():
+        await pool.run(time.sleep, 5, timeout=0.5)
+
+    with pytest.raises(RenderTimeout):
+        asyncio.run(run())
+
+
+def test_jobs_share_deadline(pool):
+    """The job waiting for a busy worker gets the time left till the shared deadline."""
+
+    async def run():
+        await pool.run(time.sleep, 0)  # The worker is started
+        deadline = time.monotonic() + 1.5
+        return await asyncio.gather(
+            pool.run(time.sleep, 1, deadline=deadline),
+            pool.run(time.sleep, 1, deadline=deadline),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert isinstance(second, RenderTimeout)
+
+
+def test_job_after_deadline_is_not_run(pool):
+    """The job taken after the deadline is timed out at once."""
+
+    with pytest.raises(RenderTimeout):
+        asyncio.run(pool.run(time.sleep, 5, deadline=time.monotonic() - 1))
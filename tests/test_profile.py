@@ -0,0 +1,60 @@
+import pytest
+
+from bot.utils.u_exceptions import OutputTooBig
+from bot.utils.u_profile import (
+    MAX_BITRATE,
+    MIN_BITRATE,
+    TAGS_SIZE,
+    UPLOAD_LIMIT,
+    get_bitrate,
+    predict_size,
+)
+
+SPEED = 0.75
+
+
+def test_predict_size():
+    """The size is predicted by the bitrate and the slowed duration."""
+
+    assert predict_size(128, duration=175, speed=1) == 128 * 1000 // 8 * 180 + TAGS_SIZE
+
+
+@pytest.mark.parametrize(
+    "source, duration, expected",
+    [
+        (128, 180, 128),
+        (125, 180, 128),  # VBR source slightly below the standard bitrate
+        (140, 180, 160),
+        (320, 180, 320),
+        (1411, 180, MAX_BITRATE),
+        (0, 180, MAX_BITRATE),
+    ],
+)
+def test_get_bitrate_keeps_source_quality(source, duration, expected):
+    """The output keeps the standard bitrate of the source."""
+
+    assert get_bitrate(source, duration, SPEED) == expected
+
+
+@pytest.mark.parametrize("source, duration", [(48, 180), (56, 120), (32, 60)])
+def test_get_bitrate_of_low_bitrate_source(source, duration):
+    """Sources below the minimum are rendered at the minimum bitrate."""
+
+    assert get_bitrate(source, duration, SPEED) == MIN_BITRATE
+
+
+def test_get_bitrate_fits_upload_limit():
+    """Long audio gets the highest bitrate which fits the upload limit."""
+
+    duration = 3600
+    bitrate = get_bitrate(320, duration, SPEED)
+
+    assert MIN_BITRATE <= bitrate < 320
+    assert predict_size(bitrate, duration, SPEED) <= UPLOAD_LIMIT
+
+
+def test_get_bitrate_raises_if_nothing_fits():
+    """OutputTooBig is raised if even the minimum bitrate doesn't fit."""
+
+    with pytest.raises(OutputTooBig):
+        get_bitrate(48, 6 * 3600, SPEED)
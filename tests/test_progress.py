@@ -0,0 +1,46 @@
+import asyncio
+
+from aiogram.utils.exceptions import RetryAfter
+
+from bot.utils import u_progress
+from bot.utils.u_progress import MessageEditor
+
+
+class FloodedMessage:
+    """Status message whose first edit is rejected by the flood control."""
+
+    def __init__(self) -> None:
+        self.chat = type("Chat", (), {"id": 42})()
+        self.message_id = 7
+        self.texts: list[str] = []
+        self.flooded = True
+
+    async def edit_text(self, text: str, reply_markup=None) -> None:
+        """Raises RetryAfter once, then records the text."""
+
+        del reply_markup
+        if self.flooded:
+            self.flooded = False
+            raise RetryAfter(0)
+        self.texts.append(text)
+
+
+def test_edit_is_sent_after_retry(monkeypatch):
+    """The text rejected by the flood control is sent after the delay."""
+
+    monkeypatch.setattr(u_progress, "TICK", 0.05)
+    message = FloodedMessage()
+    editor = MessageEditor(interval=0)
+
+    async def run() -> None:
+        editor.start()
+        editor.update(message, "50%")
+        await asyncio.sleep(0.08)
+        # The same text is still pending, it isn't taken for sent
+        editor.update(message, "50%")
+        await asyncio.sleep(0.1)
+        editor.stop()
+
+    asyncio.run(run())
+
+    assert message.texts == ["50%"]
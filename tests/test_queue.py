@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+from aiogram import types
+
+from bot.utils.u_queue import LANE_SPAN, Job, Queue, fair_score, on_drop, task, waiter_data
+
+
+def test_fair_score_starts_after_previous_job():
+    """The job of the busy user starts after its previous job."""
+
+    score, finish = fair_score(now=100, finish=150, lane=1, cost=10)
+
+    assert finish == 160
+    assert score == LANE_SPAN + 160
+
+
+def test_fair_score_starts_now_for_idle_user():
+    """The job of the idle user starts now."""
+
+    score, finish = fair_score(now=100, finish=50, lane=1, cost=10)
+
+    assert finish == 110
+    assert score == LANE_SPAN + 110
+
+
+def test_fair_score_serves_users_by_turns():
+    """The job of another user gets ahead of the second job of the first one."""
+
+    # Three jobs of one user and one job of another user enqueued at once
+    finish = 0.0
+    scores = []
+    for _ in range(3):
+        score, finish = fair_score(now=0, finish=finish, lane=1, cost=60)
+        scores.append(score)
+    other, _ = fair_score(now=0, finish=0, lane=1, cost=60)
+
+    assert scores[0] <= other < scores[1]
+
+
+def test_fair_score_orders_lanes_first():
+    """Jobs of the higher lane go first regardless of their cost."""
+
+    admin, _ = fair_score(now=0, finish=1e6, lane=0, cost=1e4)
+    user, _ = fair_score(now=0, finish=0, lane=1, cost=0)
+
+    assert admin < user
+
+
+def test_waiter_keeps_ids_only():
+    """The waiter is restored from ids without the audio."""
+
+    message = types.Message.to_object(
+        {
+            "message_id": 7,
+            "date": 0,
+            "chat": {"id": 42, "type": "private", "first_name": "Ann"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Ann"},
+            "audio": {"file_id": "f", "file_unique_id": "u", "duration": 180},
+        }
+    )
+
+    waiter = types.Message.to_object(json.loads(json.dumps(waiter_data(message))))
+
+    assert (waiter.message_id, waiter.chat.id, waiter.from_user.id) == (7, 42, 42)
+    assert waiter.audio is None
+
+
+def test_dropped_job_runs_its_drop_handler():
+    """The drop handler of the task gets the arguments of the dropped job."""
+
+    dropped = []
+
+    @task
+    async def render(_name: str, _count: int) -> None:
+        pass
+
+    @on_drop(render)
+    async def forget(name: str, count: int) -> None:
+        dropped.append((name, count))
+
+    job = Job.loads(Job.create(render, "tune", 2).dumps())
+    asyncio.run(job.drop_coro())
+
+    assert dropped == [("tune", 2)]
+    assert Job.loads(Job.create(fair_render, 1).dumps()).drop_coro() is None
+
+
+
+def test_result_keeps_uploaded_audio():
+    """The result published by a worker is run by the Bot with the uploaded file id."""
+
+    saved = []
+
+    @task
+    async def save(uploaded: types.Message, fingerprint: int) -> None:
+        saved.append((uploaded.chat.id, uploaded.message_id, uploaded.audio.file_id, fingerprint))
+
+    uploaded = types.Message.to_object(
+        {
+            "message_id": 8,
+            "date": 0,
+            "chat": {"id": 42, "type": "private", "first_name": "Ann"},
+            "audio": {"file_id": "slowed", "file_unique_id": "s", "duration": 240},
+            "caption": "@bot",
+        }
+    )
+
+    asyncio.run(Queue().run_result(Job.loads(Job.create(save, uploaded, 5).dumps())))
+
+    assert saved == [(42, 8, "slowed", 5)]
+
+
+@task
+async def fair_render(_count: int) -> None:
+    """Task without drop handler."""
@@ -0,0 +1,11 @@
+from bot.utils.u_segments import split
+
+
+def test_split_covers_source():
+    """Segments start at the source start and the last one runs till the end."""
+
+    segments, overlap = split(44100 * 600, 44100, 0.75, 4)
+    assert len(segments) == 4
+    assert segments[0][0] == 0 and segments[0][2] == 0
+    assert segments[-1][1] == 0 and segments[-1][3] == 0
+    assert overlap > 0
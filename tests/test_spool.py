@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+from bot.utils.u_spool import Spool
+
+
+def start(spool: Spool) -> None:
+    """Starts the spool without the sweeper."""
+
+    asyncio.run(spool.start())
+
+
+def write(path: str) -> str:
+    """Writes a small file and returns its path."""
+
+    with open(path, "wb") as file:
+        file.write(b"audio")
+    return path
+
+
+def test_spool_keeps_files_of_other_processes(tmp_path):
+    """Directories of running processes are not reclaimed."""
+
+    first = Spool(str(tmp_path), sweep_interval=0)
+    start(first)
+    path = write(first.new_file())
+
+    second = Spool(str(tmp_path), sweep_interval=0)
+    start(second)
+
+    assert os.path.exists(path)
+    assert second.sweep(max_age=0) == 0
+    assert os.path.exists(path)
+
+    first.stop()
+    second.stop()
+    assert not os.listdir(tmp_path)
+
+
+def test_spool_reclaims_directory_of_exited_process(tmp_path):
+    """Unlocked directories of exited processes are removed."""
+
+    crashed = tmp_path / "crashed"
+    crashed.mkdir()
+    write(str(crashed / ".lock"))
+    write(str(crashed / "job.mp3"))
+    write(str(crashed / "job_slow.mp3"))
+
+    spool = Spool(str(tmp_path), sweep_interval=0)
+    start(spool)
+
+    assert spool.reclaim() == 0
+    assert os.listdir(tmp_path) == [os.path.basename(spool.directory)]
+    spool.stop()
+
+
+def test_spool_sweeps_only_inactive_files(tmp_path):
+    """The sweeper keeps files of running jobs."""
+
+    spool = Spool(str(tmp_path), sweep_interval=0)
+    start(spool)
+    active = write(spool.new_file())
+    output = write(active[:-4] + "_slow.mp3")
+    orphan = write(spool.new_file())
+    spool.remove(orphan)
+    orphan = write(orphan)
+
+    assert spool.sweep(max_age=0) == 1
+    assert os.path.exists(active) and os.path.exists(output)
+    assert not os.path.exists(orphan)
+    spool.stop()
+
+
+def test_spool_reclaims_stale_staging_directory(tmp_path):
+    """Old unlocked staging directories are removed, new ones are kept."""
+
+    stale = tmp_path / ".stale"
+    stale.mkdir()
+    write(str(stale / "job.mp3"))
+    os.utime(stale, (0, 0))
+    starting = tmp_path / ".starting"
+    starting.mkdir()
+
+    spool = Spool(str(tmp_path), sweep_interval=0)
+    start(spool)
+
+    assert not stale.exists()
+    assert starting.exists()
+    spool.stop()
@@ -0,0 +1,53 @@
+import asyncio
+import signal
+
+from aiogram import Bot
+
+from bot.config import config
+from bot.setup import start_queue, stop_queue
+from bot.utils.u_brand import brand
+from bot.utils.u_logger import get_logger
+from bot.utils.u_metrics import MetricsBot, MetricsServer
+from bot.utils.u_pool import render_pool
+
+LOG = get_logger()
+
+# The Bot serves metrics on APP_PORT, workers on the same node need another port
+metrics_server = MetricsServer(config.APP_HOST, config.METRICS_WORKER_PORT)
+
+
+async def run():
+    """Runs jobs of the queue until SIGINT or SIGTERM."""
+
+    bot = MetricsBot(token=config.BOT_TOKEN, parse_mode="HTML")
+    Bot.set_current(bot)
+
+    LOG.info("Execute startup Worker functions...")
+    await brand.refresh(bot)
+    if config.METRICS and config.METRICS_WORKER_PORT:
+        await metrics_server.start()
+    await start_queue(bot, render_pool.workers)
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    await stopped.wait()
+
+    LOG.info("Execute shutdown Worker functions...")
+    await stop_queue(bot)
+    await metrics_server.stop()
+    await (await bot.get_session()).close()
+
+
+def main():
+    """
+    Render worker runner. It runs jobs queued by the Bot without polling updates.
+    Results are saved to the database by the Bot, so workers don't use `DATA_DIR`.
+    """
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()